@@ -0,0 +1,222 @@
+# -*- coding: utf-8 -*-
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution.
+
+"""Processing of the changes of a database by a pool of workers.
+
+A `ChangesProcessor` reads the changes feed of a database in batches, fetches
+the changed documents of every batch using a single request, and calls a
+function with every change on a pool of threads or processes:
+
+>>> from couchdb.client import Server
+>>> server = Server()
+>>> db = server.create('python-tests')
+>>> db['johndoe'] = dict(type='Person', name='John Doe')
+>>> db['maryjane'] = dict(type='Person', name='Mary Jane')
+>>> def get_name(change):
+...     return change['doc']['name']
+>>> def print_names(changes, names):
+...     print names
+>>> processor = ChangesProcessor(db, get_name, on_batch=print_names,
+...                              checkpoint='names')
+>>> processor.run() == db.info()['update_seq']
+[u'John Doe', u'Mary Jane']
+True
+
+Only the changes made since the checkpoint are processed by the next run:
+
+>>> db['janedoe'] = dict(type='Person', name='Jane Doe')
+>>> ChangesProcessor(db, get_name, on_batch=print_names,
+...                  checkpoint='names').run() == db.info()['update_seq']
+[u'Jane Doe']
+True
+
+>>> del server['python-tests']
+"""
+
+import multiprocessing
+from Queue import Full, Queue
+try:
+    from threading import Event
+except ImportError:
+    from dummy_threading import Event
+
+from couchdb import util
+
+__all__ = ['ChangesProcessor']
+__docformat__ = 'restructuredtext en'
+
+
+class ChangesProcessor(object):
+    """Call a function with every change of a database, together with the
+    current revision of the changed document, using a pool of workers.
+
+    The changes are read in batches of up to `batch_size`. The documents of a
+    batch are fetched from ``_all_docs`` using a single request, which is
+    issued while the previous batch is being processed, and stored as the
+    ``doc`` item of the change (`None` for deleted documents). The changes of
+    a batch are then passed to `callback` concurrently, on a pool of
+    `workers` threads, or processes if `processes` is true. In the latter
+    case, `callback` must be picklable, i.e. a function defined at the top
+    level of a module, and the changes are processed without the overhead
+    of the global interpreter lock.
+
+    A batch is complete when `callback` has returned for all of its changes;
+    `on_batch`, if given, is then called in the calling thread with the list
+    of changes and the list of return values, e.g. to save the results in a
+    single request. If `checkpoint` is given, the sequence of the last change
+    of the completed batch is then saved in the ``_local/<checkpoint>``
+    document of the database, and the next processor using the same
+    checkpoint starts after it. As the checkpoint is only saved once a batch
+    has been completely processed, every change is processed at least once
+    even if the processing is interrupted. An exception raised by `callback`
+    or `on_batch` stops the processing.
+
+    :param db: the `Database` whose changes are processed
+    :param callback: the function called with every change
+    :param on_batch: a function called with the changes and the return values
+                     of `callback` for every completed batch
+    :param batch_size: the maximum number of changes per batch
+    :param workers: the number of threads or processes calling `callback`
+    :param processes: whether to call `callback` in worker processes instead
+                      of threads
+    :param checkpoint: the name of the ``_local`` document storing the
+                       sequence of the last processed change, or `None`
+    :param since: the sequence to start after; by default the one stored in
+                  the checkpoint document, or the start of the feed
+    :param options: optional query string parameters for the changes feed,
+                    e.g. filter
+    :since: 0.9
+    """
+
+    def __init__(self, db, callback, on_batch=None, batch_size=100, workers=4,
+                 processes=False, checkpoint=None, since=None, **options):
+        self.db = db
+        self.callback = callback
+        self.on_batch = on_batch
+        self.batch_size = batch_size
+        self.workers = workers
+        self.processes = processes
+        self.checkpoint = checkpoint
+        self.since = since
+        self.options = options
+        self.last_seq = None
+        self.changes_processed = self.batches = 0
+        self._follower = None
+        self._stopped = False
+
+    def run(self, continuous=False, batch_timeout=1, **options):
+        """Process the changes of the database.
+
+        :param continuous: if true, keep following the changes feed until
+                           `stop` is called; otherwise return once all the
+                           changes made so far have been processed
+        :param batch_timeout: when following the feed, the number of seconds
+                              after which a batch is processed even if it is
+                              not full
+        :param options: further arguments for `Database.follow` when
+                        following the feed
+        :return: the sequence of the last processed change
+        """
+        self._stopped = False
+        doc = None
+        if self.checkpoint is not None:
+            doc = self.db.get('_local/' + self.checkpoint) or \
+                  {'_id': '_local/' + self.checkpoint}
+        since = self.since
+        if since is None:
+            since = doc is not None and doc.get('last_seq') or 0
+        self.last_seq = since
+
+        if continuous:
+            options.update(self.options)
+            self._follower = self.db.follow(since=since,
+                                            batch_size=self.batch_size,
+                                            batch_timeout=batch_timeout,
+                                            **options)
+            batches = iter(self._follower)
+        else:
+            batches = self._read_changes(since)
+
+        # Start the worker processes before any other thread
+        if self.processes:
+            pool = multiprocessing.Pool(self.workers)
+        else:
+            pool = util.WorkerPool(self.workers)
+        # The documents of the next batch are fetched by a background thread
+        # while the current batch is being processed
+        queue = Queue(1)
+        stop = Event()
+        reader = util.WorkerPool(1)
+        read = reader.submit(self._read, batches, queue, stop)
+        try:
+            while not self._stopped:
+                changes = queue.get()
+                if changes is None:
+                    read.get()
+                    break
+                if self.processes:
+                    results = pool.map(self.callback, changes)
+                else:
+                    results = list(pool.imap(self.callback, changes))
+                if self.on_batch is not None:
+                    self.on_batch(changes, results)
+                self.last_seq = changes[-1]['seq']
+                self.changes_processed += len(changes)
+                self.batches += 1
+                if doc is not None:
+                    doc['last_seq'] = self.last_seq
+                    self.db.save(doc)
+        finally:
+            stop.set()
+            if self._follower is not None:
+                self._follower.stop()
+                self._follower = None
+            reader.close()
+            pool.close()
+            if self.processes:
+                pool.join()
+        return self.last_seq
+
+    def stop(self):
+        """Stop processing once the current batch is complete."""
+        self._stopped = True
+        if self._follower is not None:
+            self._follower.stop()
+
+    def _read(self, batches, queue, stop):
+        try:
+            for changes in batches:
+                if not self._put(queue, self._fetch(changes), stop):
+                    break
+        finally:
+            self._put(queue, None, stop)
+
+    def _put(self, queue, item, stop):
+        # Give up when the processing has been stopped, so that the reader
+        # does not block forever
+        while not stop.isSet():
+            try:
+                queue.put(item, timeout=0.1)
+                return True
+            except Full:
+                pass
+        return False
+
+    def _read_changes(self, since):
+        while not self._stopped:
+            data = self.db.changes(since=since, limit=self.batch_size,
+                                   **self.options)
+            if data['results']:
+                yield data['results']
+            if len(data['results']) < self.batch_size:
+                break
+            since = data['last_seq']
+
+    def _fetch(self, changes):
+        docs = self.db.get_many([change['id'] for change in changes],
+                                chunk_size=len(changes))
+        for change, doc in zip(changes, docs):
+            change['doc'] = doc
+        return changes
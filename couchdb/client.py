@@ -23,6 +23,8 @@ False
 >>> del server['python-tests']
 """
 
+from collections import deque
+import httplib
 import mimetypes
 import os
 from types import FunctionType
@@ -30,12 +32,19 @@ from inspect import getsource
 from textwrap import dedent
 from couchdb.mapping import Document
 import re
+import socket
+import time
+try:
+    from threading import Lock
+except ImportError:
+    from dummy_threading import Lock
 import warnings
 from schematics.validation import validate_instance
 
-from couchdb import http, json
+from couchdb import http, json, util
 
-__all__ = ['Server', 'Database', 'Document', 'ViewResults', 'Row']
+__all__ = ['Server', 'Database', 'BulkWriter', 'ChangesFollower', 'Document',
+           'ViewResults', 'Row']
 __docformat__ = 'restructuredtext en'
 
 
@@ -299,7 +308,7 @@ class Database(object):
 
     def __iter__(self):
         """Return the IDs of all documents in the database."""
-        return iter([item.id for item in self.view('_all_docs')])
+        return self.iter_ids()
 
     def __len__(self):
         """Return the number of documents in the database."""
@@ -554,6 +563,79 @@ class Database(object):
         else:
             return data
 
+    def get_many(self, ids, chunk_size=100, workers=None, **options):
+        """Return the documents with the specified IDs.
+
+        The documents are fetched from ``_all_docs`` using a single request
+        for every `chunk_size` IDs, instead of one request per document.
+
+        >>> server = Server()
+        >>> db = server.create('python-tests')
+        >>> db['johndoe'] = dict(type='Person', name='John Doe')
+        >>> db['maryjane'] = dict(type='Person', name='Mary Jane')
+        >>> for doc in db.get_many(['maryjane', 'missing', 'johndoe']):
+        ...     print doc and doc['name']
+        Mary Jane
+        None
+        John Doe
+
+        >>> del server['python-tests']
+
+        :param ids: an iterable over document IDs
+        :param chunk_size: the maximum number of documents fetched per request
+        :param workers: if greater than 1, fetch this many chunks concurrently
+                        using a `util.WorkerPool`; the threads share the
+                        connection pool of the database's session
+        :param options: optional query string parameters, e.g. conflicts=True
+        :return: an iterator over `Document` objects in the order of `ids`,
+                 with `None` for documents that do not exist or are deleted
+        :since: 0.9
+        """
+        options['include_docs'] = True
+        resource = self.resource('_all_docs')
+
+        def _fetch(chunk):
+            opts = options.copy()
+            opts['keys'] = chunk
+            _, _, data = _call_viewlike(resource, opts)
+            return data['rows']
+
+        if workers is not None and workers > 1:
+            pool = util.WorkerPool(workers)
+            results = pool.imap(_fetch, _chunks(ids, chunk_size))
+        else:
+            pool = None
+            results = (_fetch(chunk) for chunk in _chunks(ids, chunk_size))
+        try:
+            for rows in results:
+                for row in rows:
+                    doc = row.get('doc')
+                    if doc is None:
+                        yield None
+                    else:
+                        yield Document(doc)
+        finally:
+            if pool is not None:
+                pool.close()
+
+    def iter_ids(self, batch_size=1000, prefetch=False):
+        """Iterate over the IDs of all documents in the database.
+
+        The IDs are requested from ``_all_docs`` in batches while iterating,
+        so that memory use does not depend on the number of documents.
+
+        :param batch_size: the number of IDs requested at a time
+        :param prefetch: whether to request the next batch in a background
+                         thread while the current one is being consumed
+        :return: an iterator over document IDs
+        :since: 0.9
+        """
+        pages = self.view('_all_docs').iterpages(page_size=batch_size,
+                                                 prefetch=prefetch)
+        for page in pages:
+            for row in page:
+                yield row.id
+
     def revisions(self, id, **options):
         """Return all available revisions of the given document.
 
@@ -575,6 +657,20 @@ class Database(object):
                 return
             yield revision
 
+    def revs_diff(self, revs):
+        """Return which of the given document revisions are missing from the
+        database.
+
+        :param revs: a dictionary mapping document IDs to lists of revisions
+        :return: a dictionary mapping the IDs of the documents with missing
+                 revisions to dictionaries with a ``missing`` list of those
+                 revisions
+        :rtype: ``dict``
+        :since: 0.9
+        """
+        _, _, data = self.resource.post_json('_revs_diff', body=revs)
+        return data
+
     def info(self, ddoc=None):
         """Return information about the database or design document as a
         dictionary.
@@ -771,23 +867,46 @@ class Database(object):
         content.update(docs=docs)
         _, _, data = self.resource.post_json('_bulk_docs', body=content)
 
-        results = []
-        for idx, result in enumerate(data):
-            if 'error' in result:
-                if result['error'] == 'conflict':
-                    exc_type = http.ResourceConflict
-                else:
-                    # XXX: Any other error types mappable to exceptions here?
-                    exc_type = http.ServerError
-                results.append((False, result['id'],
-                                exc_type(result['reason'])))
-            else:
-                doc = documents[idx]
-                if isinstance(doc, dict): # XXX: Is this a good idea??
-                    doc.update({'_id': result['id'], '_rev': result['rev']})
-                results.append((True, result['id'], result['rev']))
+        return [_bulk_result(documents[idx], result)
+                for idx, result in enumerate(data)]
+
+    def bulk_writer(self, batch_size=1000, max_bytes=None, workers=0,
+                    max_pending=None, callback=None, **options):
+        """Return a `BulkWriter` that saves documents added one at a time
+        using batched bulk updates.
 
-        return results
+        >>> server = Server()
+        >>> db = server.create('python-tests')
+        >>> with db.bulk_writer(batch_size=2) as writer:
+        ...     for name in ('John Doe', 'Mary Jane', 'Gotham City'):
+        ...         writer.add({'name': name})
+        >>> len(db), writer.batches
+        (3, 2)
+
+        >>> del server['python-tests']
+
+        :param batch_size: the maximum number of documents per request
+        :param max_bytes: the maximum size of the JSON-encoded documents per
+                          request, or `None` for no limit
+        :param workers: the number of threads sending batches in the
+                        background, or 0 to send them from the calling thread
+        :param max_pending: the maximum number of batches waiting for a
+                            worker thread before `BulkWriter.add` blocks, by
+                            default the number of workers
+        :param callback: a callable invoked as ``callback(doc, result)`` for
+                         every written document, where ``result`` is a
+                         ``(success, docid, rev_or_exc)`` tuple as returned by
+                         `update`; note that it is called from the worker
+                         threads if `workers` is not 0
+        :param options: optional args for the bulk update, e.g.
+                        all_or_nothing=True
+        :return: the bulk writer
+        :rtype: `BulkWriter`
+        :since: 0.9
+        """
+        return BulkWriter(self, batch_size=batch_size, max_bytes=max_bytes,
+                          workers=workers, max_pending=max_pending,
+                          callback=callback, **options)
 
     def purge(self, docs):
         """Perform purging (complete removing) of the given documents.
@@ -890,27 +1009,397 @@ class Database(object):
 
     def _changes(self, **opts):
         _, _, data = self.resource.get('_changes', **opts)
-        lines = data.iterchunks()
-        for ln in lines:
-            if not ln: # skip heartbeats
+        lines = data.iterlines()
+        if opts.get('feed') == 'eventsource':
+            changes = _eventsource_changes(lines)
+        else:
+            changes = _continuous_changes(lines)
+        for change in changes:
+            if change is None: # skip heartbeats
                 continue
-            doc = json.decode(ln)
-            if 'last_seq' in doc: # consume the rest of the response if this
-                for ln in lines:  # was the last line, allows conn reuse
-                    pass
-            yield doc
+            if 'last_seq' in change: # consume the rest of the response if
+                for ln in lines:     # this was the last line, allows conn
+                    pass             # reuse
+            yield change
 
     def changes(self, **opts):
         """Retrieve a changes feed from the database.
 
+        With the ``normal`` and ``longpoll`` feeds, the response is returned
+        as a dict with the ``results`` and ``last_seq`` items. With the
+        ``continuous`` and ``eventsource`` feeds, an iterator is returned
+        that yields each change notification as soon as it is received.
+
         :param opts: optional query string parameters
         :return: an iterable over change notification dicts
         """
-        if opts.get('feed') == 'continuous':
+        if opts.get('feed') in ('continuous', 'eventsource'):
             return self._changes(**opts)
         _, _, data = self.resource.get_json('_changes', **opts)
         return data
 
+    def follow(self, since=0, batch_size=None, batch_timeout=None, **options):
+        """Follow the continuous changes feed of the database, reconnecting
+        when the connection fails or times out.
+
+        >>> server = Server()
+        >>> db = server.create('python-tests')
+        >>> db['johndoe'] = dict(type='Person', name='John Doe')
+        >>> follower = db.follow()
+        >>> for change in follower:
+        ...     print change['id']
+        ...     follower.stop()
+        johndoe
+
+        >>> del server['python-tests']
+
+        :param since: the sequence to start after
+        :param batch_size: if given, yield lists of up to this many changes
+                           instead of single changes
+        :param batch_timeout: the number of seconds after which a batch is
+                              yielded even if it is not full
+        :param options: further arguments of `ChangesFollower`, and query
+                        string parameters for the feed
+        :return: the changes follower
+        :rtype: `ChangesFollower`
+        :since: 0.9
+        """
+        return ChangesFollower(self, since=since, batch_size=batch_size,
+                               batch_timeout=batch_timeout, **options)
+
+
+class BulkWriter(object):
+    """Buffer documents and save them using ``_bulk_docs`` requests once
+    enough of them have been added.
+
+    Use `Database.bulk_writer` to create instances. Any remaining documents
+    are written when the writer is closed, which happens automatically when it
+    is used as a context manager.
+
+    The number of successfully written documents, failed documents and sent
+    requests are available as the `written`, `failed` and `batches`
+    attributes.
+    """
+
+    def __init__(self, db, batch_size=1000, max_bytes=None, workers=0,
+                 max_pending=None, callback=None, **options):
+        self.db = db
+        self.batch_size = batch_size
+        self.max_bytes = max_bytes
+        self.callback = callback
+        self.options = options
+        self.written = self.failed = self.batches = 0
+        self._docs = []
+        self._size = 0
+        self._lock = Lock()
+        self._pending = deque()
+        self._pool = None
+        if workers:
+            self._pool = util.WorkerPool(workers,
+                                         max_pending=max_pending or workers)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self._shutdown()
+
+    def add(self, doc):
+        """Add a document to the current batch, sending the batch if it is
+        full.
+
+        :param doc: a dictionary or `Document` object, or an object providing
+                    an ``items()`` method
+        """
+        if not isinstance(doc, dict):
+            if hasattr(doc, 'items'):
+                doc = dict(doc.items())
+            else:
+                raise TypeError('expected dict, got %s' % type(doc))
+        encoded = json.encode_bytes(doc)
+        if self.max_bytes is not None and self._docs and \
+                self._size + len(encoded) > self.max_bytes:
+            self.flush()
+        self._docs.append((doc, encoded))
+        self._size += len(encoded) + 1
+        if len(self._docs) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """Send the current batch."""
+        self._check_pending()
+        if not self._docs:
+            return
+        docs, self._docs, self._size = self._docs, [], 0
+        if self._pool is None:
+            self._write(docs)
+        else:
+            self._pending.append(self._pool.submit(self._write, docs))
+
+    def wait(self):
+        """Send the current batch and wait for all pending requests to
+        complete.
+        """
+        self.flush()
+        while self._pending:
+            self._pending.popleft().get()
+
+    def close(self):
+        """Send the remaining documents and wait for all pending requests to
+        complete.
+        """
+        try:
+            self.wait()
+        finally:
+            self._shutdown()
+
+    def _shutdown(self):
+        if self._pool is not None:
+            self._pool.close()
+            self._pool = None
+
+    def _check_pending(self):
+        # Re-raise errors of requests sent in the background
+        while self._pending and self._pending[0].ready():
+            self._pending.popleft().get()
+
+    def _write(self, docs):
+        content = ['{"docs": [', ','.join([encoded for doc, encoded in docs]),
+                   ']']
+        for name, value in self.options.items():
+            content.append(', %s: %s' % (json.encode_bytes(name),
+                                         json.encode_bytes(value)))
+        content.append('}')
+        _, _, data = self.db.resource.post_json('_bulk_docs',
+                                                body=''.join(content),
+                                                headers={
+            'Content-Type': 'application/json'
+        })
+        if self.options.get('new_edits', True):
+            results = [(doc, result) for (doc, encoded), result
+                       in zip(docs, data)]
+        else:
+            # Only the documents that could not be saved are listed
+            errors = {}
+            for result in data:
+                errors.setdefault(result['id'], []).append(result)
+            results = []
+            for doc, encoded in docs:
+                result = errors.get(doc['_id'])
+                if result:
+                    results.append((doc, result.pop(0)))
+                else:
+                    results.append((doc, {'id': doc['_id'],
+                                          'rev': doc['_rev']}))
+        written = failed = 0
+        for doc, result in results:
+            result = _bulk_result(doc, result)
+            if result[0]:
+                written += 1
+            else:
+                failed += 1
+            if self.callback is not None:
+                self.callback(doc, result)
+        self._lock.acquire()
+        try:
+            self.written += written
+            self.failed += failed
+            self.batches += 1
+        finally:
+            self._lock.release()
+
+
+class ChangesFollower(object):
+    """Follow the changes feed of a database, reconnecting when the connection
+    fails.
+
+    Use `Database.follow` to create instances. Iterating over a follower
+    yields the change notifications (or lists of at most `batch_size` of them)
+    until `stop` is called. The sequence of the last change yielded is kept
+    as the `last_seq` attribute, so that it can be saved and passed as `since`
+    to a later follower.
+
+    The `feed` is either ``continuous``, ``eventsource``, or ``longpoll``,
+    which requests the changes again after every response and works through
+    proxies that buffer streaming responses. It is requested with heartbeats
+    every `heartbeat` milliseconds, and the connection is considered lost
+    when nothing has been received for `timeout` seconds. It is then
+    requested again, starting after the last change received, after a delay
+    that doubles with every consecutive failure from `retry_delay` up to
+    `max_retry_delay` seconds. After `max_retries` consecutive failures, the
+    error is raised.
+    """
+
+    def __init__(self, db, since=0, batch_size=None, batch_timeout=None,
+                 feed='continuous', heartbeat=10000, timeout=None,
+                 retry_delay=1, max_retry_delay=60, max_retries=None,
+                 **options):
+        if feed not in ('continuous', 'eventsource', 'longpoll'):
+            raise ValueError('unsupported feed %r' % feed)
+        if timeout is None:
+            timeout = heartbeat * 3 / 1000.0
+        # Use a separate session so that the timeout only applies to the feed
+        self.resource = http.Resource(db.resource.url,
+                                      http.Session(timeout=timeout))
+        self.resource.credentials = db.resource.credentials
+        self.resource.headers = db.resource.headers.copy()
+        self.db = db
+        self.last_seq = self._since = since
+        self.batch_size = batch_size
+        self.batch_timeout = batch_timeout
+        self.feed = feed
+        self.heartbeat = heartbeat
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.max_retries = max_retries
+        self.options = options
+        self.reconnects = 0
+        self._stopped = False
+        self._body = None # the streamed response being read
+
+    def __iter__(self):
+        if not self.batch_size:
+            for change in self._follow():
+                if change is not None:
+                    self.last_seq = change['seq']
+                    yield change
+            return
+
+        batch = []
+        for change in self._follow():
+            if change is not None:
+                if not batch:
+                    started = time.time()
+                batch.append(change)
+            if batch and (len(batch) >= self.batch_size or
+                          self.batch_timeout is not None and
+                          time.time() - started >= self.batch_timeout):
+                self.last_seq = batch[-1]['seq']
+                yield batch
+                batch = []
+        if batch:
+            self.last_seq = batch[-1]['seq']
+            yield batch
+
+    def stop(self):
+        """Stop following the feed once the next change or heartbeat has been
+        received.
+        """
+        self._stopped = True
+        self._discard()
+
+    def _discard(self):
+        # Close the connection of an unfinished response instead of leaving
+        # it checked out of the pool
+        body, self._body = self._body, None
+        if body is not None:
+            body.discard()
+
+    def _follow(self):
+        # Yield the changes, and None for every heartbeat
+        failures = 0
+        while not self._stopped:
+            try:
+                for change in self._read():
+                    failures = 0
+                    if change is None:
+                        yield None
+                    elif 'last_seq' in change: # the response has ended
+                        self._since = change['last_seq']
+                        yield None
+                    else:
+                        self._since = change['seq']
+                        yield change
+                    if self._stopped:
+                        self._discard()
+                        return
+            except (socket.error, httplib.HTTPException, http.ServerError), e:
+                self._discard()
+                if self._stopped:
+                    return
+                if isinstance(e, http.ServerError) and e.args[0][0] < 500:
+                    raise
+                failures += 1
+                if self.max_retries is not None and \
+                        failures > self.max_retries:
+                    raise
+                self.reconnects += 1
+                time.sleep(min(self.retry_delay * 2 ** (failures - 1),
+                               self.max_retry_delay))
+            except Exception:
+                self._discard()
+                if self._stopped: # the response was closed by stop()
+                    return
+                raise
+
+    def _read(self):
+        # Yield the changes of a single request, None for every heartbeat,
+        # and a dict with the last sequence at the end of the response
+        if self.feed == 'longpoll':
+            _, _, data = self.resource.get_json('_changes', feed='longpoll',
+                                                since=self._since,
+                                                heartbeat=self.heartbeat,
+                                                **self.options)
+            return data['results'] + [{'last_seq': data['last_seq']}]
+        _, _, data = self.resource.get('_changes', feed=self.feed,
+                                       since=self._since,
+                                       heartbeat=self.heartbeat,
+                                       **self.options)
+        if hasattr(data, 'discard'):
+            self._body = data
+        if self.feed == 'eventsource':
+            return _eventsource_changes(data.iterlines())
+        return _continuous_changes(data.iterlines())
+
+
+def _bulk_result(doc, result):
+    """Convert a row of a ``_bulk_docs`` response to a ``(success, docid,
+    rev_or_exc)`` tuple, updating the ID and revision of the document.
+    """
+    if 'error' in result:
+        if result['error'] == 'conflict':
+            exc_type = http.ResourceConflict
+        else:
+            # XXX: Any other error types mappable to exceptions here?
+            exc_type = http.ServerError
+        return False, result['id'], exc_type(result['reason'])
+    if isinstance(doc, dict): # XXX: Is this a good idea??
+        doc.update({'_id': result['id'], '_rev': result['rev']})
+    return True, result['id'], result['rev']
+
+
+def _continuous_changes(lines):
+    """Decode the lines of a ``continuous`` changes feed, yielding `None` for
+    heartbeats.
+    """
+    for line in lines:
+        if not line:
+            yield None
+        else:
+            yield json.decode(line)
+
+
+def _eventsource_changes(lines):
+    """Decode the events of an ``eventsource`` changes feed, yielding `None`
+    for heartbeats.
+    """
+    data = []
+    for line in lines:
+        if line.startswith('data:'):
+            value = line[5:]
+            if value.startswith(' '):
+                value = value[1:]
+            data.append(value)
+        elif not line:
+            if data:
+                yield json.decode('\n'.join(data))
+                data = []
+            else:
+                yield None
+
 
 def _doc_resource(base, doc_id):
     """Return the resource for the given document id.
@@ -922,6 +1411,18 @@ def _doc_resource(base, doc_id):
     return base(doc_id)
 
 
+def _chunks(iterable, size):
+    """Yield lists of up to `size` consecutive items of `iterable`."""
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
 def _path_from_name(name, type):
     """Expand a 'design/foo' style name to its full path as a list of
     segments.
@@ -980,6 +1481,9 @@ class View(object):
     def _exec(self, options):
         raise NotImplementedError
 
+    def _stream(self, options):
+        raise NotImplementedError
+
 
 class PermanentView(View):
     """Representation of a permanent view on the server."""
@@ -995,6 +1499,10 @@ class PermanentView(View):
         _, _, data = _call_viewlike(self.resource, options)
         return data
 
+    def _stream(self, options):
+        _, _, data = _call_viewlike(self.resource, options, stream=True)
+        return data
+
 
 class TemporaryView(View):
     """Representation of a temporary view."""
@@ -1017,14 +1525,20 @@ class TemporaryView(View):
                                self.reduce_fun)
 
     def _exec(self, options):
+        return self._post(self.resource.post_json, options)
+
+    def _stream(self, options):
+        return self._post(self.resource.post, options)
+
+    def _post(self, func, options):
         body = {'map': self.map_fun, 'language': self.language}
         if self.reduce_fun:
             body['reduce'] = self.reduce_fun
         if 'keys' in options:
             options = options.copy()
             body['keys'] = options.pop('keys')
-        content = json.encode(body).encode('utf-8')
-        _, _, data = self.resource.post_json(body=content, headers={
+        content = json.encode_bytes(body)
+        _, _, data = func(body=content, headers={
             'Content-Type': 'application/json'
         }, **_encode_view_options(options))
         return data
@@ -1043,15 +1557,129 @@ def _encode_view_options(options):
     return retval
 
 
-def _call_viewlike(resource, options):
+def _call_viewlike(resource, options, stream=False):
     """Call a resource that takes view-like options.
+
+    If `stream` is true, the response body is returned as a file-like object
+    instead of being decoded.
     """
     if 'keys' in options:
         options = options.copy()
         keys = {'keys': options.pop('keys')}
-        return resource.post_json(body=keys, **_encode_view_options(options))
+        if stream:
+            func = resource.post
+        else:
+            func = resource.post_json
+        return func(body=keys, **_encode_view_options(options))
     else:
-        return resource.get_json(**_encode_view_options(options))
+        if stream:
+            func = resource.get
+        else:
+            func = resource.get_json
+        return func(**_encode_view_options(options))
+
+
+_VIEW_ROWS_RE = re.compile(r'"rows"\s*:\s*\[')
+_VIEW_SEPARATOR_RE = re.compile(r'[\s,]*')
+_JSON_TOKEN_RE = re.compile(r'["{}\[\]]')
+_JSON_STRING_RE = re.compile(r'"[^"\\]*(?:\\.[^"\\]*)*"', re.DOTALL)
+
+
+def _iter_view_rows(fileobj, meta, chunk_size=http.CHUNK_SIZE):
+    """Incrementally parse a view response read from a file-like object.
+
+    Yields the decoded objects of the ``rows`` array one at a time, while
+    only buffering the current row. The other top-level members of the
+    response (such as ``total_rows`` and ``offset``) are stored in the `meta`
+    dictionary as soon as they have been read, that is, before the first row
+    is yielded for members preceding the rows.
+
+    >>> from StringIO import StringIO
+    >>> meta = {}
+    >>> body = StringIO('{"total_rows":2,"offset":0,"rows":[\\r\\n'
+    ...                 '{"id":"a","key":"a]}","value":{}},\\r\\n'
+    ...                 '{"id":"b","key":"b","value":[1]}\\r\\n]}')
+    >>> for row in _iter_view_rows(body, meta, chunk_size=7):
+    ...     print row['key'], meta['total_rows']
+    a]} 2
+    b 2
+    """
+    complete = False
+    buf = fileobj.read(chunk_size)
+    try:
+        # Everything up to the start of the rows array
+        while True:
+            match = _VIEW_ROWS_RE.search(buf)
+            if match is not None:
+                break
+            chunk = fileobj.read(chunk_size)
+            if not chunk:
+                # No rows at all, just decode whatever we got
+                complete = True
+                meta.update(json.decode(buf))
+                return
+            buf += chunk
+        head = buf[:match.start()].rstrip().rstrip(',')
+        meta.update(json.decode(head + '}'))
+
+        pos = match.end()
+        while True:
+            pos = _VIEW_SEPARATOR_RE.match(buf, pos).end()
+            if pos == len(buf):
+                chunk = fileobj.read(chunk_size)
+                if not chunk:
+                    raise ValueError('unexpected end of view response')
+                buf, pos = buf[pos:] + chunk, 0
+                continue
+            if buf[pos] == ']':
+                break
+
+            # Find the end of the row object by tracking the nesting depth,
+            # reading more data whenever the buffer ends in the middle of it
+            depth = 0
+            scan = pos
+            while True:
+                token = _JSON_TOKEN_RE.search(buf, scan)
+                if token is not None and token.group() == '"':
+                    string = _JSON_STRING_RE.match(buf, token.start())
+                    if string is not None:
+                        scan = string.end()
+                        continue
+                    token = None # incomplete string
+                if token is None:
+                    chunk = fileobj.read(chunk_size)
+                    if not chunk:
+                        raise ValueError('unexpected end of view response')
+                    buf, scan, pos = buf[pos:] + chunk, scan - pos, 0
+                    continue
+                scan = token.end()
+                if token.group() in '{[':
+                    depth += 1
+                else:
+                    depth -= 1
+                    if not depth:
+                        break
+            yield json.decode(buf[pos:scan])
+            pos = scan
+
+        # Whatever follows the rows array, e.g. update_seq
+        tail = [buf[pos + 1:]]
+        while True:
+            chunk = fileobj.read(chunk_size)
+            if not chunk:
+                break
+            tail.append(chunk)
+        complete = True
+        tail = ''.join(tail).strip().lstrip(',')
+        if tail != '}':
+            meta.update(json.decode('{' + tail))
+    finally:
+        if complete or not hasattr(fileobj, 'discard'):
+            fileobj.close()
+        else:
+            # Stopped early or failed: closing a streamed response would read
+            # the rest of it first
+            fileobj.discard()
 
 
 class ViewResults(object):
@@ -1103,6 +1731,7 @@ class ViewResults(object):
         self.view = view
         self.options = options
         self._rows = self._total_rows = self._offset = None
+        self._has_meta = False
 
     def __repr__(self):
         return '<%s %r %r>' % (type(self).__name__, self.view, self.options)
@@ -1125,12 +1754,129 @@ class ViewResults(object):
     def __len__(self):
         return len(self.rows)
 
+    def iterrows(self):
+        """Iterate over the rows of the view while they are being received.
+
+        Unlike iterating over the `ViewResults` object itself, this does not
+        keep the rows, so that memory use does not depend on the size of the
+        view. Every call makes a new request to the server.
+
+        The `total_rows` and `offset` properties become available without an
+        additional request as soon as the first row has been received.
+
+        :return: an iterator over the (wrapped) rows
+        """
+        wrapper = self.view.wrapper or Row
+        meta = {}
+        rows = _iter_view_rows(self.view._stream(self.options), meta)
+        for row in rows:
+            if not self._has_meta:
+                self._set_meta(meta)
+            yield wrapper(row)
+        self._set_meta(meta)
+
+    def iterpages(self, page_size=100, prefetch=False):
+        """Iterate over the rows of the view in pages of `page_size` rows.
+
+        Every page is requested separately, starting at the first row not
+        returned yet, which is identified by its key and document ID (using
+        the ``startkey`` and ``startkey_docid`` options) rather than by
+        skipping rows, so that requesting a page does not get slower the
+        further into the view it is. Only the rows with the same key and
+        document ID as the first row of the page that have already been
+        returned, e.g. when a document emits the same key several times, are
+        skipped.
+
+        >>> server = Server()
+        >>> db = server.create('python-tests')
+        >>> db['johndoe'] = dict(type='Person', name='John Doe')
+        >>> db['maryjane'] = dict(type='Person', name='Mary Jane')
+        >>> db['gotham'] = dict(type='City', name='Gotham City')
+        >>> for page in db.view('_all_docs').iterpages(page_size=2):
+        ...     print [row.id for row in page]
+        [u'gotham', u'johndoe']
+        [u'maryjane']
+
+        >>> del server['python-tests']
+
+        :param page_size: the number of rows per page
+        :param prefetch: whether to request the next page in a background
+                         thread while the current page is being processed
+        :return: an iterator over lists of (wrapped) rows
+        """
+        options = self.options.copy()
+        if 'keys' in options:
+            raise ValueError('views queried by keys cannot be paginated')
+        remaining = options.pop('limit', None)
+        wrapper = self.view.wrapper or Row
+
+        pool = None
+        if prefetch:
+            pool = util.WorkerPool(1)
+        try:
+            pending = None
+            start = None # the key and ID the current page starts at
+            skip = 0
+            while remaining is None or remaining > 0:
+                count = page_size
+                if remaining is not None:
+                    count = min(count, remaining)
+                options['limit'] = count + 1
+                if pending is not None:
+                    data = pending.get()
+                else:
+                    data = self.view._exec(options)
+                if not self._has_meta:
+                    self._set_meta(data)
+
+                # The additional row is the first one of the next page
+                rows = data['rows']
+                last = len(rows) <= count
+                if not last:
+                    following = rows[count]
+                    rows = rows[:count]
+                    # Skip the rows with the same key and ID as the first row
+                    # of the next page that are returned with this page
+                    following_start = following['key'], following.get('id')
+                    duplicates = 0
+                    for row in reversed(rows):
+                        if (row['key'], row.get('id')) != following_start:
+                            break
+                        duplicates += 1
+                    if duplicates == len(rows) and start == following_start:
+                        skip += duplicates
+                    else:
+                        skip = duplicates
+                    start = following_start
+                    for name in ('start_key', 'start_key_doc_id', 'skip'):
+                        options.pop(name, None)
+                    options['startkey'] = following['key']
+                    if 'id' in following:
+                        options['startkey_docid'] = following['id']
+                    if skip:
+                        options['skip'] = skip
+                    if remaining is not None:
+                        remaining -= count
+                    if pool is not None:
+                        pending = pool.submit(self.view._exec, options.copy())
+
+                yield [wrapper(row) for row in rows]
+                if last:
+                    break
+        finally:
+            if pool is not None:
+                pool.close()
+
     def _fetch(self):
         data = self.view._exec(self.options)
         wrapper = self.view.wrapper or Row
         self._rows = [wrapper(row) for row in data['rows']]
+        self._set_meta(data)
+
+    def _set_meta(self, data):
         self._total_rows = data.get('total_rows')
         self._offset = data.get('offset', 0)
+        self._has_meta = True
 
     @property
     def rows(self):
@@ -1150,7 +1896,7 @@ class ViewResults(object):
 
         :rtype: `int` or ``NoneType`` for reduce views
         """
-        if self._rows is None:
+        if not self._has_meta:
             self._fetch()
         return self._total_rows
 
@@ -1162,7 +1908,7 @@ class ViewResults(object):
 
         :rtype: `int`
         """
-        if self._rows is None:
+        if not self._has_meta:
             self._fetch()
         return self._offset
 
@@ -12,9 +12,11 @@ standard library.
 """
 
 from base64 import b64encode
-from datetime import datetime
 import errno
-from httplib import BadStatusLine, HTTPConnection, HTTPSConnection
+from httplib import BadStatusLine, HTTPConnection, HTTPMessage, \
+                    HTTPSConnection, IncompleteRead
+import os
+import select
 import socket
 import time
 try:
@@ -23,18 +25,18 @@ except ImportError:
     from StringIO import StringIO
 import sys
 try:
-    from threading import Lock
+    from threading import Condition, Lock, local
 except ImportError:
-    from dummy_threading import Lock
+    from dummy_threading import Condition, Lock, local
 import urllib
 from urlparse import urlsplit, urlunsplit
-from email.Utils import parsedate
+import warnings
 
 from couchdb import json
 
 __all__ = ['HTTPError', 'PreconditionFailed', 'ResourceNotFound',
            'ResourceConflict', 'ServerError', 'Unauthorized', 'RedirectLimit',
-           'Session', 'Resource']
+           'PoolTimeout', 'Session', 'Resource']
 __docformat__ = 'restructuredtext en'
 
 
@@ -163,42 +165,118 @@ class RedirectLimit(Exception):
     """
 
 
+class PoolTimeout(Exception):
+    """Exception raised when no connection to a host became available in the
+    connection pool within the configured wait timeout.
+    """
+
+
 CHUNK_SIZE = 1024 * 8
 
 class ResponseBody(object):
 
-    def __init__(self, resp, callback):
+    def __init__(self, resp, callback, discard_callback=None):
         self.resp = resp
         self.callback = callback
+        self.discard_callback = discard_callback
+
+    def __del__(self):
+        # A response that is neither fully read nor closed, e.g. the body of
+        # an abandoned continuous feed, must not keep its connection checked
+        # out of the pool
+        if self.callback:
+            self.discard()
 
     def read(self, size=None):
-        bytes = self.resp.read(size)
+        try:
+            bytes = self.resp.read(size)
+        except:
+            self.discard()
+            raise
         if size is None or len(bytes) < size:
             self.close()
         return bytes
 
     def close(self):
-        while not self.resp.isclosed():
-            self.resp.read(CHUNK_SIZE)
+        try:
+            while not self.resp.isclosed():
+                self.resp.read(CHUNK_SIZE)
+        except:
+            self.discard()
+            raise
         if self.callback:
             self.callback()
             self.callback = None
 
+    def discard(self):
+        """Close the response without reading the rest of it.
+
+        The connection is closed instead of being returned to the pool, as it
+        cannot be reused for another request.
+        """
+        if self.callback:
+            self.callback = None
+            self.resp.close()
+            if self.discard_callback:
+                self.discard_callback()
+        self.discard_callback = None
+
     def iterchunks(self):
+        """Iterate over the lines of a chunked response.
+
+        This is an alias of `iterlines`, kept for backwards compatibility.
+        """
+        return self.iterlines()
+
+    def iterlines(self):
+        """Iterate over the lines of a chunked response, without the line
+        terminators.
+
+        Lines are yielded as soon as they are complete, even if they span
+        several chunks, which makes this suitable for reading streaming
+        responses such as continuous changes feeds. An `IncompleteRead` error
+        is raised if the connection is closed before the end of the response.
+        """
         assert self.resp.msg.get('transfer-encoding') == 'chunked'
-        while True:
-            if self.resp.isclosed():
-                break
-            chunksz = int(self.resp.fp.readline().strip(), 16)
-            if not chunksz:
-                self.resp.fp.read(2) #crlf
-                self.resp.close()
-                self.callback()
-                break
-            chunk = self.resp.fp.read(chunksz)
-            for ln in chunk.splitlines():
-                yield ln
-            self.resp.fp.read(2) #crlf
+        fp = self.resp.fp
+        # The start of a line that continues in the next chunk; only it is
+        # copied, as the chunks are split in place
+        pending = ''
+        try:
+            while not self.resp.isclosed():
+                line = fp.readline()
+                if not line:
+                    raise IncompleteRead(pending)
+                chunksz = int(line.split(';', 1)[0].strip(), 16)
+                if not chunksz:
+                    fp.read(2) #crlf
+                    self.resp.close()
+                    if self.callback:
+                        self.callback()
+                        self.callback = None
+                    break
+                chunk = fp.read(chunksz)
+                if len(chunk) < chunksz:
+                    raise IncompleteRead(pending + chunk)
+                fp.read(2) #crlf
+                lines = chunk.split('\n')
+                if pending:
+                    lines[0] = pending + lines[0]
+                pending = lines.pop()
+                if '\r' in chunk or lines and lines[0].endswith('\r'):
+                    for ln in lines:
+                        if ln.endswith('\r'):
+                            ln = ln[:-1]
+                        yield ln
+                else:
+                    for ln in lines:
+                        yield ln
+        except:
+            # Failed, or closed before the end of the response
+            self.discard()
+            raise
+        if pending:
+            yield pending
 
 
 RETRYABLE_ERRORS = frozenset([
@@ -212,35 +290,61 @@ RETRYABLE_ERRORS = frozenset([
 class Session(object):
 
     def __init__(self, cache=None, timeout=None, max_redirects=5,
-                 retry_delays=[0], retryable_errors=RETRYABLE_ERRORS):
+                 retry_delays=[0], retryable_errors=RETRYABLE_ERRORS,
+                 max_connections=None, pool_timeout=None, max_idle_time=None,
+                 max_lifetime=None):
         """Initialize an HTTP client session.
 
-        :param cache: an instance with a dict-like interface or None to allow
-                      Session to create a dict for caching.
+        :param cache: a `Cache` instance, or any object with the same
+                      ``get``, ``put`` and ``remove`` methods, or `None` to
+                      create a default `Cache`
         :param timeout: socket timeout in number of seconds, or `None` for no
                         timeout (the default)
         :param retry_delays: list of request retry delays.
+        :param max_connections: maximum number of connections per host, or
+                                `None` for no limit (the default)
+        :param pool_timeout: number of seconds to wait for a connection when
+                             `max_connections` has been reached, or `None` to
+                             wait indefinitely (the default)
+        :param max_idle_time: number of seconds after which idle connections
+                              are closed, or `None` to keep them open
+        :param max_lifetime: number of seconds after which connections are
+                             closed regardless of use, or `None` for no limit
         """
         from couchdb import __version__ as VERSION
         self.user_agent = 'CouchDB-Python/%s' % VERSION
-        # XXX We accept a `cache` dict arg, but the ref gets overwritten later
-        # during cache cleanup. Do we remove the cache arg (does using a shared
-        # Session instance cover the same use cases?) or fix the cache cleanup?
-        # For now, let's just assign the dict to the Cache instance to retain
-        # current behaviour.
-        if cache is not None:
-            cache_by_url = cache
-            cache = Cache()
-            cache.by_url = cache_by_url
-        else:
+        if cache is None:
             cache = Cache()
+        elif not hasattr(cache, 'put'):
+            warnings.warn('Passing a dict as Session cache is deprecated, '
+                          'please pass a Cache instance instead [2026-10-18]',
+                          DeprecationWarning, stacklevel=2)
+            entries, cache = cache, Cache()
+            for url, response in entries.items():
+                cache.put(url, response)
         self.cache = cache
         self.max_redirects = max_redirects
         self.perm_redirects = {}
-        self.connection_pool = ConnectionPool(timeout)
+        self.connection_pool = ConnectionPool(timeout,
+                                              max_connections=max_connections,
+                                              wait_timeout=pool_timeout,
+                                              max_idle_time=max_idle_time,
+                                              max_lifetime=max_lifetime)
         self.retry_delays = list(retry_delays) # We don't want this changing on us.
         self.retryable_errors = set(retryable_errors)
 
+    def stats(self):
+        """Return a dictionary of statistics about this session.
+
+        The ``pool`` item holds the statistics of the connection pool, as
+        returned by `ConnectionPool.stats()`, and the ``cache`` item those of
+        the response cache, if it provides a ``stats()`` method.
+        """
+        stats = {'pool': self.connection_pool.stats()}
+        if hasattr(self.cache, 'stats'):
+            stats['cache'] = self.cache.stats()
+        return stats
+
     def request(self, method, url, body=None, headers=None, credentials=None,
                 num_redirects=0):
         if url in self.perm_redirects:
@@ -262,7 +366,7 @@ class Session(object):
 
         if (body is not None and not isinstance(body, basestring) and
                 not hasattr(body, 'read')):
-            body = json.encode(body).encode('utf-8')
+            body = json.encode_bytes(body)
             headers.setdefault('Content-Type', 'application/json')
 
         if body is None:
@@ -324,7 +428,12 @@ class Session(object):
                 else:
                     raise
 
-        resp = _try_request_with_retries(iter(self.retry_delays))
+        try:
+            resp = _try_request_with_retries(iter(self.retry_delays))
+        except:
+            # Don't leak the connection's slot in the pool
+            self.connection_pool.discard(url, conn)
+            raise
         status = resp.status
 
         # Handle conditional response
@@ -371,19 +480,23 @@ class Session(object):
         # For large or chunked response bodies, do not buffer the full body,
         # and instead return a minimal file-like object
         else:
-            data = ResponseBody(resp,
-                                lambda: self.connection_pool.release(url, conn))
+            pool = self.connection_pool
+            data = ResponseBody(resp, lambda: pool.release(url, conn),
+                                lambda: pool.discard(url, conn))
             streamed = True
 
         # Handle errors
         if status >= 400:
+            # The connection has already been released, or is released by
+            # the ResponseBody once it has been read
+            if streamed:
+                data = data.read()
             ctype = resp.getheader('content-type')
             if data is not None and 'application/json' in ctype:
                 data = json.decode(data)
                 error = data.get('error'), data.get('reason')
-            elif method != 'HEAD':
-                error = resp.read()
-                self.connection_pool.release(url, conn)
+            elif data is not None:
+                error = data
             else:
                 error = ''
             if status == 401:
@@ -407,78 +520,456 @@ class Session(object):
         return status, resp.msg, data
 
 
-def cache_sort(i):
-    return datetime.fromtimestamp(time.mktime(parsedate(i[1][1]['Date'])))
-
 class Cache(object):
-    """Content cache."""
+    """Content cache with least-recently-used eviction.
+
+    Entries are evicted once there are more than `max_entries` of them, or
+    when the total size of the cached response bodies exceeds `max_bytes`.
+    All operations take constant time.
 
-    # Some random values to limit memory use
-    keep_size, max_size = 10, 75
+    Any object providing the same ``get(url)``, ``put(url, response)`` and
+    ``remove(url)`` methods can be passed to `Session` as its cache, where
+    ``response`` is a ``(status, headers, body)`` tuple.
+    """
 
-    def __init__(self):
-        self.by_url = {}
+    def __init__(self, max_entries=75, max_bytes=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = self.misses = self.evictions = 0
+        # Circular doubly linked list of [prev, next, url, response, size]
+        # entries, the most recently used entry being at the end
+        self._root = root = []
+        root[:] = [root, root, None, None, 0]
+        self._links = {}
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self._links)
 
     def get(self, url):
-        return self.by_url.get(url)
+        self._lock.acquire()
+        try:
+            link = self._links.get(url)
+            if link is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._unlink(link)
+            self._append(link)
+            return link[3]
+        finally:
+            self._lock.release()
 
     def put(self, url, response):
-        self.by_url[url] = response
-        if len(self.by_url) > self.max_size:
-            self._clean()
+        size = _response_size(response)
+        self._lock.acquire()
+        try:
+            link = self._links.pop(url, None)
+            if link is not None:
+                self._unlink(link)
+                self.size -= link[4]
+            if self.max_bytes is not None and size > self.max_bytes:
+                return
+            link = [None, None, url, response, size]
+            self._links[url] = link
+            self._append(link)
+            self.size += size
+            while len(self._links) > self.max_entries or \
+                    self.max_bytes is not None and self.size > self.max_bytes:
+                oldest = self._root[1]
+                self._unlink(oldest)
+                del self._links[oldest[2]]
+                self.size -= oldest[4]
+                self.evictions += 1
+        finally:
+            self._lock.release()
 
     def remove(self, url):
-        self.by_url.pop(url, None)
+        self._lock.acquire()
+        try:
+            link = self._links.pop(url, None)
+            if link is not None:
+                self._unlink(link)
+                self.size -= link[4]
+        finally:
+            self._lock.release()
 
-    def _clean(self):
-        ls = sorted(self.by_url.iteritems(), key=cache_sort)
-        self.by_url = dict(ls[-self.keep_size:])
+    def stats(self):
+        """Return a dictionary with the number of cache ``hits``, ``misses``
+        and ``evictions``, and the current number of ``entries`` and their
+        total ``size`` in bytes.
+        """
+        self._lock.acquire()
+        try:
+            return {'hits': self.hits, 'misses': self.misses,
+                    'evictions': self.evictions,
+                    'entries': len(self._links), 'size': self.size}
+        finally:
+            self._lock.release()
+
+    def _append(self, link):
+        root = self._root
+        last = root[0]
+        link[0], link[1] = last, root
+        last[1] = root[0] = link
+
+    def _unlink(self, link):
+        prev, next = link[0], link[1]
+        prev[1] = next
+        next[0] = prev
+
+
+def _response_size(response):
+    data = response[2]
+    if data is None:
+        return 0
+    return len(data)
+
+
+class SQLiteCache(object):
+    """Response cache stored in an SQLite database file.
+
+    As the file can be opened by any number of processes, this allows the
+    worker processes of a pre-forking server to share their cached responses,
+    so that ``If-None-Match`` revalidation requests are answered with ``304
+    Not Modified`` much more often than with a cache per process.
+
+    When there are more than `max_entries` responses in the file, the ones
+    that were stored first are evicted.
+
+    >>> import os, tempfile
+    >>> fd, path = tempfile.mkstemp()
+    >>> cache = SQLiteCache(path)
+    >>> cache.put('http://localhost:5984/db/doc', (200, {'etag': '"1-a"'}, '{}'))
+    >>> status, headers, body = SQLiteCache(path).get('http://localhost:5984/db/doc')
+    >>> status, headers['etag'], body
+    (200, '"1-a"', '{}')
+    >>> os.close(fd); os.remove(path)
+    """
+
+    def __init__(self, path, max_entries=1000, timeout=5):
+        self.path = path
+        self.max_entries = max_entries
+        self.timeout = timeout
+        self.hits = self.misses = 0
+        self._local = local()
+        self._connect().execute(
+            'CREATE TABLE IF NOT EXISTS responses ('
+            'url TEXT PRIMARY KEY, status INTEGER, headers TEXT, body BLOB, '
+            'size INTEGER, stored REAL)'
+        )
+        self._connect().execute(
+            'CREATE INDEX IF NOT EXISTS responses_stored ON responses (stored)'
+        )
+
+    def get(self, url):
+        import sqlite3
+        try:
+            row = self._connect().execute(
+                'SELECT status, headers, body FROM responses WHERE url = ?',
+                (url,)
+            ).fetchone()
+        except sqlite3.OperationalError: # e.g. database locked for too long
+            row = None
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        status, headers, body = row
+        if body is not None:
+            body = str(body)
+        return status, HTTPMessage(StringIO(headers.encode('latin-1'))), body
+
+    def put(self, url, response):
+        import sqlite3
+        status, headers, body = response
+        if hasattr(headers, 'headers'): # an httplib.HTTPMessage
+            headers = ''.join(headers.headers)
+        else:
+            headers = ''.join(['%s: %s\r\n' % item for item in headers.items()])
+        size = _response_size(response)
+        if body is not None:
+            body = sqlite3.Binary(body)
+        conn = self._connect()
+        try:
+            conn.execute(
+                'INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)',
+                (url, status, headers.decode('latin-1'), body, size,
+                 time.time())
+            )
+            conn.execute(
+                'DELETE FROM responses WHERE stored <= (SELECT stored FROM '
+                'responses ORDER BY stored DESC LIMIT 1 OFFSET ?)',
+                (self.max_entries,)
+            )
+        except sqlite3.OperationalError:
+            pass
+
+    def remove(self, url):
+        import sqlite3
+        try:
+            self._connect().execute('DELETE FROM responses WHERE url = ?',
+                                    (url,))
+        except sqlite3.OperationalError:
+            pass
+
+    def stats(self):
+        """Return a dictionary with the number of cache ``hits`` and
+        ``misses`` in this process, and the number of ``entries`` and their
+        total ``size`` in bytes in the shared file.
+        """
+        entries, size = self._connect().execute(
+            'SELECT COUNT(*), SUM(size) FROM responses'
+        ).fetchone()
+        return {'hits': self.hits, 'misses': self.misses,
+                'entries': entries, 'size': size or 0}
+
+    def _connect(self):
+        # SQLite connections can neither be shared between threads nor
+        # survive a fork, so keep one per thread and process
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            import sqlite3
+            conn = sqlite3.connect(self.path, timeout=self.timeout,
+                                   isolation_level=None)
+            try:
+                conn.execute('PRAGMA journal_mode=WAL')
+            except sqlite3.DatabaseError:
+                pass # not supported by older SQLite versions
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
 
 
 class ConnectionPool(object):
-    """HTTP connection pool."""
+    """HTTP connection pool.
+
+    Connections are kept per ``(scheme, host)`` pair. If `max_connections` is
+    set, at most that many connections to a single host will be open at any
+    time; callers asking for more will block until a connection is released,
+    or until `wait_timeout` seconds have passed, in which case `PoolTimeout`
+    is raised.
 
-    def __init__(self, timeout):
+    Idle connections are closed when they have not been used for more than
+    `max_idle_time` seconds, and any connection is closed once it has been
+    open for longer than `max_lifetime` seconds.
+    """
+
+    def __init__(self, timeout, max_connections=None, wait_timeout=None,
+                 max_idle_time=None, max_lifetime=None):
         self.timeout = timeout
-        self.conns = {} # HTTP connections keyed by (scheme, host)
+        self.max_connections = max_connections
+        self.wait_timeout = wait_timeout
+        self.max_idle_time = max_idle_time
+        self.max_lifetime = max_lifetime
+        # Idle HTTP connections keyed by (scheme, host), as a list of
+        # (connection, created, last_used) tuples
+        self.conns = {}
+        self.in_use = {} # number of checked out connections by (scheme, host)
         self.lock = Lock()
+        # Conditions notified when a connection to (scheme, host) is released
+        self.available = {}
+        self.waits = self.creations = self.evictions = self.stale = 0
 
     def get(self, url):
 
-        scheme, host = urlsplit(url, 'http', False)[:2]
+        scheme, host = key = urlsplit(url, 'http', False)[:2]
+        if scheme == 'http':
+            cls = HTTPConnection
+        elif scheme == 'https':
+            cls = HTTPSConnection
+        else:
+            raise ValueError('%s is not a supported scheme' % scheme)
 
-        # Try to reuse an existing connection.
+        # Try to reuse an existing connection, waiting for one to be
+        # released if the per-host limit has been reached.
+        conn = None
+        deadline = None
         self.lock.acquire()
         try:
-            conns = self.conns.setdefault((scheme, host), [])
-            if conns:
-                conn = conns.pop(-1)
-            else:
-                conn = None
+            available = self.available.get(key)
+            if available is None:
+                available = self.available[key] = Condition(self.lock)
+            while True:
+                conns = self.conns.setdefault(key, [])
+                now = time.time()
+                while conns:
+                    conn, created, last_used = conns.pop(-1)
+                    if self._expired(created, last_used, now):
+                        self._evict(conn)
+                        conn = None
+                    elif _is_stale(conn):
+                        conn.close()
+                        self.stale += 1
+                        conn = None
+                    else:
+                        break
+                in_use = self.in_use.get(key, 0)
+                if conn is not None or self.max_connections is None or \
+                        in_use < self.max_connections:
+                    break
+                self.waits += 1
+                if self.wait_timeout is None:
+                    available.wait()
+                else:
+                    if deadline is None:
+                        deadline = now + self.wait_timeout
+                    elif now >= deadline:
+                        raise PoolTimeout('No connection to %s available '
+                                          'within %s seconds' %
+                                          (host, self.wait_timeout))
+                    available.wait(deadline - now)
+            # Reserve the slot while still holding the lock, so that
+            # concurrent callers cannot exceed the limit.
+            self.in_use[key] = in_use + 1
         finally:
             self.lock.release()
 
         # Create a new connection if nothing was available.
         if conn is None:
-            if scheme == 'http':
-                cls = HTTPConnection
-            elif scheme == 'https':
-                cls = HTTPSConnection
-            else:
-                raise ValueError('%s is not a supported scheme' % scheme)
-            conn = cls(host, timeout=self.timeout)
-            conn.connect()
+            try:
+                conn = cls(host, timeout=self.timeout)
+                conn.connect()
+            except:
+                self._checkin(key, None)
+                raise
+            # The creation time is kept on the connection itself, so that the
+            # pool holds no reference to checked out connections
+            conn.pool_created = time.time()
+            self.lock.acquire()
+            try:
+                self.creations += 1
+            finally:
+                self.lock.release()
 
         return conn
 
     def release(self, url, conn):
-        scheme, host = urlsplit(url, 'http', False)[:2]
+        scheme, host = key = urlsplit(url, 'http', False)[:2]
+        self._checkin(key, conn)
+
+    def discard(self, url, conn):
+        """Close a checked out connection that is no longer usable, instead
+        of returning it to the pool.
+        """
+        scheme, host = key = urlsplit(url, 'http', False)[:2]
+        self._checkin(key, conn, discard=True)
+
+    def clear(self):
+        """Close all idle connections."""
+        self.lock.acquire()
+        try:
+            conns, self.conns = self.conns, {}
+        finally:
+            self.lock.release()
+        for idle in conns.values():
+            for conn, created, last_used in idle:
+                conn.close()
+
+    def prune(self):
+        """Close idle connections that have exceeded the maximum idle time or
+        lifetime.
+        """
+        self.lock.acquire()
+        try:
+            now = time.time()
+            for key, conns in self.conns.items():
+                keep = []
+                for item in conns:
+                    conn, created, last_used = item
+                    if self._expired(created, last_used, now):
+                        self._evict(conn)
+                    else:
+                        keep.append(item)
+                conns[:] = keep
+        finally:
+            self.lock.release()
+
+    def stats(self):
+        """Return a dictionary of pool statistics: the number of connections
+        currently checked out (``in_use``) and idle (``idle``), how often
+        callers had to wait for a connection (``waits``), and how many
+        connections have been opened (``creations``), closed due to their
+        age (``evictions``) and found closed by the server (``stale``).
+        """
         self.lock.acquire()
         try:
-            self.conns.setdefault((scheme, host), []).append(conn)
+            return {
+                'in_use': sum(self.in_use.values()),
+                'idle': sum([len(conns) for conns in self.conns.values()]),
+                'waits': self.waits,
+                'creations': self.creations,
+                'evictions': self.evictions,
+                'stale': self.stale
+            }
         finally:
             self.lock.release()
 
+    def _checkin(self, key, conn, discard=False):
+        self.lock.acquire()
+        try:
+            if conn is not None:
+                for item in self.conns.get(key, ()):
+                    if item[0] is conn:
+                        # Already released
+                        return
+            self.in_use[key] = max(self.in_use.get(key, 0) - 1, 0)
+            if discard:
+                conn.close()
+            elif conn is not None:
+                now = time.time()
+                created = getattr(conn, 'pool_created', None)
+                if created is None or self._expired(created, now, now):
+                    self._evict(conn)
+                else:
+                    self.conns.setdefault(key, []).append((conn, created, now))
+            available = self.available.get(key)
+            if available is not None:
+                available.notify()
+        finally:
+            self.lock.release()
+
+    def _evict(self, conn):
+        # Must be called with the lock held
+        conn.close()
+        self.evictions += 1
+
+    def _expired(self, created, last_used, now):
+        if self.max_lifetime is not None and \
+                now - created > self.max_lifetime:
+            return True
+        if self.max_idle_time is not None and \
+                now - last_used > self.max_idle_time:
+            return True
+        return False
+
+
+def _is_stale(conn):
+    """Return whether an idle pooled connection has been closed by the server.
+
+    An idle keep-alive socket should never become readable; if it does, the
+    server has either closed the connection (EOF) or sent unexpected data, and
+    the connection cannot be reused either way.
+    """
+    sock = conn.sock
+    if sock is None:
+        # Not connected; httplib will open a new socket on the next request
+        return False
+    try:
+        if hasattr(select, 'poll'):
+            # Unlike select(), poll() supports descriptors above FD_SETSIZE
+            poller = select.poll()
+            poller.register(sock, select.POLLIN)
+            readable = poller.poll(0)
+        else:
+            readable = select.select([sock], [], [], 0)[0]
+    except (select.error, socket.error, ValueError):
+        # The probe is not possible; if the connection is in fact closed,
+        # the request will fail and be retried as usual
+        return False
+    return bool(readable)
+
 
 class Resource(object):
 
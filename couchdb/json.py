@@ -15,6 +15,7 @@ This module currently supports the following JSON modules:
  - ``json``: This is the version of ``simplejson`` that is bundled with the
    Python standard library since version 2.6
    (see http://docs.python.org/library/json.html)
+ - ``ujson``: https://pypi.python.org/pypi/ujson
 
 The default behavior is to use ``simplejson`` if installed, and otherwise
 fallback to the standard library module. To explicitly tell CouchDB-Python
@@ -29,58 +30,99 @@ CouchDB-Python to use custom decoding and encoding functions::
     from couchdb import json
     json.use(decode=my_decode, encode=my_encode)
 
+Other modules can be made available under a name with `register()`; the
+`encode_bytes` function is used where the JSON data is sent over the wire,
+so that modules producing UTF-8 encoded data directly can avoid converting
+it::
+
+    import orjson
+    from couchdb import json
+    json.register('orjson', decode=orjson.loads, encode=orjson.dumps,
+                  encode_bytes=orjson.dumps)
+    json.use('orjson')
+
 """
 
-__all__ = ['decode', 'encode', 'use']
+__all__ = ['decode', 'encode', 'encode_bytes', 'register', 'use']
 
 import warnings
 import os
 
-_initialized = False
-_using = os.environ.get('COUCHDB_PYTHON_JSON')
+_using = None
 _decode = None
 _encode = None
+_encode_bytes = None
+_backends = {}
 
 
 def decode(string):
     """Decode the given JSON string.
-    
-    :param string: the JSON string to decode
+
+    :param string: the JSON string to decode, either a unicode string or a
+                   UTF-8 encoded byte string
     :type string: basestring
     :return: the corresponding Python data structure
     :rtype: object
     """
-    if not _initialized:
-        _initialize()
     return _decode(string)
 
 
 def encode(obj):
     """Encode the given object as a JSON string.
-    
+
     :param obj: the Python data structure to encode
     :type obj: object
     :return: the corresponding JSON string
     :rtype: basestring
     """
-    if not _initialized:
-        _initialize()
     return _encode(obj)
 
 
-def use(module=None, decode=None, encode=None):
+def encode_bytes(obj):
+    """Encode the given object as a UTF-8 encoded JSON string.
+
+    >>> encode_bytes({'name': u'J\xf6rg'}) in ('{"name": "J\\u00f6rg"}',
+    ...                                        '{"name": "J\xc3\xb6rg"}')
+    True
+
+    :param obj: the Python data structure to encode
+    :type obj: object
+    :return: the corresponding JSON data
+    :rtype: str
+    :since: 0.9
+    """
+    return _encode_bytes(obj)
+
+
+def register(name, decode, encode, encode_bytes=None):
+    """Make a JSON module available to `use()` under the given name.
+
+    :param name: the name of the JSON module
+    :param decode: a function for decoding JSON strings, which should accept
+                   UTF-8 encoded byte strings as well as unicode strings
+    :param encode: a function for encoding objects as JSON strings
+    :param encode_bytes: a function for encoding objects as UTF-8 encoded
+                         JSON strings; by default, the result of `encode` is
+                         encoded if necessary
+    :since: 0.9
+    """
+    _backends[name] = lambda: (decode, encode, encode_bytes)
+
+
+def use(module=None, decode=None, encode=None, encode_bytes=None):
     """Set the JSON library that should be used, either by specifying a known
     module name, or by providing a decode and encode function.
-    
-    The modules "simplejson" and "json" are currently supported for the
-    ``module`` parameter.
-    
+
+    The modules "simplejson", "json", "ujson" and any module made available
+    using `register()` are currently supported for the ``module`` parameter.
+
     If provided, the ``decode`` parameter must be a callable that accepts a
     JSON string and returns a corresponding Python data structure. The
     ``encode`` callable must accept a Python data structure and return the
-    corresponding JSON string. Exceptions raised by decoding and encoding
-    should be propagated up unaltered.
-    
+    corresponding JSON string, and the optional ``encode_bytes`` callable the
+    corresponding UTF-8 encoded JSON string. Exceptions raised by decoding and
+    encoding should be propagated up unaltered.
+
     :param module: the name of the JSON library module to use, or the module
                    object itself
     :type module: str or module
@@ -88,59 +130,91 @@ def use(module=None, decode=None, encode=None):
     :type decode: callable
     :param encode: a function for encoding objects as JSON strings
     :type encode: callable
+    :param encode_bytes: a function for encoding objects as UTF-8 encoded
+                         JSON strings
+    :type encode_bytes: callable
     """
-    global _decode, _encode, _initialized, _using
+    global _using
     if module is not None:
         if not isinstance(module, basestring):
             module = module.__name__
-        if module not in ('cjson', 'json', 'simplejson'):
+        if module not in _backends:
             raise ValueError('Unsupported JSON module %s' % module)
+        if module == 'cjson':
+            warnings.warn("Builtin cjson support is deprecated. Please use "
+                          "the default or provide custom decode/encode "
+                          "functions [2011-11-09].",
+                          DeprecationWarning, stacklevel=2)
+        _set(*_backends[module]())
         _using = module
-        _initialized = False
     else:
         assert decode is not None and encode is not None
+        _set(decode, encode, encode_bytes)
         _using = 'custom'
-        _decode = decode
-        _encode = encode
-        _initialized = True
+
+
+def _set(decode, encode, encode_bytes=None):
+    global _decode, _encode, _encode_bytes
+    if encode_bytes is None:
+        def encode_bytes(obj):
+            data = encode(obj)
+            if isinstance(data, unicode):
+                data = data.encode('utf-8')
+            return data
+    _decode, _encode, _encode_bytes = decode, encode, encode_bytes
+
+
+def _load_simplejson():
+    import simplejson
+    # Escaping non-ASCII characters produces UTF-8 compatible data without
+    # the slower unicode code path of the encoder
+    return (simplejson.loads,
+            lambda obj, dumps=simplejson.dumps: \
+                dumps(obj, allow_nan=False, ensure_ascii=False),
+            lambda obj, dumps=simplejson.dumps: dumps(obj, allow_nan=False))
+
+
+def _load_cjson():
+    import cjson
+    return cjson.decode, cjson.encode, None
+
+
+def _load_stdlib():
+    json = __import__('json', {}, {})
+    return (json.loads,
+            lambda obj, dumps=json.dumps: \
+                dumps(obj, allow_nan=False, ensure_ascii=False),
+            lambda obj, dumps=json.dumps: dumps(obj, allow_nan=False))
+
+
+def _load_ujson():
+    import ujson
+    return (ujson.loads,
+            lambda obj, dumps=ujson.dumps: dumps(obj, ensure_ascii=False),
+            None)
+
+
+_backends.update({
+    'simplejson': _load_simplejson,
+    'cjson': _load_cjson,
+    'json': _load_stdlib,
+    'ujson': _load_ujson,
+})
 
 
 def _initialize():
-    global _initialized
-
-    def _init_simplejson():
-        global _decode, _encode
-        import simplejson
-        _decode = lambda string, loads=simplejson.loads: loads(string)
-        _encode = lambda obj, dumps=simplejson.dumps: \
-            dumps(obj, allow_nan=False, ensure_ascii=False)
-
-    def _init_cjson():
-        global _decode, _encode
-        import cjson
-        _decode = lambda string, decode=cjson.decode: decode(string)
-        _encode = lambda obj, encode=cjson.encode: encode(obj)
-
-    def _init_stdlib():
-        global _decode, _encode
-        json = __import__('json', {}, {})
-        _decode = lambda string, loads=json.loads: loads(string)
-        _encode = lambda obj, dumps=json.dumps: \
-            dumps(obj, allow_nan=False, ensure_ascii=False)
-
-    if _using == 'simplejson':
-        _init_simplejson()
-    elif _using == 'cjson':
-        warnings.warn("Builtin cjson support is deprecated. Please use the "
-                      "default or provide custom decode/encode functions "
-                      "[2011-11-09].",
-                      DeprecationWarning, stacklevel=1)
-        _init_cjson()
-    elif _using == 'json':
-        _init_stdlib()
-    elif _using != 'custom':
+    using = os.environ.get('COUCHDB_PYTHON_JSON')
+    if using:
         try:
-            _init_simplejson()
-        except ImportError:
-            _init_stdlib()
-    _initialized = True
+            use(using)
+            return
+        except (ValueError, ImportError), e:
+            warnings.warn('Cannot use the JSON module %s set by '
+                          'COUCHDB_PYTHON_JSON (%s), using the default '
+                          'instead' % (using, e), RuntimeWarning)
+    try:
+        use('simplejson')
+    except ImportError:
+        use('json')
+
+_initialize()
@@ -0,0 +1,279 @@
+# -*- coding: utf-8 -*-
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution.
+
+"""Replication of databases performed by the client.
+
+`Server.replicate` asks the server to replicate a database. A `Replicator`
+instead reads the changes of the source database and writes the missing
+document revisions to the target database itself, so that the documents can
+be filtered or transformed on the way, and the rate at which they are written
+can be limited:
+
+>>> from couchdb.client import Server
+>>> server = Server()
+>>> source = server.create('python-tests')
+>>> target = server.create('python-tests-copy')
+>>> source['johndoe'] = dict(type='Person', name='John Doe')
+>>> replicator = Replicator(source, target)
+>>> replicator.run() == source.info()['update_seq']
+True
+>>> target['johndoe']['name']
+u'John Doe'
+>>> replicator.docs_written
+1
+
+>>> del server['python-tests']
+>>> del server['python-tests-copy']
+"""
+
+from collections import deque
+from hashlib import md5
+from Queue import Full, Queue
+import time
+try:
+    from threading import Event, Lock
+except ImportError:
+    from dummy_threading import Event, Lock
+
+from couchdb import http, json, util
+
+__all__ = ['Replicator']
+__docformat__ = 'restructuredtext en'
+
+
+class Replicator(object):
+    """Replicate the documents of one database to another.
+
+    Replication works like that of CouchDB itself: the changes feed of the
+    source is read in batches, the target is asked which of the changed
+    revisions it is missing (using ``_revs_diff``), those revisions are
+    fetched from the source (using ``_bulk_get`` where the server supports
+    it, and ``open_revs`` otherwise) and saved to the target with their
+    revision history (using ``_bulk_docs`` with ``new_edits=false``).
+
+    These steps overlap: changes are read ahead by a background thread, the
+    missing revisions are fetched by a pool of `workers` threads, and up to
+    `workers` bulk requests to the target are in flight at a time. The last
+    source sequence whose changes have all been saved is recorded in a
+    ``_local`` document on the target after every batch, so that the next
+    run continues from there. A revision the target refuses to save stops the
+    replication with an error before the sequence of its change is recorded.
+
+    :param source: the `Database` to replicate from
+    :param target: the `Database` to replicate to
+    :param batch_size: the number of changes to process at a time
+    :param workers: the number of threads fetching revisions from the source
+                    and saving them to the target
+    :param max_pending: the number of batches of changes to read ahead
+    :param filter: a function called with every document revision to be
+                   replicated, returning whether it should be saved
+    :param transform: a function called with every document revision to be
+                      saved, returning the document to save instead, or
+                      `None` to skip it
+    :param max_rate: the maximum number of documents per second to save, or
+                     `None` for no limit
+    :since: 0.9
+    """
+
+    def __init__(self, source, target, batch_size=100, workers=4,
+                 max_pending=2, filter=None, transform=None, max_rate=None):
+        self.source = source
+        self.target = target
+        self.batch_size = batch_size
+        self.workers = workers
+        self.max_pending = max_pending
+        self.filter = filter
+        self.transform = transform
+        self.max_rate = max_rate
+        self.docs_read = self.missing_revs = self.docs_written = 0
+        self._bulk_get = True
+
+    @property
+    def replication_id(self):
+        """The ID identifying replications from the source to the target,
+        used for the checkpoint document.
+        """
+        return md5('%s\n%s' % (self.source.resource.url,
+                               self.target.resource.url)).hexdigest()
+
+    def run(self, since=None):
+        """Replicate the changes made to the source database.
+
+        :param since: the source sequence to start at, by default the one
+                      recorded by the last replication between the two
+                      databases
+        :return: the last source sequence that was replicated
+        """
+        checkpoint_id = '_local/' + self.replication_id
+        checkpoint = self.target.get(checkpoint_id) or {'_id': checkpoint_id}
+        if since is None:
+            since = checkpoint.get('source_last_seq', 0)
+
+        queue = Queue(self.max_pending)
+        stop = Event()
+        reader = util.WorkerPool(1)
+        fetchers = util.WorkerPool(self.workers)
+        # The batches of changes whose revisions are being saved, in order,
+        # as [since, number of revisions not saved yet] lists
+        batches = deque()
+        saving = {} # the batches of the revisions being saved, by id()
+        errors = []
+        lock = Lock()
+        def _saved(doc, result):
+            lock.acquire()
+            try:
+                saving.pop(id(doc))[1] -= 1
+                if not result[0]:
+                    errors.append(result[2])
+            finally:
+                lock.release()
+        writer = self.target.bulk_writer(batch_size=self.batch_size,
+                                         workers=self.workers,
+                                         callback=_saved, new_edits=False)
+        read = reader.submit(self._read_changes, since, queue, stop)
+        started = time.time()
+        try:
+            while True:
+                item = queue.get()
+                if item is None:
+                    break
+                results, since = item
+                self.docs_read += len(results)
+                batch = [since, 0]
+                batches.append(batch)
+                revs = dict((change['id'], [rev['rev'] for rev in
+                                            change['changes']])
+                            for change in results)
+                missing = {}
+                if revs:
+                    missing = self.target.revs_diff(revs)
+                for docs in fetchers.imap(self._fetch, self._chunks(missing)):
+                    for doc in docs:
+                        doc = self._prepare(doc, started)
+                        if doc is None:
+                            continue
+                        lock.acquire()
+                        try:
+                            saving[id(doc)] = batch
+                            batch[1] += 1
+                        finally:
+                            lock.release()
+                        writer.add(doc)
+                # Do not wait for the requests, but only record the batches
+                # whose revisions have all been saved
+                writer.flush()
+                self._checkpoint(checkpoint, batches, errors, lock)
+            read.get()
+            writer.close()
+            self._checkpoint(checkpoint, batches, errors, lock)
+        except:
+            # Do not send the remaining documents, which could fail as well
+            # and hide the original error
+            writer._shutdown()
+            raise
+        finally:
+            stop.set()
+            reader.close()
+            fetchers.close()
+        return since
+
+    def _checkpoint(self, checkpoint, batches, errors, lock):
+        lock.acquire()
+        try:
+            if errors:
+                raise errors[0]
+            since = None
+            while batches and not batches[0][1]:
+                since = batches.popleft()[0]
+        finally:
+            lock.release()
+        if since is not None and since != checkpoint.get('source_last_seq'):
+            checkpoint['source_last_seq'] = since
+            self.target.save(checkpoint)
+
+    def _read_changes(self, since, queue, stop):
+        try:
+            while not stop.isSet():
+                data = self.source.changes(since=since, limit=self.batch_size,
+                                           style='all_docs')
+                since = data['last_seq']
+                if not self._put(queue, (data['results'], since), stop):
+                    break
+                if len(data['results']) < self.batch_size:
+                    break
+        finally:
+            self._put(queue, None, stop)
+
+    def _put(self, queue, item, stop):
+        # Give up when the replication has been stopped, so that the reader
+        # does not block forever
+        while not stop.isSet():
+            try:
+                queue.put(item, timeout=0.1)
+                return True
+            except Full:
+                pass
+        return False
+
+    def _chunks(self, missing):
+        # Split the missing revisions into chunks to fetch using one request
+        # each, or one chunk per document when using open_revs
+        items = []
+        for docid, info in missing.items():
+            self.missing_revs += len(info['missing'])
+            items.append((docid, info['missing']))
+            if not self._bulk_get or len(items) >= self.batch_size:
+                yield items
+                items = []
+        if items:
+            yield items
+
+    def _fetch(self, items):
+        if self._bulk_get:
+            try:
+                return self._fetch_bulk(items)
+            except (http.ResourceNotFound, http.ServerError):
+                # The server does not support _bulk_get (CouchDB < 2.0)
+                self._bulk_get = False
+        docs = []
+        for docid, revs in items:
+            docs.extend(self._fetch_open_revs(docid, revs))
+        return docs
+
+    def _fetch_bulk(self, items):
+        body = {'docs': [{'id': docid, 'rev': rev} for docid, revs in items
+                         for rev in revs]}
+        _, _, data = self.source.resource.post_json('_bulk_get', body=body,
+                                                    revs=True,
+                                                    attachments=True)
+        docs = []
+        for result in data['results']:
+            for doc in result['docs']:
+                if 'ok' in doc:
+                    docs.append(doc['ok'])
+        return docs
+
+    def _fetch_open_revs(self, docid, revs):
+        data = self.source.get(docid, open_revs=json.encode(revs), revs=True,
+                               latest=True, attachments=True)
+        if data is None:
+            return []
+        return [doc['ok'] for doc in data if 'ok' in doc]
+
+    def _prepare(self, doc, started):
+        # Return the document to save, or None to skip it
+        if self.filter is not None and not self.filter(doc):
+            return None
+        if self.transform is not None:
+            doc = self.transform(doc)
+            if doc is None:
+                return None
+        if self.max_rate:
+            delay = started + self.docs_written / float(self.max_rate) - \
+                    time.time()
+            if delay > 0:
+                time.sleep(delay)
+        self.docs_written += 1
+        return doc
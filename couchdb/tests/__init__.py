@@ -8,22 +8,27 @@
 
 import unittest
 
-import client, couch_tests, design, http, multipart, mapping, \
-                          old_mapping, view, package, tools
+import changes, client, couch_tests, design, http, jsonlib, multipart, \
+                          mapping, old_mapping, view, package, replicator, \
+                          tools, util
 
 
 def suite():
     suite = unittest.TestSuite()
+    suite.addTest(changes.suite())
     suite.addTest(client.suite())
     suite.addTest(design.suite())
     suite.addTest(http.suite())
+    suite.addTest(jsonlib.suite())
     suite.addTest(multipart.suite())
     suite.addTest(mapping.suite())
     suite.addTest(old_mapping.suite())
     suite.addTest(view.suite())
     suite.addTest(couch_tests.suite())
     suite.addTest(package.suite())
+    suite.addTest(replicator.suite())
     suite.addTest(tools.suite())
+    suite.addTest(util.suite())
     return suite
 
 
@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution.
+
+import doctest
+import unittest
+
+from couchdb import changes
+from couchdb.tests import testutil
+
+
+def _get_idx(change):
+    # Defined at the top level so that it can be called by worker processes
+    if change['doc'] is not None:
+        return change['doc']['idx']
+
+
+class ChangesProcessorTestCase(testutil.TempDatabaseMixin, unittest.TestCase):
+
+    def setUp(self):
+        testutil.TempDatabaseMixin.setUp(self)
+        self.db.update([{'_id': 'doc%02d' % idx, 'idx': idx}
+                        for idx in range(25)])
+        self.batches = []
+
+    def _on_batch(self, changes, results):
+        self.batches.append(results)
+
+    def test_run(self):
+        processor = changes.ChangesProcessor(self.db, _get_idx,
+                                             on_batch=self._on_batch,
+                                             batch_size=10)
+        self.assertEqual(25, processor.run())
+        self.assertEqual([range(10), range(10, 20), range(20, 25)],
+                         self.batches)
+        self.assertEqual(25, processor.changes_processed)
+        self.assertEqual(3, processor.batches)
+
+    def test_processes(self):
+        processor = changes.ChangesProcessor(self.db, _get_idx,
+                                             on_batch=self._on_batch,
+                                             batch_size=10, workers=2,
+                                             processes=True)
+        processor.run()
+        self.assertEqual(range(25), sum(self.batches, []))
+
+    def test_deleted(self):
+        del self.db['doc03']
+        processor = changes.ChangesProcessor(self.db, _get_idx,
+                                             on_batch=self._on_batch,
+                                             since=20)
+        processor.run()
+        self.assertEqual([[20, 21, 22, 23, 24, None]], self.batches)
+
+    def test_checkpoint(self):
+        processor = changes.ChangesProcessor(self.db, _get_idx,
+                                             batch_size=10, checkpoint='test')
+        processor.run()
+        self.assertEqual(25, self.db['_local/test']['last_seq'])
+        self.db['doc25'] = {'idx': 25}
+        processor = changes.ChangesProcessor(self.db, _get_idx,
+                                             on_batch=self._on_batch,
+                                             batch_size=10, checkpoint='test')
+        self.assertEqual(26, processor.run())
+        self.assertEqual([[25]], self.batches)
+
+    def test_checkpoint_after_batch(self):
+        def _callback(change):
+            if change['id'] == 'doc15':
+                raise ValueError('failed')
+        processor = changes.ChangesProcessor(self.db, _callback,
+                                             batch_size=10, checkpoint='test')
+        self.assertRaises(ValueError, processor.run)
+        self.assertEqual(10, self.db['_local/test']['last_seq'])
+        self.assertEqual(10, processor.last_seq)
+
+    def test_continuous(self):
+        def _on_batch(changes, results):
+            self.batches.append(results)
+            if len(self.batches) == 1:
+                self.db['doc25'] = {'idx': 25}
+            else:
+                processor.stop()
+        processor = changes.ChangesProcessor(self.db, _get_idx,
+                                             on_batch=_on_batch,
+                                             batch_size=30)
+        self.assertEqual(26, processor.run(continuous=True, batch_timeout=.1,
+                                           heartbeat=100))
+        self.assertEqual([range(25), [25]], self.batches)
+
+
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(doctest.DocTestSuite(changes))
+    suite.addTest(unittest.makeSuite(ChangesProcessorTestCase, 'test'))
+    return suite
+
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
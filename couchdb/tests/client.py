@@ -11,6 +11,7 @@ import doctest
 import os
 import os.path
 import shutil
+import socket
 from StringIO import StringIO
 import time
 import tempfile
@@ -18,7 +19,7 @@ import threading
 import unittest
 import urlparse
 
-from couchdb import client, http
+from couchdb import client, http, json
 from couchdb.tests import testutil
 from schematics.validation import validate_instance
 
@@ -343,6 +344,88 @@ class DatabaseTestCase(testutil.TempDatabaseMixin, unittest.TestCase):
         for idx, i in enumerate(range(1, 6, 2)):
             self.assertEqual(i, res[idx].key)
 
+    def test_iter_ids(self):
+        ids = ['doc%d' % i for i in range(10)]
+        self.db.update([{'_id': id} for id in ids])
+        self.assertEqual(list(self.db), ids)
+        self.assertEqual(list(self.db.iter_ids(batch_size=3, prefetch=True)),
+                         ids)
+
+    def test_get_many(self):
+        self.db['foo'] = {'i': 1}
+        self.db['bar'] = {'i': 2}
+        self.db['baz'] = {'i': 3}
+        del self.db['baz']
+        docs = list(self.db.get_many(['bar', 'missing', 'baz', 'foo'],
+                                     chunk_size=3))
+        self.assertEqual([doc and doc['i'] for doc in docs],
+                         [2, None, None, 1])
+        self.assertEqual(docs[0].id, 'bar')
+
+    def test_get_many_workers(self):
+        ids = ['doc%d' % i for i in range(20)]
+        self.db.update([{'_id': id} for id in ids])
+        docs = self.db.get_many(reversed(ids), chunk_size=3, workers=4)
+        self.assertEqual([doc.id for doc in docs], list(reversed(ids)))
+
+    def test_bulk_writer(self):
+        docs = [{'i': i} for i in range(5)]
+        writer = self.db.bulk_writer(batch_size=2)
+        for doc in docs:
+            writer.add(doc)
+        self.assertEqual(writer.batches, 2)
+        writer.close()
+        self.assertEqual(writer.batches, 3)
+        self.assertEqual(writer.written, 5)
+        self.assertEqual(len(self.db), 5)
+        self.assertEqual(self.db[docs[0]['_id']].rev, docs[0]['_rev'])
+
+    def test_bulk_writer_max_bytes(self):
+        writer = self.db.bulk_writer(max_bytes=30)
+        for i in range(4):
+            writer.add({'data': 'x' * 10})
+        writer.close()
+        self.assertEqual(writer.batches, 4)
+
+    def test_bulk_writer_conflict(self):
+        self.db['foo'] = {}
+        results = []
+        writer = self.db.bulk_writer(callback=lambda doc, result:
+                                     results.append(result))
+        writer.add({'_id': 'foo'})
+        writer.add({'_id': 'bar'})
+        writer.close()
+        self.assertEqual([result[0] for result in results], [False, True])
+        assert isinstance(results[0][2], http.ResourceConflict)
+        self.assertEqual((writer.written, writer.failed), (1, 1))
+
+    def test_bulk_writer_new_edits(self):
+        post_json = self.db.resource.post_json
+        def _post_json(*args, **kwargs):
+            post_json(*args, **kwargs)
+            # The server only lists the documents it rejected
+            return 201, {}, [{'id': 'bar', 'error': 'forbidden',
+                              'reason': 'denied'}]
+        self.db.resource.post_json = _post_json
+        results = []
+        writer = self.db.bulk_writer(callback=lambda doc, result:
+                                     results.append(result), new_edits=False)
+        writer.add({'_id': 'foo', '_rev': '1-abc'})
+        writer.add({'_id': 'bar', '_rev': '1-def'})
+        writer.close()
+        self.assertEqual(results[0], (True, 'foo', '1-abc'))
+        self.assertEqual(results[1][:2], (False, 'bar'))
+        assert isinstance(results[1][2], http.ServerError)
+        self.assertEqual((writer.written, writer.failed), (1, 1))
+
+    def test_bulk_writer_workers(self):
+        writer = self.db.bulk_writer(batch_size=10, workers=3)
+        for i in range(95):
+            writer.add({'_id': 'doc%02d' % i})
+        writer.close()
+        self.assertEqual(writer.batches, 10)
+        self.assertEqual(len(self.db), 95)
+
     def test_bulk_update_conflict(self):
         docs = [
             dict(type='Person', name='John Doe'),
@@ -469,6 +552,13 @@ class DatabaseTestCase(testutil.TempDatabaseMixin, unittest.TestCase):
         # in a good state from the previous request.
         self.assertTrue(self.db.info()['doc_count'] == 0)
 
+    def test_changes_eventsource(self):
+        self.db['foo'] = {}
+        self.db['bar'] = {}
+        changes = self.db.changes(feed='eventsource', since=1)
+        self.assertEqual([(2, 'bar')], [(change['seq'], change['id'])
+                                        for change in changes])
+
     def test_changes_heartbeat(self):
         def wakeup():
             time.sleep(.3)
@@ -487,6 +577,87 @@ class DatabaseTestCase(testutil.TempDatabaseMixin, unittest.TestCase):
         self.assertRaises(TypeError, self.db.save, doc)
 
 
+class ChangesFollowerTestCase(testutil.TempDatabaseMixin, unittest.TestCase):
+
+    def setUp(self):
+        testutil.TempDatabaseMixin.setUp(self)
+        self.db.update([{'_id': 'doc%d' % idx} for idx in range(5)])
+
+    def _collect(self, follower, count):
+        changes = []
+        for change in follower:
+            changes.append(change)
+            if len(changes) == count:
+                follower.stop()
+        return changes
+
+    def test_follow(self):
+        follower = self.db.follow(since=2)
+        changes = self._collect(follower, 3)
+        self.assertEqual(['doc2', 'doc3', 'doc4'],
+                         [change['id'] for change in changes])
+        self.assertEqual(5, follower.last_seq)
+
+    def test_follow_batches(self):
+        follower = self.db.follow(batch_size=2, batch_timeout=.1,
+                                  heartbeat=100)
+        batches = self._collect(follower, 3)
+        self.assertEqual([2, 2, 1], [len(batch) for batch in batches])
+        self.assertEqual(5, follower.last_seq)
+
+    def test_follow_eventsource(self):
+        follower = self.db.follow(since=3, feed='eventsource')
+        changes = self._collect(follower, 2)
+        self.assertEqual(['doc3', 'doc4'],
+                         [change['id'] for change in changes])
+
+    def test_follow_longpoll(self):
+        follower = self.db.follow(since=1, feed='longpoll')
+        changes = self._collect(follower, 4)
+        self.assertEqual(['doc1', 'doc2', 'doc3', 'doc4'],
+                         [change['id'] for change in changes])
+        self.assertEqual(5, follower.last_seq)
+
+    def test_reconnect(self):
+        follower = self.db.follow(retry_delay=0)
+        read = follower._read
+        responses = [] # keep the failed responses from being collected
+        def _read():
+            # Fail after the first change of every request
+            changes = read()
+            responses.append(changes)
+            for idx, change in enumerate(changes):
+                if idx > 0:
+                    raise socket.error('connection reset')
+                yield change
+        follower._read = _read
+        changes = self._collect(follower, 5)
+        self.assertEqual(['doc%d' % idx for idx in range(5)],
+                         [change['id'] for change in changes])
+        self.assertEqual(4, follower.reconnects)
+        # The failed connections have been closed
+        stats = follower.resource.session.connection_pool.stats()
+        self.assertEqual(0, stats['in_use'])
+        self.assertEqual(0, stats['idle'])
+
+    def test_stop_from_thread(self):
+        follower = self.db.follow(since=5, heartbeat=200)
+        timer = threading.Timer(.3, follower.stop)
+        timer.start()
+        self.assertEqual([], list(follower))
+        timer.join()
+        stats = follower.resource.session.connection_pool.stats()
+        self.assertEqual(0, stats['in_use'])
+
+    def test_max_retries(self):
+        follower = self.db.follow(retry_delay=0, max_retries=2)
+        def _read():
+            raise socket.error('connection refused')
+        follower._read = _read
+        self.assertRaises(socket.error, list, follower)
+        self.assertEqual(2, follower.reconnects)
+
+
 class ViewTestCase(testutil.TempDatabaseMixin, unittest.TestCase):
 
     def test_row_object(self):
@@ -595,6 +766,57 @@ class ViewTestCase(testutil.TempDatabaseMixin, unittest.TestCase):
         view = client.PermanentView(self.db.resource('_all_docs').url, '_all_docs')
         self.assertEquals(len(list(view)), 1)
 
+    def test_iterrows(self):
+        self.db.update([{'_id': 'doc%d' % i} for i in range(10)])
+        results = self.db.view('_all_docs', startkey='doc5')
+        rows = results.iterrows()
+        self.assertEqual(rows.next().id, 'doc5')
+        self.assertEqual((results.total_rows, results.offset), (10, 5))
+        self.assertEqual([row.id for row in rows],
+                         ['doc6', 'doc7', 'doc8', 'doc9'])
+        self.assertEqual(results._rows, None)
+
+    def test_iterpages(self):
+        self.db.update([{'_id': 'doc%d' % i} for i in range(10)])
+        pages = list(self.db.view('_all_docs').iterpages(page_size=4))
+        self.assertEqual([len(page) for page in pages], [4, 4, 2])
+        self.assertEqual([row.id for page in pages for row in page],
+                         ['doc%d' % i for i in range(10)])
+
+    def test_iterpages_limit(self):
+        self.db.update([{'_id': 'doc%d' % i} for i in range(10)])
+        results = self.db.view('_all_docs', startkey='doc2', limit=5)
+        pages = list(results.iterpages(page_size=2, prefetch=True))
+        self.assertEqual([[row.id for row in page] for page in pages],
+                         [['doc2', 'doc3'], ['doc4', 'doc5'], ['doc6']])
+        self.assertEqual(results.offset, 2)
+
+    def test_iterpages_repeated_rows(self):
+        # Documents emitting the same key several times, with rows of the
+        # same key and ID on both sides of the page boundaries
+        all_rows = [{'key': key, 'id': docid, 'value': idx}
+                    for idx, (key, docid) in enumerate(
+                        [('j', 'a')] + [('k', 'a')] * 5 + [('k', 'b')] * 2 +
+                        [('l', 'a')])]
+        class View(object):
+            wrapper = None
+            def _exec(self, options):
+                start = (options.get('startkey'), options.get('startkey_docid'))
+                rows = [row for row in all_rows
+                        if (row['key'], row['id']) >= start]
+                rows = rows[options.get('skip', 0):]
+                return {'total_rows': len(all_rows), 'offset': 0,
+                        'rows': rows[:options['limit']]}
+        for page_size in range(1, 6):
+            results = client.ViewResults(View(), {})
+            pages = list(results.iterpages(page_size=page_size))
+            self.assertEqual([row.value for page in pages for row in page],
+                             range(len(all_rows)))
+
+    def test_iterpages_keys(self):
+        results = self.db.view('_all_docs', keys=['foo'])
+        self.assertRaises(ValueError, list, results.iterpages())
+
     def test_tmpview_repr(self):
         mapfunc = "function(doc) {emit(null, null);}"
         view = client.TemporaryView(self.db.resource('_temp_view'), mapfunc)
@@ -629,6 +851,74 @@ class ViewTestCase(testutil.TempDatabaseMixin, unittest.TestCase):
         self.assertTrue('id' not in repr(rows[0]))
 
 
+class ViewRowsParserTestCase(unittest.TestCase):
+
+    def _parse(self, text, chunk_size):
+        meta = {}
+        rows = list(client._iter_view_rows(StringIO(text), meta,
+                                           chunk_size=chunk_size))
+        return meta, rows
+
+    def test_chunk_boundaries(self):
+        data = {'total_rows': 3, 'offset': 1, 'rows': [
+            {'id': 'a', 'key': ['a', '}"]{\\'], 'value': {'x': [1, {}]}},
+            {'id': 'b', 'key': u'b\xe5r', 'value': None},
+            {'id': 'c', 'key': 'c', 'value': '['}
+        ]}
+        text = json.encode(data).encode('utf-8')
+        for chunk_size in range(1, 40):
+            meta, rows = self._parse(text, chunk_size)
+            self.assertEqual(rows, data['rows'])
+            self.assertEqual(meta, {'total_rows': 3, 'offset': 1})
+
+    def test_couchdb_layout(self):
+        text = ('{"total_rows":2,"offset":0,"rows":[\r\n'
+                '{"id":"a","key":"a","value":1},\r\n'
+                '{"id":"b","key":"b","value":2}\r\n'
+                ']}\n')
+        meta, rows = self._parse(text, 5)
+        self.assertEqual([row['value'] for row in rows], [1, 2])
+
+    def test_reduce(self):
+        meta, rows = self._parse('{"rows":[{"key":null,"value":42}]}', 4)
+        self.assertEqual(meta, {})
+        self.assertEqual(rows, [{'key': None, 'value': 42}])
+
+    def test_trailer(self):
+        meta, rows = self._parse('{"total_rows":0,"offset":0,"rows":[],'
+                                 '"update_seq":5}', 3)
+        self.assertEqual(rows, [])
+        self.assertEqual(meta['update_seq'], 5)
+
+    def test_truncated(self):
+        self.assertRaises(ValueError, self._parse,
+                          '{"total_rows":1,"offset":0,"rows":[{"id":"a",', 8)
+
+    def test_closes_body(self):
+        body = StringIO('{"rows":[{"key":1},{"key":2}]}')
+        rows = client._iter_view_rows(body, {})
+        rows.next()
+        rows.close()
+        self.assertTrue(body.closed)
+
+    def test_discards_unread_body(self):
+        class Body(StringIO):
+            discarded = False
+            def discard(self):
+                self.discarded = True
+        body = Body('{"rows":[{"key":1},{"key":2}]}')
+        rows = client._iter_view_rows(body, {}, chunk_size=12)
+        rows.next()
+        rows.close()
+        self.assertTrue(body.discarded)
+        self.assertFalse(body.closed)
+
+        body = Body('{"rows":[{"key":1},{"key":2}]}')
+        list(client._iter_view_rows(body, {}, chunk_size=12))
+        self.assertFalse(body.discarded)
+        self.assertTrue(body.closed)
+
+
 class ShowListTestCase(testutil.TempDatabaseMixin, unittest.TestCase):
 
     show_func = """
@@ -730,7 +1020,9 @@ def suite():
     suite = unittest.TestSuite()
     suite.addTest(unittest.makeSuite(ServerTestCase, 'test'))
     suite.addTest(unittest.makeSuite(DatabaseTestCase, 'test'))
+    suite.addTest(unittest.makeSuite(ChangesFollowerTestCase, 'test'))
     suite.addTest(unittest.makeSuite(ViewTestCase, 'test'))
+    suite.addTest(unittest.makeSuite(ViewRowsParserTestCase, 'test'))
     suite.addTest(unittest.makeSuite(ShowListTestCase, 'test'))
     suite.addTest(unittest.makeSuite(UpdateHandlerTestCase, 'test'))
     suite.addTest(doctest.DocTestSuite(client))
@@ -6,10 +6,18 @@
 # This software is licensed as described in the file COPYING, which
 # you should have received as part of this distribution.
 
+import BaseHTTPServer
 import doctest
+import gc
+import httplib
+import os
 import socket
+import SocketServer
+import tempfile
+import threading
 import time
 import unittest
+import weakref
 from StringIO import StringIO
 
 from couchdb import http
@@ -59,6 +67,9 @@ class ResponseBodyTestCase(unittest.TestCase):
             def isclosed(self):
                 return len(self.fp.buf) == self.fp.tell()
 
+            def close(self):
+                pass
+
         data = 'foobarbaz'
         data = '\n'.join([hex(len(data))[2:], data])
         response = http.ResponseBody(TestHttpResp(StringIO(data)),
@@ -66,6 +77,277 @@ class ResponseBodyTestCase(unittest.TestCase):
         self.assertEqual(list(response.iterchunks()), ['foobarbaz'])
         self.assertEqual(list(response.iterchunks()), [])
 
+    def _chunked_response(self, chunks, terminate=True):
+        class TestHttpResp(object):
+            msg = {'transfer-encoding': 'chunked'}
+            closed = False
+            def __init__(self, fp):
+                self.fp = fp
+            def isclosed(self):
+                return self.closed
+            def close(self):
+                self.closed = True
+        data = ''.join(['%x\r\n%s\r\n' % (len(chunk), chunk)
+                        for chunk in chunks])
+        if terminate:
+            data += '0\r\n\r\n'
+        return http.ResponseBody(TestHttpResp(StringIO(data)),
+                                 lambda *a, **k: None)
+
+    def test_iterlines(self):
+        response = self._chunked_response(['{"seq": 1', '}\n{"seq"',
+                                           ': 2}\n', '\n', '{"seq": 3}\r\n'])
+        self.assertEqual(list(response.iterlines()),
+                         ['{"seq": 1}', '{"seq": 2}', '', '{"seq": 3}'])
+
+    def test_iterlines_crlf(self):
+        response = self._chunked_response(['data: 1\r', '\n\r\ndata',
+                                           ': 2\r\n\r\n'])
+        self.assertEqual(list(response.iterlines()),
+                         ['data: 1', '', 'data: 2', ''])
+
+    def test_iterlines_incomplete(self):
+        response = self._chunked_response(['{"seq": 1}\n{"se'],
+                                          terminate=False)
+        lines = response.iterlines()
+        self.assertEqual(lines.next(), '{"seq": 1}')
+        self.assertRaises(httplib.IncompleteRead, lines.next)
+
+    def test_iterlines_incomplete_discards(self):
+        discarded = []
+        response = self._chunked_response(['{"seq": 1}\n{"se'],
+                                          terminate=False)
+        response.discard_callback = lambda: discarded.append(True)
+        self.assertRaises(httplib.IncompleteRead, list, response.iterlines())
+        self.assertEqual(discarded, [True])
+        self.assertTrue(response.resp.isclosed())
+
+    def test_abandoned(self):
+        released, discarded = [], []
+        response = self._chunked_response(['{"seq": 1}\n', '{"seq": 2}\n'],
+                                          terminate=False)
+        response.callback = lambda: released.append(True)
+        response.discard_callback = lambda: discarded.append(True)
+        lines = response.iterlines()
+        lines.next()
+        del lines, response
+        self.assertEqual((released, discarded), ([], [True]))
+
+
+class ConnectionPoolTestCase(unittest.TestCase):
+
+    def setUp(self):
+        # A listening socket is enough for connections to be established
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.bind(('127.0.0.1', 0))
+        self.sock.listen(16)
+        self.url = 'http://127.0.0.1:%d/' % self.sock.getsockname()[1]
+
+    def tearDown(self):
+        self.sock.close()
+
+    def test_reuse(self):
+        pool = http.ConnectionPool(None)
+        conn = pool.get(self.url)
+        pool.release(self.url, conn)
+        self.assertTrue(pool.get(self.url) is conn)
+        self.assertEqual(pool.stats()['creations'], 1)
+
+    def test_max_connections_timeout(self):
+        pool = http.ConnectionPool(None, max_connections=1, wait_timeout=0.1)
+        pool.get(self.url)
+        self.assertRaises(http.PoolTimeout, pool.get, self.url)
+        stats = pool.stats()
+        self.assertEqual(stats['in_use'], 1)
+        self.assertTrue(stats['waits'] >= 1)
+
+    def test_max_connections_wait(self):
+        pool = http.ConnectionPool(None, max_connections=1, wait_timeout=5)
+        conn = pool.get(self.url)
+        def release():
+            time.sleep(.1)
+            pool.release(self.url, conn)
+        threading.Thread(target=release).start()
+        self.assertTrue(pool.get(self.url) is conn)
+
+    def test_release_wakes_waiter_for_host(self):
+        pool = http.ConnectionPool(None, max_connections=1, wait_timeout=2)
+        url_b = self.url.replace('127.0.0.1', 'localhost')
+        conn_a = pool.get(self.url)
+        conn_b = pool.get(url_b)
+        results = {}
+        def wait(url):
+            start = time.time()
+            results[url] = pool.get(url), time.time() - start
+        # The waiter for the other host waits first, so that it would be
+        # the one woken up if all hosts shared a condition
+        waiter_b = threading.Thread(target=wait, args=(url_b,))
+        waiter_b.start()
+        time.sleep(.1)
+        waiter_a = threading.Thread(target=wait, args=(self.url,))
+        waiter_a.start()
+        time.sleep(.1)
+        pool.release(self.url, conn_a)
+        waiter_a.join()
+        self.assertTrue(results[self.url][0] is conn_a)
+        self.assertTrue(results[self.url][1] < 1)
+        pool.release(url_b, conn_b)
+        waiter_b.join()
+        self.assertTrue(results[url_b][0] is conn_b)
+
+    def test_checked_out_not_referenced(self):
+        pool = http.ConnectionPool(None)
+        conn = weakref.ref(pool.get(self.url))
+        self.assertEqual(conn(), None)
+
+    def test_release_twice(self):
+        pool = http.ConnectionPool(None)
+        other = pool.get(self.url)
+        conn = pool.get(self.url)
+        pool.release(self.url, conn)
+        pool.release(self.url, conn)
+        pool.discard(self.url, conn)
+        stats = pool.stats()
+        self.assertEqual((stats['in_use'], stats['idle']), (1, 1))
+        self.assertTrue(conn.sock is not None)
+        self.assertTrue(pool.get(self.url) is conn)
+
+    def test_discard_frees_slot(self):
+        pool = http.ConnectionPool(None, max_connections=1, wait_timeout=0.1)
+        pool.discard(self.url, pool.get(self.url))
+        pool.get(self.url)
+        stats = pool.stats()
+        self.assertEqual(stats['idle'], 0)
+        self.assertEqual(stats['creations'], 2)
+
+    def test_max_idle_time(self):
+        pool = http.ConnectionPool(None, max_idle_time=0.05)
+        conn = pool.get(self.url)
+        pool.release(self.url, conn)
+        time.sleep(.1)
+        self.assertFalse(pool.get(self.url) is conn)
+        self.assertEqual(pool.stats()['evictions'], 1)
+
+    def test_max_lifetime(self):
+        pool = http.ConnectionPool(None, max_lifetime=0.05)
+        conn = pool.get(self.url)
+        time.sleep(.1)
+        pool.release(self.url, conn)
+        self.assertEqual(pool.stats()['idle'], 0)
+        self.assertEqual(pool.stats()['evictions'], 1)
+
+    def test_stale_connection(self):
+        pool = http.ConnectionPool(None)
+        conn = pool.get(self.url)
+        pool.release(self.url, conn)
+        # The server closes the idle keep-alive connection
+        self.sock.accept()[0].close()
+        time.sleep(.05)
+        self.assertFalse(pool.get(self.url) is conn)
+        self.assertEqual(pool.stats()['stale'], 1)
+
+    def test_live_connection_not_stale(self):
+        pool = http.ConnectionPool(None)
+        conn = pool.get(self.url)
+        pool.release(self.url, conn)
+        peer = self.sock.accept()[0]
+        try:
+            self.assertTrue(pool.get(self.url) is conn)
+            self.assertEqual(pool.stats()['stale'], 0)
+        finally:
+            peer.close()
+
+    def test_high_descriptor_not_stale(self):
+        # Use up the descriptors supported by select() first
+        placeholders = []
+        try:
+            try:
+                for idx in range(1024):
+                    placeholders.append(os.open(os.devnull, os.O_RDONLY))
+            except OSError:
+                self.skipTest('cannot open enough descriptors')
+            pool = http.ConnectionPool(None)
+            conn = pool.get(self.url)
+            peer = self.sock.accept()[0]
+            try:
+                self.assertTrue(conn.sock.fileno() >= 1024)
+                pool.release(self.url, conn)
+                self.assertTrue(pool.get(self.url) is conn)
+                self.assertEqual(pool.stats()['stale'], 0)
+            finally:
+                peer.close()
+                conn.close()
+        finally:
+            for fd in placeholders:
+                os.close(fd)
+
+    def test_prune(self):
+        pool = http.ConnectionPool(None, max_idle_time=0.05)
+        pool.release(self.url, pool.get(self.url))
+        time.sleep(.1)
+        pool.prune()
+        self.assertEqual(pool.stats()['idle'], 0)
+
+
+class ErrorResponseTestCase(unittest.TestCase):
+
+    def setUp(self):
+        class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            def do_GET(self):
+                if self.path == '/empty':
+                    self.send_response(404)
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                else:
+                    self.send_response(500)
+                    self.send_header('Content-Type', 'text/plain')
+                    self.send_header('Transfer-Encoding', 'chunked')
+                    self.end_headers()
+                    self.wfile.write('6\r\nfailed\r\n0\r\n\r\n')
+            def log_message(self, *args):
+                pass
+        class Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+            daemon_threads = True
+        self.server = Server(('127.0.0.1', 0), Handler)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+        self.url = 'http://127.0.0.1:%d/' % self.server.server_port
+        self.session = http.Session(max_connections=2)
+        # Another connection stays checked out during the requests
+        self.other = self.session.connection_pool.get(self.url)
+
+    def tearDown(self):
+        self.session.connection_pool.release(self.url, self.other)
+        self.session.connection_pool.clear()
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+
+    def _check_released(self):
+        stats = self.session.connection_pool.stats()
+        self.assertEqual((stats['in_use'], stats['idle']), (1, 1))
+
+    def test_empty_body(self):
+        self.assertRaises(http.ResourceNotFound, self.session.request, 'GET',
+                          self.url + 'empty')
+        self._check_released()
+
+    def _error(self, path):
+        try:
+            self.session.request('GET', self.url + path)
+        except http.ServerError, e:
+            return e.args[0]
+        self.fail('expected ServerError')
+
+    def test_streamed_body(self):
+        self.assertEqual((500, 'failed'), self._error('streamed'))
+        # The response is no longer referenced by the traceback
+        gc.collect()
+        self._check_released()
+        conn = self.session.connection_pool.conns.values()[0][0][0]
+        self.assertTrue(conn.sock is not None)
+
 
 class CacheTestCase(testutil.TempDatabaseMixin, unittest.TestCase):
 
@@ -77,13 +359,97 @@ class CacheTestCase(testutil.TempDatabaseMixin, unittest.TestCase):
         cache.remove(url)
         cache.remove(url)
 
+    def test_lru_eviction(self):
+        cache = http.Cache(max_entries=2)
+        cache.put('a', (200, {}, 'a'))
+        cache.put('b', (200, {}, 'b'))
+        cache.get('a') # 'b' is now the least recently used entry
+        cache.put('c', (200, {}, 'c'))
+        self.assertEqual(cache.get('b'), None)
+        self.assertEqual(cache.get('a'), (200, {}, 'a'))
+        self.assertEqual(cache.get('c'), (200, {}, 'c'))
+        self.assertEqual(cache.stats()['evictions'], 1)
+
+    def test_max_bytes(self):
+        cache = http.Cache(max_bytes=10)
+        cache.put('a', (200, {}, 'x' * 6))
+        cache.put('b', (200, {}, 'x' * 6))
+        self.assertEqual(len(cache), 1)
+        self.assertEqual(cache.get('a'), None)
+        cache.put('c', (200, {}, 'x' * 11)) # too large to be cached at all
+        self.assertEqual(cache.get('c'), None)
+        self.assertEqual(cache.get('b'), (200, {}, 'x' * 6))
+        self.assertEqual(cache.stats()['size'], 6)
+
+    def test_replace(self):
+        cache = http.Cache()
+        cache.put('a', (200, {}, 'xxx'))
+        cache.put('a', (200, {}, 'x'))
+        self.assertEqual(len(cache), 1)
+        self.assertEqual(cache.stats()['size'], 1)
+
+    def test_stats(self):
+        cache = http.Cache()
+        cache.put('a', (200, {}, None))
+        cache.get('a')
+        cache.get('b')
+        stats = cache.stats()
+        self.assertEqual((stats['hits'], stats['misses']), (1, 1))
+
+    def test_session_cache(self):
+        cache = http.Cache()
+        session = http.Session(cache=cache)
+        self.assertTrue(session.cache is cache)
+        self.assertEqual(session.stats()['cache'], cache.stats())
+
+
+class SQLiteCacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp()
+        os.close(fd)
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def test_shared(self):
+        url = 'http://localhost:5984/foo'
+        headers = httplib.HTTPMessage(StringIO('ETag: "1-abc"\r\n'
+                                               'Content-Type: text/plain\r\n'))
+        http.SQLiteCache(self.path).put(url, (200, headers, 'foo'))
+        status, headers, body = http.SQLiteCache(self.path).get(url)
+        self.assertEqual(status, 200)
+        self.assertEqual(headers.get('etag'), '"1-abc"')
+        self.assertEqual(headers.get('content-type'), 'text/plain')
+        self.assertEqual(body, 'foo')
+
+    def test_remove(self):
+        url = 'http://localhost:5984/foo'
+        cache = http.SQLiteCache(self.path)
+        cache.put(url, (200, {}, None))
+        cache.remove(url)
+        cache.remove(url)
+        self.assertEqual(cache.get(url), None)
+
+    def test_max_entries(self):
+        cache = http.SQLiteCache(self.path, max_entries=2)
+        for name in 'abc':
+            cache.put(name, (200, {}, name))
+            time.sleep(.01)
+        self.assertEqual(cache.get('a'), None)
+        self.assertEqual(cache.get('c')[2], 'c')
+        self.assertEqual(cache.stats()['entries'], 2)
+
 
 def suite():
     suite = unittest.TestSuite()
     suite.addTest(doctest.DocTestSuite(http))
     suite.addTest(unittest.makeSuite(SessionTestCase, 'test'))
     suite.addTest(unittest.makeSuite(ResponseBodyTestCase, 'test'))
+    suite.addTest(unittest.makeSuite(ConnectionPoolTestCase, 'test'))
+    suite.addTest(unittest.makeSuite(ErrorResponseTestCase, 'test'))
     suite.addTest(unittest.makeSuite(CacheTestCase, 'test'))
+    suite.addTest(unittest.makeSuite(SQLiteCacheTestCase, 'test'))
     return suite
 
 
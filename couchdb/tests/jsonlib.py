@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution.
+
+import doctest
+import os
+import unittest
+import warnings
+
+from couchdb import json
+
+
+class JSONTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.using = json._using
+        self.backends = json._backends.copy()
+
+    def tearDown(self):
+        json._backends.clear()
+        json._backends.update(self.backends)
+        json.use(self.using)
+
+    def test_use(self):
+        json.use('json')
+        self.assertEqual({u'name': u'J\xf6rg'},
+                         json.decode('{"name": "J\xc3\xb6rg"}'))
+        self.assertEqual(u'{"name": "J\xf6rg"}',
+                         json.encode({'name': u'J\xf6rg'}))
+        self.assertEqual({u'name': u'J\xf6rg'},
+                         json.decode(json.encode_bytes({'name': u'J\xf6rg'})))
+
+    def test_use_unsupported(self):
+        self.assertRaises(ValueError, json.use, 'foojson')
+
+    def test_register(self):
+        calls = []
+        def encode_bytes(obj):
+            calls.append(obj)
+            return '[]'
+        json.register('listjson', decode=lambda string: [],
+                      encode=lambda obj: u'[]', encode_bytes=encode_bytes)
+        json.use('listjson')
+        self.assertEqual([], json.decode('{}'))
+        self.assertEqual('[]', json.encode_bytes({}))
+        self.assertEqual([{}], calls)
+
+    def test_encode_bytes_default(self):
+        json.use(decode=lambda string: None,
+                 encode=lambda obj: u'"J\xf6rg"')
+        self.assertEqual('"J\xc3\xb6rg"', json.encode_bytes('J\xc3\xb6rg'))
+
+    def _initialize(self, using):
+        caught = []
+        environ = os.environ.get('COUCHDB_PYTHON_JSON')
+        filters, showwarning = warnings.filters[:], warnings.showwarning
+        warnings.simplefilter('always', RuntimeWarning)
+        warnings.showwarning = lambda message, *args: caught.append(message)
+        os.environ['COUCHDB_PYTHON_JSON'] = using
+        try:
+            json._initialize()
+        finally:
+            warnings.filters[:], warnings.showwarning = filters, showwarning
+            if environ is None:
+                del os.environ['COUCHDB_PYTHON_JSON']
+            else:
+                os.environ['COUCHDB_PYTHON_JSON'] = environ
+        return caught
+
+    def test_initialize_unsupported(self):
+        caught = self._initialize('foojson')
+        self.assertEqual(1, len(caught))
+        self.assertTrue('foojson' in str(caught[0]))
+        self.assertTrue(json._using in ('simplejson', 'json'))
+
+    def test_initialize_missing(self):
+        def _load():
+            raise ImportError('No module named missingjson')
+        json._backends['missingjson'] = _load
+        caught = self._initialize('missingjson')
+        self.assertEqual(1, len(caught))
+        self.assertEqual({'a': 1}, json.decode('{"a": 1}'))
+        self.assertTrue(json._using in ('simplejson', 'json'))
+
+
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(doctest.DocTestSuite(json))
+    suite.addTest(unittest.makeSuite(JSONTestCase, 'test'))
+    return suite
+
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution.
+
+import doctest
+import unittest
+
+from couchdb import http, replicator
+from couchdb.tests import testutil
+
+
+class ReplicatorTestCase(testutil.TempDatabaseMixin, unittest.TestCase):
+
+    def setUp(self):
+        testutil.TempDatabaseMixin.setUp(self)
+        _, self.source = self.temp_db()
+        _, self.target = self.temp_db()
+        self.source.update([{'_id': 'doc%02d' % idx, 'idx': idx}
+                            for idx in range(25)])
+
+    def test_replicate(self):
+        repl = replicator.Replicator(self.source, self.target, batch_size=10)
+        self.assertEqual(self.source.info()['update_seq'], repl.run())
+        self.assertEqual(25, repl.docs_read)
+        self.assertEqual(25, repl.missing_revs)
+        self.assertEqual(25, repl.docs_written)
+        self.assertEqual(25, len(self.target))
+        self.assertEqual(self.source['doc07'].rev, self.target['doc07'].rev)
+
+    def test_open_revs(self):
+        repl = replicator.Replicator(self.source, self.target, batch_size=10)
+        repl._bulk_get = False
+        repl.run()
+        self.assertEqual(25, len(self.target))
+        self.assertEqual(self.source['doc07'].rev, self.target['doc07'].rev)
+
+    def test_checkpoint(self):
+        replicator.Replicator(self.source, self.target, batch_size=10).run()
+        doc = self.source['doc03']
+        doc['idx'] = 'changed'
+        self.source.save(doc)
+        del self.source['doc04']
+
+        repl = replicator.Replicator(self.source, self.target, batch_size=10)
+        repl.run()
+        self.assertEqual(2, repl.docs_read)
+        self.assertEqual(2, repl.docs_written)
+        self.assertEqual('changed', self.target['doc03']['idx'])
+        self.assertEqual(doc.rev, self.target['doc03'].rev)
+        self.assertEqual(None, self.target.get('doc04'))
+
+    def test_filter_transform(self):
+        def _transform(doc):
+            doc['copy'] = True
+            return doc
+        repl = replicator.Replicator(self.source, self.target,
+                                     filter=lambda doc: doc['idx'] % 5 == 0,
+                                     transform=_transform)
+        repl.run()
+        self.assertEqual(['doc00', 'doc05', 'doc10', 'doc15', 'doc20'],
+                         list(self.target))
+        self.assertTrue(self.target['doc05']['copy'])
+
+    def test_rejected(self):
+        post_json = self.target.resource.post_json
+        def _post_json(path, body=None, **kwargs):
+            status, headers, data = post_json(path, body=body, **kwargs)
+            if path == '_bulk_docs' and '"doc07"' in body:
+                data = [{'id': 'doc07', 'error': 'forbidden',
+                         'reason': 'denied'}]
+            return status, headers, data
+        self.target.resource.post_json = _post_json
+        repl = replicator.Replicator(self.source, self.target, batch_size=10)
+        self.assertRaises(http.ServerError, repl.run)
+        # The changes of the rejected revision are replicated again
+        self.assertEqual(None, self.target.get('_local/' +
+                                               repl.replication_id))
+
+    def test_pipelined(self):
+        repl = replicator.Replicator(self.source, self.target, batch_size=5,
+                                     workers=3)
+        self.assertEqual(self.source.info()['update_seq'], repl.run())
+        self.assertEqual(25, len(self.target))
+        self.assertEqual(self.source.info()['update_seq'],
+                         self.target['_local/' +
+                                     repl.replication_id]['source_last_seq'])
+
+    def test_error(self):
+        self.server.delete(self.target.name)
+        del self.temp_dbs[self.target.name]
+        repl = replicator.Replicator(self.source, self.target)
+        self.assertRaises(Exception, repl.run)
+
+
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(ReplicatorTestCase, 'test'))
+    suite.addTest(doctest.DocTestSuite(replicator))
+    return suite
+
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
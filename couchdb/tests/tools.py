@@ -8,23 +8,278 @@
 #
 
 
+import doctest
+import os
+import shutil
+import tempfile
+import time
 import unittest
 from StringIO import StringIO
 
-from couchdb.tools import load
+from couchdb import http, json
+from couchdb.multipart import read_multipart
+from couchdb.tools import checkpoint, dump, load, replicate
+from couchdb.tools import compression as compression_module
+from couchdb.tools.compression import open_decompressed
+from couchdb.tools.checkpoint import read_checkpoint, write_checkpoint
 from couchdb.tests import testutil
 
 class ToolLoadTestCase(testutil.TempDatabaseMixin, unittest.TestCase):
 
+    def setUp(self):
+        testutil.TempDatabaseMixin.setUp(self)
+        self.tempdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+        testutil.TempDatabaseMixin.tearDown(self)
+
     def test_handle_credentials(self):
         # Issue 194: couchdb-load attribute error: 'Resource' object has no attribute 'http'
         # http://code.google.com/p/couchdb-python/issues/detail?id=194
         load.load_db(StringIO(''), self.db.resource.url, 'foo', 'bar')
 
+    def _dump(self, **options):
+        source = self.server.create('python-tests-load-source')
+        try:
+            for idx in range(10):
+                source['doc%02d' % idx] = {'idx': idx}
+            source.put_attachment(source['doc03'], 'Foo bar', 'foo.txt',
+                                  'text/plain')
+            output = StringIO()
+            dump.dump_db(source.resource.url, output=output, **options)
+        finally:
+            del self.server['python-tests-load-source']
+        output.seek(0)
+        return output
+
+    def test_load(self):
+        load.load_db(self._dump(), self.db.resource.url, batch_size=4,
+                     jobs=2)
+        self.assertEqual(10, len(self.db))
+        self.assertEqual(3, self.db['doc03']['idx'])
+        self.assertEqual('Foo bar',
+                         self.db.get_attachment('doc03', 'foo.txt').read())
+
+    def test_load_compressed(self):
+        load.load_db(self._dump(compression='gzip'), self.db.resource.url)
+        self.assertEqual(10, len(self.db))
+        self.assertEqual('Foo bar',
+                         self.db.get_attachment('doc03', 'foo.txt').read())
+
+    def test_load_resume(self):
+        checkpoint = os.path.join(self.tempdir, 'load.checkpoint')
+        write_checkpoint(checkpoint, {'count': 6, 'last_id': 'doc05'})
+        load.load_db(self._dump(), self.db.resource.url, batch_size=3,
+                     checkpoint=checkpoint, resume=True)
+        self.assertEqual(['doc06', 'doc07', 'doc08', 'doc09'], list(self.db))
+        self.assertEqual(None, read_checkpoint(checkpoint))
+
+    def test_load_checkpoint(self):
+        checkpoint = os.path.join(self.tempdir, 'load.checkpoint')
+        saved = []
+        write_checkpoint = load.write_checkpoint
+        def _write_checkpoint(path, state):
+            saved.append((state, len(self.db)))
+            write_checkpoint(path, state)
+        read_docs = load._read_docs
+        def _read_docs(fileobj):
+            # Give the requests of the previous batches time to complete
+            for doc in read_docs(fileobj):
+                time.sleep(.05)
+                yield doc
+        load.write_checkpoint = _write_checkpoint
+        load._read_docs = _read_docs
+        try:
+            load.load_db(self._dump(), self.db.resource.url, batch_size=3,
+                         jobs=2, checkpoint=checkpoint,
+                         checkpoint_interval=2)
+        finally:
+            load.write_checkpoint = write_checkpoint
+            load._read_docs = read_docs
+        self.assertTrue(saved)
+        for state, loaded in saved:
+            # Only documents that have been saved are recorded
+            self.assertTrue(0 < state['count'] <= loaded)
+            self.assertEqual('doc%02d' % (state['count'] - 1),
+                             state['last_id'])
+
+    def test_load_progress(self):
+        progress = load._Progress(2)
+        progress.done(5, 'doc04')
+        progress.done(4, 'doc03')
+        self.assertEqual({'count': 2, 'last_id': None}, progress.state())
+        progress.done(3, 'doc02')
+        self.assertEqual({'count': 5, 'last_id': 'doc04'}, progress.state())
+
+    def test_load_error_not_hidden(self):
+        def _read_docs(fileobj):
+            yield {'_id': 'doc00'}
+            raise ValueError('invalid input')
+        read_docs = load._read_docs
+        load._read_docs = _read_docs
+        try:
+            # Sending the buffered document would fail with a socket error
+            self.assertRaises(ValueError, load.load_db, StringIO(''),
+                              'http://127.0.0.1:1/python-tests')
+        finally:
+            load._read_docs = read_docs
+
+    def test_load_conflicts(self):
+        self.db['doc05'] = {'idx': 'existing'}
+        self.assertRaises(http.ResourceConflict, load.load_db, self._dump(),
+                          self.db.resource.url, batch_size=4)
+        self.assertEqual(10, len(self.db))
+        self.assertEqual('existing', self.db['doc05']['idx'])
+
+    def test_load_ignore_errors(self):
+        self.db['doc05'] = {'idx': 'existing'}
+        load.load_db(self._dump(), self.db.resource.url, ignore_errors=True)
+        self.assertEqual(10, len(self.db))
+
+
+class ToolDumpTestCase(testutil.TempDatabaseMixin, unittest.TestCase):
+
+    def setUp(self):
+        testutil.TempDatabaseMixin.setUp(self)
+        for idx in range(10):
+            self.db['doc%02d' % idx] = {'idx': idx}
+        self.db.put_attachment(self.db['doc03'], 'Foo bar', 'foo.txt',
+                               'text/plain')
+        self.tempdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+        testutil.TempDatabaseMixin.tearDown(self)
+
+    def _dump(self, output=None, **options):
+        if output is None:
+            output = StringIO()
+        dump.dump_db(self.db.resource.url, output=output, **options)
+        output.seek(0)
+        parts = []
+        for headers, is_multipart, payload in read_multipart(
+                open_decompressed(output)):
+            if is_multipart:
+                payload = list(payload)
+            parts.append((dict(headers), is_multipart, payload))
+        return parts
+
+    def _check(self, parts):
+        self.assertEqual(['doc%02d' % idx for idx in range(10)],
+                         [headers['content-id'] for headers, _, _ in parts])
+        headers, is_multipart, payload = parts[3]
+        self.assertTrue(is_multipart)
+        self.assertEqual(3, json.decode(payload[0][2])['idx'])
+        self.assertEqual('foo.txt', payload[1][0]['content-id'])
+        self.assertEqual('Foo bar', payload[1][2])
+
+    def test_dump(self):
+        self._check(self._dump(batch_size=4))
+
+    def test_dump_jobs(self):
+        self._check(self._dump(batch_size=4, jobs=3))
+
+    def test_dump_compressed(self):
+        for compression in ('gzip', 'zlib'):
+            output = StringIO()
+            self._check(self._dump(output, compression=compression))
+            self.assertEqual(compression,
+                             compression_module._detect(output.getvalue()))
+
+    def test_dump_resume(self, compression=None):
+        checkpoint = os.path.join(self.tempdir, 'dump.checkpoint')
+        output = StringIO()
+        write_doc = dump._write_doc
+        def _write_doc(envelope, doc):
+            if doc.id == 'doc06':
+                raise IOError('interrupted')
+            write_doc(envelope, doc)
+        dump._write_doc = _write_doc
+        try:
+            self.assertRaises(IOError, dump.dump_db, self.db.resource.url,
+                              output=output, checkpoint=checkpoint,
+                              checkpoint_interval=4, compression=compression)
+        finally:
+            dump._write_doc = write_doc
+        self.assertEqual('doc03', read_checkpoint(checkpoint)['last_id'])
+        self._check(self._dump(output, checkpoint=checkpoint, resume=True,
+                               batch_size=3))
+        self.assertEqual(None, read_checkpoint(checkpoint))
+
+    def test_dump_resume_compressed(self):
+        self.test_dump_resume('gzip')
+
+    def test_dump_since(self):
+        since = self.db.info()['update_seq']
+        self.db['doc07'] = self.db['doc07']
+        del self.db['doc08']
+        self.db['doc10'] = {'idx': 10}
+        parts = self._dump(since=since, batch_size=1)
+        self.assertEqual(['doc07', 'doc10'],
+                         [headers['content-id'] for headers, _, _ in parts])
+
+    def test_handle_credentials(self):
+        dump.dump_db(self.db.resource.url, 'foo', 'bar', output=StringIO())
+
+
+class ToolReplicateTestCase(testutil.TempDatabaseMixin, unittest.TestCase):
+
+    def _replicate(self, source, target, **options):
+        sbase = self.server.resource.url + '/'
+        return replicate.replicate_db(self.server, self.server, sbase, source,
+                                      target, **options)
+
+    def test_replicate_db(self):
+        name, db = self.temp_db()
+        db['foo'] = {'bar': 42}
+        target = name + '-copy'
+        result = self._replicate(name, target)
+        self.temp_dbs[target] = self.server[target]
+        self.assertEqual(None, result['error'])
+        self.assertTrue(result['created'])
+        self.assertEqual(1, result['docs'])
+        self.assertEqual(42, self.server[target]['foo']['bar'])
+
+    def test_skip_up_to_date(self):
+        name, db = self.temp_db()
+        target, _ = self.temp_db()
+        db['foo'] = {'bar': 42}
+        result = self._replicate(name, target, skip_up_to_date=True)
+        self.assertFalse(result['skipped'])
+        result = self._replicate(name, target, skip_up_to_date=True)
+        self.assertTrue(result['skipped'])
+        db['baz'] = {}
+        result = self._replicate(name, target, skip_up_to_date=True)
+        self.assertFalse(result['skipped'])
+        self.assertEqual(2, result['docs'])
+
+    def test_client_side(self):
+        name, db = self.temp_db()
+        target, _ = self.temp_db()
+        db['foo'] = {'bar': 42}
+        result = self._replicate(name, target, client_side=True,
+                                 skip_up_to_date=True)
+        self.assertEqual(None, result['error'])
+        self.assertEqual(1, result['docs'])
+        self.assertEqual(db['foo'].rev, self.server[target]['foo'].rev)
+        result = self._replicate(name, target, client_side=True,
+                                 skip_up_to_date=True)
+        self.assertTrue(result['skipped'])
+
+    def test_error(self):
+        name, _ = self.temp_db()
+        result = self._replicate(name + '-missing', name)
+        self.assertTrue(isinstance(result['error'], http.ResourceNotFound))
+
 
 def suite():
     suite = unittest.TestSuite()
     suite.addTest(unittest.makeSuite(ToolLoadTestCase, 'test'))
+    suite.addTest(unittest.makeSuite(ToolDumpTestCase, 'test'))
+    suite.addTest(unittest.makeSuite(ToolReplicateTestCase, 'test'))
+    suite.addTest(doctest.DocTestSuite(checkpoint))
+    suite.addTest(doctest.DocTestSuite(compression_module))
     return suite
 
 
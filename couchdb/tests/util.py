@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution.
+
+import doctest
+import threading
+import time
+import unittest
+
+from couchdb import util
+
+
+class WorkerPoolTestCase(unittest.TestCase):
+
+    def test_exception(self):
+        pool = util.WorkerPool(1)
+        result = pool.submit(int, 'foo')
+        self.assertRaises(ValueError, result.get)
+        self.assertTrue(result.ready())
+
+    def test_concurrent(self):
+        # All four calls must be running at the same time for any of them
+        # to return
+        barrier = []
+        lock = threading.Lock()
+        def wait():
+            lock.acquire()
+            barrier.append(None)
+            lock.release()
+            while len(barrier) < 4:
+                time.sleep(.01)
+            return len(barrier)
+        pool = util.WorkerPool(4)
+        results = [pool.submit(wait) for i in range(4)]
+        self.assertEqual([result.get() for result in results], [4] * 4)
+
+    def test_imap_order(self):
+        def delayed(i):
+            time.sleep((5 - i) * .01)
+            return i
+        pool = util.WorkerPool(5)
+        self.assertEqual(list(pool.imap(delayed, range(5))), range(5))
+
+    def test_imap_lazy(self):
+        consumed = []
+        def items():
+            for i in range(100):
+                consumed.append(i)
+                yield i
+        pool = util.WorkerPool(2)
+        iterator = pool.imap(lambda i: i, items(), window=4)
+        iterator.next()
+        self.assertTrue(len(consumed) <= 5)
+
+    def test_close(self):
+        pool = util.WorkerPool(2)
+        results = [pool.submit(time.sleep, .01) for i in range(4)]
+        pool.close()
+        pool.join()
+        self.assertEqual([result.ready() for result in results], [True] * 4)
+
+
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(doctest.DocTestSuite(util))
+    suite.addTest(unittest.makeSuite(WorkerPoolTestCase, 'test'))
+    return suite
+
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
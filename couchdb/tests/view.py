@@ -7,10 +7,13 @@
 # you should have received as part of this distribution.
 
 import doctest
+import logging
+import os
 from StringIO import StringIO
+import tempfile
 import unittest
 
-from couchdb import view
+from couchdb import json, view
 
 
 class ViewServerTestCase(unittest.TestCase):
@@ -45,6 +48,65 @@ class ViewServerTestCase(unittest.TestCase):
                          'true\n'
                          '[[["b\xc3\xa5r", {"test": "b\xc3\xa5r"}]]]\n')
 
+    def test_i18n_ascii_output(self):
+        input = StringIO('["add_fun", "def fun(doc): yield doc[\\"test\\"], doc"]\n'
+                         '["map_doc", {"test": "b\xc3\xa5r"}]\n')
+        output = StringIO()
+        view.run(input=input, output=output, ascii_output=True)
+        self.assertEqual(output.getvalue(),
+                         'true\n'
+                         '[[["b\\u00e5r", {"test": "b\\u00e5r"}]]]\n')
+
+    def test_pipelined_input(self):
+        # Input read from a file is available without blocking, so that the
+        # responses are only written at the end
+        class Output(StringIO):
+            writes = 0
+            def write(self, data):
+                self.writes += 1
+                StringIO.write(self, data)
+        fd, path = tempfile.mkstemp()
+        try:
+            os.write(fd, '["add_fun", "def fun(doc): yield None, doc"]\n' +
+                         '["map_doc", {"foo": "bar"}]\n' * 3)
+            os.close(fd)
+            input = open(path)
+            output = Output()
+            try:
+                view.run(input=input, output=output)
+            finally:
+                input.close()
+        finally:
+            os.remove(path)
+        self.assertEqual(output.getvalue(),
+                         'true\n' + '[[[null, {"foo": "bar"}]]]\n' * 3)
+        self.assertEqual(1, output.writes)
+
+    def test_map_doc_workers(self):
+        funs = ['def fun(doc): log(%d); yield %d, doc["foo"]' % (idx, idx)
+                for idx in range(3)]
+        funs.append('def fun(doc): log(\'running\'); yield None, 1 / 0')
+        commands = [['add_fun', fun] for fun in funs] + [
+            ['map_doc', {'foo': 'bar'}],
+            ['reset'],
+            ['add_fun', funs[1]],
+            ['map_doc', {'foo': u'b\xe5r'}],
+        ]
+        input = '\n'.join([json.encode_bytes(cmd) for cmd in commands])
+        outputs = []
+        for workers in (None, 3):
+            output = StringIO()
+            view.run(input=StringIO(input), output=output, workers=workers)
+            outputs.append(output.getvalue())
+        self.assertEqual(outputs[0], outputs[1])
+        lines = outputs[1].splitlines()
+        # The messages are in the order of the functions
+        self.assertEqual(['{"log": "0"}', '{"log": "1"}', '{"log": "2"}',
+                          '{"log": "running"}'], lines[4:8])
+        self.assertEqual('[[[0, "bar"]], [[1, "bar"]], [[2, "bar"]], []]',
+                         lines[9])
+        self.assertEqual('[[[1, "b\xc3\xa5r"]]]', lines[13])
+
     def test_map_doc_with_logging(self):
         fun = 'def fun(doc): log(\'running\'); yield None, doc'
         input = StringIO('["add_fun", "%s"]\n'
@@ -102,6 +164,193 @@ class ViewServerTestCase(unittest.TestCase):
         self.assertEqual(output.getvalue(),
                          '[true, [0]]\n')
 
+    def _reduce(self, *commands):
+        input = StringIO(''.join([json.encode_bytes(cmd) + '\n'
+                                  for cmd in commands]))
+        output = StringIO()
+        view.run(input=input, output=output)
+        return [json.decode(line) for line in output.getvalue().splitlines()]
+
+    def test_reduce_builtins(self):
+        kvs = [[[key, 'doc%d' % key], key] for key in range(1, 5)]
+        self.assertEqual([[True, [10, 4, {'sum': 10, 'count': 4, 'min': 1,
+                                          'max': 4, 'sumsqr': 30}]]],
+                         self._reduce(['reduce', ['_sum', '_count', '_stats'],
+                                       kvs]))
+
+    def test_rereduce_builtins(self):
+        stats = [{'sum': 3, 'count': 2, 'min': 1, 'max': 2, 'sumsqr': 5},
+                 {'sum': 7, 'count': 2, 'min': 3, 'max': 4, 'sumsqr': 25}]
+        self.assertEqual([[True, [10]], [True, [4]],
+                          [True, [{'sum': 10, 'count': 4, 'min': 1, 'max': 4,
+                                   'sumsqr': 30}]]],
+                         self._reduce(['rereduce', ['_sum'], [3, 7]],
+                                      ['rereduce', ['_count'], [2, 2]],
+                                      ['rereduce', ['_stats'], stats]))
+
+    def test_reduce_builtin_arrays(self):
+        kvs = [[None, [1, 2]], [None, [3, 4, 5]], [None, 6]]
+        self.assertEqual([[True, [[10, 6, 5]]]],
+                         self._reduce(['reduce', ['_sum'], kvs]))
+        kvs = [[None, [1, 2]], [None, [3, 4]]]
+        result = self._reduce(['reduce', ['_stats'], kvs])
+        self.assertEqual([4, 6], [stats['sum'] for stats in result[0][1][0]])
+
+    def test_reduce_builtin_floats(self):
+        kvs = [[None, idx / 2.0] for idx in range(1000)]
+        result = self._reduce(['reduce', ['_stats'], kvs])[0][1][0]
+        self.assertEqual({'sum': 249750.0, 'count': 1000, 'min': 0.0,
+                          'max': 499.5, 'sumsqr': 83208375.0}, result)
+
+    def test_reduce_builtin_error(self):
+        result = self._reduce(['reduce', ['_sum'], [[None, 'foo']]])
+        self.assertEqual('builtin_reduce_error', result[0]['error']['id'])
+
+    def test_reduce_builtin_stats_mixed(self):
+        for values in ([[1, 2], 3], [3, [1, 2]], [[1, 2], [3]]):
+            result = self._reduce(['reduce', ['_stats'],
+                                   [[None, value] for value in values]],
+                                  ['reset'])
+            self.assertEqual('builtin_reduce_error',
+                             result[0]['error']['id'])
+            self.assertEqual(True, result[1])
+
+    def test_approx_count_distinct(self):
+        kvs = [[[key % 3000, 'doc%d' % key], None] for key in range(6000)]
+        result = self._reduce(['reduce', ['_approx_count_distinct'],
+                               kvs[:4000]],
+                              ['reduce', ['_approx_count_distinct'],
+                               kvs[4000:]])
+        counts = [reduction[1][0]['count'] for reduction in result]
+        self.assertTrue(2800 < counts[0] < 3200)
+        self.assertTrue(1900 < counts[1] < 2100)
+        result = self._reduce(['rereduce', ['_approx_count_distinct'],
+                               [reduction[1][0] for reduction in result]])
+        self.assertTrue(2800 < result[0][1][0]['count'] < 3200)
+
+    def test_function_cache(self):
+        # The compiled code is reused, but the function is defined anew, so
+        # that its mutable default argument does not survive a reset or
+        # get shared with another function of the same source
+        fun = 'def fun(doc, calls=[]): calls.append(1); yield None, len(calls)'
+        input = StringIO('["add_fun", "%s"]\n'
+                         '["add_fun", "%s"]\n'
+                         '["map_doc", {}]\n'
+                         '["reset"]\n'
+                         '["add_fun", "%s"]\n'
+                         '["map_doc", {}]\n' % (fun, fun, fun))
+        output = StringIO()
+        view.run(input=input, output=output)
+        self.assertEqual(output.getvalue(),
+                         'true\n'
+                         'true\n'
+                         '[[[null, 1]], [[null, 1]]]\n'
+                         'true\n'
+                         'true\n'
+                         '[[[null, 1]]]\n')
+
+    def test_function_cache_globals(self):
+        fun = ('def fun(doc):\\n    global seen\\n'
+               '    try:\\n        seen += 1\\n'
+               '    except NameError:\\n        seen = 1\\n'
+               '    yield None, seen')
+        input = StringIO('["add_fun", "%s"]\n'
+                         '["map_doc", {}]\n'
+                         '["map_doc", {}]\n'
+                         '["reset"]\n'
+                         '["add_fun", "%s"]\n'
+                         '["map_doc", {}]\n' % (fun, fun))
+        output = StringIO()
+        view.run(input=input, output=output)
+        self.assertEqual(output.getvalue().splitlines()[1:],
+                         ['[[[null, 1]]]', '[[[null, 2]]]', 'true', 'true',
+                          '[[[null, 1]]]'])
+
+    def test_function_cache_reduce(self):
+        messages = []
+        class Handler(logging.Handler):
+            def emit(self, record):
+                messages.append(record.getMessage())
+        handler = Handler()
+        view.log.addHandler(handler)
+        level = view.log.level
+        view.log.setLevel(logging.DEBUG)
+        try:
+            cmd = ('["reduce", ["def fun(keys, values): return sum(values)"], '
+                   '[[null, 1], [null, 2]]]\n')
+            input = StringIO(cmd * 3 + '["reset"]\n')
+            output = StringIO()
+            view.run(input=input, output=output)
+        finally:
+            view.log.removeHandler(handler)
+            view.log.setLevel(level)
+        self.assertEqual(output.getvalue(), '[true, [3]]\n' * 3 + 'true\n')
+        self.assertTrue('Function cache: 2 hits, 1 misses' in messages)
+
+    def test_function_cache_eviction(self):
+        cache = view._FunctionCache(2)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        cache.get('a') # 'b' is now the least recently used function
+        cache.put('c', 3)
+        self.assertEqual(None, cache.get('b'))
+        self.assertEqual(1, cache.get('a'))
+        self.assertEqual(3, cache.get('c'))
+
+    def _profile(self, commands, **options):
+        fd, path = tempfile.mkstemp()
+        os.close(fd)
+        try:
+            input = '\n'.join([json.encode_bytes(cmd) for cmd in commands])
+            output = StringIO()
+            view.run(input=StringIO(input), output=output, profile=path,
+                     **options)
+            fileobj = open(path)
+            try:
+                return output.getvalue(), fileobj.read().splitlines()
+            finally:
+                fileobj.close()
+        finally:
+            os.remove(path)
+
+    def test_profile(self):
+        commands = [
+            ['add_fun', 'def fun(doc): yield doc["foo"], 1'],
+            ['add_fun', 'def fun(doc): return []'],
+            ['map_doc', {'foo': 'bar'}],
+            ['map_doc', {'foo': 'baz'}],
+            ['reduce', ['_sum'], [[['bar', 'doc1'], 1], [['baz', 'doc2'], 1]]],
+        ]
+        output, report = self._profile(commands)
+        self.assertEqual('true\ntrue\n[[["bar", 1]], []]\n'
+                         '[[["baz", 1]], []]\n[true, [2]]\n', output)
+        entries = dict([(line.split(None, 6)[-1], line.split()[:2])
+                        for line in report[2:]])
+        self.assertEqual(['map', '2'], entries[[label for label in entries
+                                                if 'yield' in label][0]])
+        self.assertEqual(['reduce', '1'], entries[[label for label in entries
+                                                   if '_sum' in label][0]])
+        self.assertEqual(3, len(entries))
+
+    def test_profile_workers(self):
+        commands = [
+            ['add_fun', 'def fun(doc): yield None, doc'],
+            ['map_doc', {'foo': 'bar'}],
+        ]
+        output, report = self._profile(commands, workers=2)
+        self.assertEqual('true\n[[[null, {"foo": "bar"}]]]\n', output)
+        self.assertEqual(3, len(report))
+        self.assertTrue('(1 map functions in 2 workers)' in report[2])
+
+    def test_profile_stats(self):
+        fd, path = tempfile.mkstemp()
+        os.close(fd)
+        try:
+            self._profile([['reset']], profile_stats=path)
+            self.assertTrue(os.path.getsize(path) > 0)
+        finally:
+            os.remove(path)
+
 
 def suite():
     suite = unittest.TestSuite()
@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution.
+
+"""Checkpoint files recording the progress of `couchdb-dump` and
+`couchdb-load`, so that interrupted runs can be resumed.
+
+>>> import os, tempfile
+>>> path = os.path.join(tempfile.mkdtemp(), 'dump.checkpoint')
+>>> print read_checkpoint(path)
+None
+>>> write_checkpoint(path, {'last_id': 'foo'})
+>>> read_checkpoint(path)
+{u'last_id': u'foo'}
+>>> remove_checkpoint(path)
+>>> print read_checkpoint(path)
+None
+"""
+
+import os
+
+from couchdb import json
+
+__all__ = ['read_checkpoint', 'write_checkpoint', 'remove_checkpoint']
+__docformat__ = 'restructuredtext en'
+
+
+def read_checkpoint(path):
+    """Return the state saved in the checkpoint file at `path`, or `None` if
+    the file does not exist.
+    """
+    if not os.path.exists(path):
+        return None
+    fileobj = open(path, 'rb')
+    try:
+        return json.decode(fileobj.read())
+    finally:
+        fileobj.close()
+
+
+def write_checkpoint(path, state):
+    """Save `state` to the checkpoint file at `path`.
+
+    The state is written to a temporary file first which then replaces the
+    checkpoint file, so that an interruption never leaves a truncated file
+    behind.
+    """
+    tmppath = path + '.tmp'
+    fileobj = open(tmppath, 'wb')
+    try:
+        fileobj.write(json.encode(state))
+        fileobj.flush()
+        os.fsync(fileobj.fileno())
+    finally:
+        fileobj.close()
+    if os.name == 'nt' and os.path.exists(path):
+        os.remove(path)
+    os.rename(tmppath, path)
+
+
+def remove_checkpoint(path):
+    """Remove the checkpoint file at `path`, if it exists."""
+    if os.path.exists(path):
+        os.remove(path)
@@ -0,0 +1,220 @@
+# -*- coding: utf-8 -*-
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution.
+
+"""Streaming compression of the files written by `couchdb-dump`.
+
+Compressed output is written as a sequence of independent gzip members, zlib
+streams or zstd frames: every `CompressedWriter.flush` ends the current one, so
+that a file can be truncated at a flushed position and appended to later.
+
+>>> from StringIO import StringIO
+>>> buf = StringIO()
+>>> writer = CompressedWriter(buf, 'gzip')
+>>> writer.write('Just\\n')
+>>> writer.flush()
+>>> writer.write('testing\\n')
+>>> writer.flush()
+>>> buf.seek(0)
+>>> list(open_decompressed(buf))
+['Just\\n', 'testing\\n']
+
+Uncompressed input is passed through unchanged:
+
+>>> list(open_decompressed(StringIO('Just\\ntesting')))
+['Just\\n', 'testing']
+"""
+
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+__all__ = ['COMPRESSIONS', 'CompressedWriter', 'DecompressedReader',
+           'open_decompressed', 'guess_compression']
+__docformat__ = 'restructuredtext en'
+
+COMPRESSIONS = ('gzip', 'zlib', 'zstd')
+
+CHUNK_SIZE = 1024 * 64
+
+_EXTENSIONS = {'.gz': 'gzip', '.zz': 'zlib', '.zst': 'zstd'}
+
+
+def guess_compression(filename):
+    """Return the compression method implied by the extension of `filename`,
+    or `None`.
+
+    >>> guess_compression('backup.mime.gz')
+    'gzip'
+    >>> print guess_compression('backup.mime')
+    None
+    """
+    for extension, method in _EXTENSIONS.items():
+        if filename.endswith(extension):
+            return method
+    return None
+
+
+def _compressor(method, level):
+    if method == 'gzip':
+        return zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    elif method == 'zlib':
+        return zlib.compressobj(level)
+    elif method == 'zstd':
+        if zstandard is None:
+            raise ValueError('zstd compression requires the zstandard module')
+        return zstandard.ZstdCompressor(level=level).compressobj()
+    raise ValueError('unknown compression method %r' % method)
+
+
+def _decompressor(method):
+    if method == 'gzip':
+        return zlib.decompressobj(16 + zlib.MAX_WBITS)
+    elif method == 'zlib':
+        return zlib.decompressobj()
+    elif method == 'zstd':
+        if zstandard is None:
+            raise ValueError('zstd compression requires the zstandard module')
+        return zstandard.ZstdDecompressor().decompressobj()
+    raise ValueError('unknown compression method %r' % method)
+
+
+def _detect(head):
+    if isinstance(head, unicode): # text read from a StringIO
+        return None
+    elif head.startswith('\x1f\x8b'):
+        return 'gzip'
+    elif head.startswith('\x28\xb5\x2f\xfd'):
+        return 'zstd'
+    elif len(head) >= 2 and ord(head[0]) & 0x0f == 8 and \
+            (ord(head[0]) << 8 | ord(head[1])) % 31 == 0:
+        return 'zlib'
+    return None
+
+
+class CompressedWriter(object):
+    """Wrap a writable file-like object so that everything written to it is
+    compressed.
+
+    :param fileobj: the file-like object to write the compressed data to
+    :param method: the compression method, one of `COMPRESSIONS`
+    :param level: the compression level, or `None` for the default of the
+                  method
+    """
+
+    def __init__(self, fileobj, method, level=None):
+        if level is None:
+            level = method == 'zstd' and 3 or 6
+        self.fileobj = fileobj
+        self.method = method
+        self.level = level
+        self._compressor = None
+        _compressor(method, level) # fail early for unsupported methods
+
+    def write(self, data):
+        if isinstance(data, unicode):
+            data = data.encode('utf-8')
+        if self._compressor is None:
+            self._compressor = _compressor(self.method, self.level)
+        data = self._compressor.compress(data)
+        if data:
+            self.fileobj.write(data)
+
+    def flush(self):
+        """End the current gzip member, zlib stream or zstd frame and flush
+        the underlying file.
+        """
+        if self._compressor is not None:
+            self.fileobj.write(self._compressor.flush())
+            self._compressor = None
+        self.fileobj.flush()
+
+    def close(self):
+        """Flush the compressed data; the underlying file is not closed."""
+        self.flush()
+
+
+class DecompressedReader(object):
+    """Read the decompressed data of a file-like object line by line.
+
+    Use `open_decompressed` to create instances.
+    """
+
+    def __init__(self, fileobj, method, head=''):
+        self.fileobj = fileobj
+        self.method = method
+        self._raw = head
+        self._decompressor = None
+        self._buf = ''
+        self._pos = 0
+
+    def _fill(self):
+        # Decompress more data into the buffer, returning whether there was
+        # any input left
+        raw = self._raw or self.fileobj.read(CHUNK_SIZE)
+        self._raw = ''
+        if not raw:
+            return False
+        if self.method is None:
+            self._buf += raw
+            return True
+        while raw:
+            if self._decompressor is None:
+                self._decompressor = _decompressor(self.method)
+            self._buf += self._decompressor.decompress(raw)
+            # Data following the end of a member or frame belongs to the
+            # next one
+            raw = self._decompressor.unused_data
+            if raw or getattr(self._decompressor, 'eof', False):
+                self._decompressor = None
+        return True
+
+    def _compact(self):
+        self._buf = self._buf[self._pos:]
+        self._pos = 0
+
+    def read(self, size=-1):
+        self._compact()
+        while size < 0 or len(self._buf) < size:
+            if not self._fill():
+                break
+        if size < 0:
+            size = len(self._buf)
+        data, self._buf = self._buf[:size], self._buf[size:]
+        return data
+
+    def readline(self):
+        pos = self._buf.find('\n', self._pos)
+        while pos < 0:
+            self._compact()
+            start = len(self._buf)
+            if not self._fill():
+                line, self._buf = self._buf, ''
+                return line
+            pos = self._buf.find('\n', start)
+        line = self._buf[self._pos:pos + 1]
+        self._pos = pos + 1
+        return line
+
+    def __iter__(self):
+        while True:
+            line = self.readline()
+            if not line:
+                break
+            yield line
+
+
+def open_decompressed(fileobj):
+    """Return a file-like object reading the decompressed data of `fileobj`,
+    detecting the compression method from the first bytes of the data.
+
+    :param fileobj: a readable file-like object, which does not need to be
+                    seekable
+    :rtype: `DecompressedReader`
+    """
+    head = fileobj.read(4)
+    return DecompressedReader(fileobj, _detect(head), head)
@@ -13,51 +13,177 @@ file.
 
 from base64 import b64decode
 from optparse import OptionParser
+import os
+from StringIO import StringIO
 import sys
+import time
 
 from couchdb import __version__ as VERSION
 from couchdb import json
-from couchdb.client import Database
+from couchdb.client import Database, Document
 from couchdb.multipart import write_multipart
+from couchdb.tools.compression import COMPRESSIONS, CompressedWriter, \
+                                      guess_compression
+from couchdb.tools.checkpoint import read_checkpoint, write_checkpoint, \
+                                     remove_checkpoint
+from couchdb.util import WorkerPool
 
 
 def dump_db(dburl, username=None, password=None, boundary=None,
-            output=sys.stdout):
+            output=sys.stdout, jobs=1, batch_size=1000, since=None,
+            checkpoint=None, resume=False, checkpoint_interval=1000,
+            compression=None):
+    """Write the documents of a database, including their attachments, to
+    `output` as a multipart MIME envelope.
+
+    Documents are requested in batches of `batch_size` from ``_all_docs``.
+    Only documents with attachments need to be requested again, which is done
+    by `jobs` threads concurrently; the documents are nevertheless written in
+    the order of their IDs.
+
+    If `since` is given, only the documents changed after that update
+    sequence are dumped, in the order of the changes feed. Deleted documents
+    are left out, as the dump format has no way to represent them.
+
+    If a `checkpoint` file name is given, the progress is saved to that file
+    every `checkpoint_interval` documents, and the file is removed once the
+    dump is complete. With `resume` set, a dump that was interrupted continues
+    after the last saved checkpoint; `output` must then be the file written
+    before, opened for updating.
+
+    The output is compressed if `compression` is one of the methods listed in
+    `compression.COMPRESSIONS`.
+    """
     db = Database(dburl)
     if username is not None and password is not None:
-        db.resource.http.add_credentials(username, password)
+        db.resource.credentials = (username, password)
 
-    envelope = write_multipart(output, boundary=boundary)
-    for docid in db:
+    state = None
+    if resume and checkpoint is not None:
+        state = read_checkpoint(checkpoint)
+    if state is not None:
+        boundary = state['boundary']
+        since = state.get('since')
+        compression = state.get('compression')
+        output.seek(state['offset'])
+        output.truncate()
+        print >> sys.stderr, 'Resuming dump at offset %d' % state['offset']
 
-        doc = db.get(docid, attachments=True)
-        print >> sys.stderr, 'Dumping document %r' % doc.id
-        attachments = doc.pop('_attachments', {})
-        jsondoc = json.encode(doc)
+    stream = output
+    if compression is not None:
+        stream = CompressedWriter(output, compression)
+    if state is not None:
+        envelope = _resume_multipart(stream, boundary)
+    else:
+        envelope = write_multipart(stream, boundary=boundary)
+        stream.flush()
+        state = {'boundary': envelope.boundary, 'compression': compression,
+                 'offset': output.tell()}
+        if since is None:
+            state['last_id'] = None
+            state['seq'] = db.info()['update_seq']
+        else:
+            state['since'] = since
 
-        if attachments:
-            parts = envelope.open({
-                'Content-ID': doc.id,
-                'ETag': '"%s"' % doc.rev
-            })
-            parts.add('application/json', jsondoc)
+    def _fetch(item):
+        doc, position = item
+        if doc.get('_attachments'):
+            doc = db.get(doc.id, attachments=True)
+        return doc, position
 
-            for name, info in attachments.items():
-                content_type = info.get('content_type')
-                if content_type is None: # CouchDB < 0.8
-                    content_type = info.get('content-type')
-                parts.add(content_type, b64decode(info['data']), {
-                    'Content-ID': name
-                })
-            parts.close()
+    if since is None:
+        docs = _iter_all_docs(db, batch_size, state['last_id'], jobs > 1)
+        position_key = 'last_id'
+    else:
+        docs = _iter_changes(db, batch_size, state['since'], state)
+        position_key = 'since'
+    pool = None
+    if jobs > 1:
+        pool = WorkerPool(jobs)
+        docs = pool.imap(_fetch, docs)
+    else:
+        docs = (_fetch(item) for item in docs)
 
-        else:
-            envelope.add('application/json', jsondoc, {
-                'Content-ID': doc.id,
-                'ETag': '"%s"' % doc.rev
+    started = time.time()
+    count = 0
+    try:
+        for doc, position in docs:
+            _write_doc(envelope, doc)
+            count += 1
+            if checkpoint is not None and count % checkpoint_interval == 0:
+                stream.flush()
+                state['offset'] = output.tell()
+                state[position_key] = position
+                write_checkpoint(checkpoint, state)
+    finally:
+        if pool is not None:
+            pool.close()
+    envelope.close()
+    stream.flush()
+    if checkpoint is not None:
+        remove_checkpoint(checkpoint)
+
+    elapsed = time.time() - started
+    print >> sys.stderr, 'Dumped %d documents in %.1f seconds (%.1f docs/s), ' \
+                         'up to update sequence %s' % (
+        count, elapsed, count / max(elapsed, 0.001), state['seq']
+    )
+
+
+def _resume_multipart(fileobj, boundary):
+    # The header of the envelope was written before the interruption
+    envelope = write_multipart(StringIO(), boundary=boundary)
+    envelope.fileobj = fileobj
+    return envelope
+
+
+def _iter_all_docs(db, batch_size, last_id, prefetch):
+    options = {}
+    if last_id is not None:
+        options['startkey'] = last_id
+    rows = db.view('_all_docs', include_docs=True, **options)
+    for page in rows.iterpages(batch_size, prefetch=prefetch):
+        for row in page:
+            if row.id != last_id:
+                yield row.doc, row.id
+
+
+def _iter_changes(db, batch_size, since, state):
+    while True:
+        data = db.changes(since=since, limit=batch_size, include_docs=True)
+        for change in data['results']:
+            if not change.get('deleted'):
+                yield Document(change['doc']), change['seq']
+        since = state['seq'] = data['last_seq']
+        if len(data['results']) < batch_size:
+            break
+
+
+def _write_doc(envelope, doc):
+    attachments = doc.pop('_attachments', {})
+    jsondoc = json.encode(doc)
+
+    if attachments:
+        parts = envelope.open({
+            'Content-ID': doc.id,
+            'ETag': '"%s"' % doc.rev
+        })
+        parts.add('application/json', jsondoc)
+
+        for name, info in attachments.items():
+            content_type = info.get('content_type')
+            if content_type is None: # CouchDB < 0.8
+                content_type = info.get('content-type')
+            parts.add(content_type, b64decode(info['data']), {
+                'Content-ID': name
             })
+        parts.close()
 
-    envelope.close()
+    else:
+        envelope.add('application/json', jsondoc, {
+            'Content-ID': doc.id,
+            'ETag': '"%s"' % doc.rev
+        })
 
 
 def main():
@@ -69,16 +195,69 @@ def main():
                       help='the username to use for authentication')
     parser.add_option('-p', '--password', action='store', dest='password',
                       help='the password to use for authentication')
-    parser.set_defaults()
+    parser.add_option('-j', '--jobs', action='store', type='int',
+                      dest='jobs', default=1,
+                      help='the number of documents with attachments to '
+                           'fetch concurrently')
+    parser.add_option('--batch-size', action='store', type='int',
+                      dest='batch_size', default=1000,
+                      help='the number of documents to fetch per request')
+    parser.add_option('--output', action='store', dest='output',
+                      metavar='FILE',
+                      help='the name of the file to write to')
+    parser.add_option('--since', action='store', dest='since',
+                      metavar='SEQ',
+                      help='only dump the documents changed after this '
+                           'update sequence')
+    parser.add_option('--checkpoint', action='store', dest='checkpoint',
+                      metavar='FILE',
+                      help='the name of the file to save the progress to '
+                           '(defaults to the output file name with '
+                           '".checkpoint" appended)')
+    parser.add_option('--resume', action='store_true', dest='resume',
+                      help='continue an interrupted dump to the output file')
+    parser.add_option('--compress', action='store', dest='compression',
+                      type='choice', choices=COMPRESSIONS + ('none',),
+                      help='the compression method, one of "gzip", "zlib", '
+                           '"zstd" or "none" (defaults to the method implied '
+                           'by the extension of the output file name)')
+    parser.set_defaults(output='-')
     options, args = parser.parse_args()
 
     if len(args) != 1:
         return parser.error('incorrect number of arguments')
 
+    compression = options.compression
+    if compression is None and options.output != '-':
+        compression = guess_compression(options.output)
+    elif compression == 'none':
+        compression = None
+
+    checkpoint = options.checkpoint
+    if options.output != '-':
+        if checkpoint is None:
+            checkpoint = options.output + '.checkpoint'
+        if options.resume and os.path.exists(checkpoint):
+            output = open(options.output, 'r+b')
+        else:
+            output = open(options.output, 'wb')
+    elif options.resume or checkpoint is not None:
+        return parser.error('--checkpoint and --resume require --output')
+    else:
+        output = sys.stdout
+
     if options.json_module:
         json.use(options.json_module)
 
-    dump_db(args[0], username=options.username, password=options.password)
+    try:
+        dump_db(args[0], username=options.username,
+                password=options.password, output=output, jobs=options.jobs,
+                batch_size=options.batch_size, since=options.since,
+                checkpoint=checkpoint, resume=options.resume,
+                compression=compression)
+    finally:
+        if output is not sys.stdout:
+            output.close()
 
 
 if __name__ == '__main__':
@@ -14,19 +14,131 @@ file.
 from base64 import b64encode
 from optparse import OptionParser
 import sys
+from threading import Lock
+import time
 
 from couchdb import __version__ as VERSION
 from couchdb import json
 from couchdb.client import Database
 from couchdb.multipart import read_multipart
-
-
-def load_db(fileobj, dburl, username=None, password=None, ignore_errors=False):
+from couchdb.tools.compression import open_decompressed
+from couchdb.tools.checkpoint import read_checkpoint, write_checkpoint, \
+                                     remove_checkpoint
+
+
+def load_db(fileobj, dburl, username=None, password=None, ignore_errors=False,
+            batch_size=1000, batch_bytes=8 * 1024 * 1024, jobs=1,
+            checkpoint=None, resume=False, checkpoint_interval=1000):
+    """Load the documents from a multipart MIME envelope written by
+    `couchdb-dump` into a database. Compressed input is decompressed
+    transparently.
+
+    Documents are saved using ``_bulk_docs`` requests of at most `batch_size`
+    documents and `batch_bytes` bytes. Up to `jobs` requests are sent in
+    background threads while the input is still being parsed.
+
+    Documents that cannot be saved are reported on stderr without stopping
+    the load; unless `ignore_errors` is set, the error of the first of them
+    is raised once all other documents have been loaded.
+
+    If a `checkpoint` file name is given, the number of documents saved so far
+    is written to that file every `checkpoint_interval` documents, and the
+    file is removed once the load is complete. Only documents whose requests
+    have completed, along with all the documents before them, are counted, so
+    that writing a checkpoint does not wait for the pending requests. With
+    `resume` set, the documents up to the last saved checkpoint are skipped.
+    """
     db = Database(dburl)
     if username is not None and password is not None:
         db.resource.credentials = (username, password)
 
-    for headers, is_multipart, payload in read_multipart(fileobj):
+    errors = []
+    positions = {} # position in the input of the documents being sent
+    def _report(doc, result):
+        success, docid, rev_or_exc = result
+        if not success:
+            errors.append(rev_or_exc)
+            print>>sys.stderr, 'Error loading document %r: %s' % (docid,
+                                                                  rev_or_exc)
+        progress.done(positions.pop(doc['_id']), doc['_id'])
+
+    skip = 0
+    if resume and checkpoint is not None:
+        state = read_checkpoint(checkpoint)
+        if state is not None:
+            skip = state['count']
+            print>>sys.stderr, 'Resuming load after document %r' % (
+                state['last_id'],
+            )
+
+    progress = _Progress(skip)
+    writer = db.bulk_writer(batch_size=batch_size, max_bytes=batch_bytes,
+                            workers=jobs, callback=_report)
+    started = time.time()
+    count = saved = 0
+    try:
+        for doc in _read_docs(fileobj):
+            count += 1
+            if count <= skip:
+                continue
+            positions[doc['_id']] = count
+            writer.add(doc)
+            if checkpoint is not None and count % checkpoint_interval == 0:
+                state = progress.state()
+                if state['count'] > max(saved, skip):
+                    write_checkpoint(checkpoint, state)
+                    saved = state['count']
+    except:
+        # Do not send the remaining documents, which could fail as well and
+        # hide the original error
+        writer._shutdown()
+        raise
+    writer.close()
+    if checkpoint is not None:
+        remove_checkpoint(checkpoint)
+
+    elapsed = time.time() - started
+    print>>sys.stderr, 'Loaded %d documents in %d requests, %d failed, in ' \
+                       '%.1f seconds (%.1f docs/s)' % (
+        writer.written, writer.batches, writer.failed, elapsed,
+        writer.written / max(elapsed, 0.001)
+    )
+    if errors and not ignore_errors:
+        raise errors[0]
+
+
+class _Progress(object):
+    """Track the position in the input up to which all documents have been
+    saved, as the requests complete in any order.
+    """
+
+    def __init__(self, count):
+        self.count = count
+        self.last_id = None
+        self._done = {}
+        self._lock = Lock()
+
+    def done(self, position, docid):
+        self._lock.acquire()
+        try:
+            self._done[position] = docid
+            while self.count + 1 in self._done:
+                self.count += 1
+                self.last_id = self._done.pop(self.count)
+        finally:
+            self._lock.release()
+
+    def state(self):
+        self._lock.acquire()
+        try:
+            return {'count': self.count, 'last_id': self.last_id}
+        finally:
+            self._lock.release()
+
+
+def _read_docs(fileobj):
+    for headers, is_multipart, payload in read_multipart(
+            open_decompressed(fileobj)):
         docid = headers['content-id']
 
         if is_multipart: # doc has attachments
@@ -44,14 +156,9 @@ def load_db(fileobj, dburl, username=None, password=None, ignore_errors=False):
         else: # no attachments, just the JSON
             doc = json.decode(payload)
 
+        doc['_id'] = docid
         del doc['_rev']
-        print>>sys.stderr, 'Loading document %r' % docid
-        try:
-            db[docid] = doc
-        except Exception, e:
-            if not ignore_errors:
-                raise
-            print>>sys.stderr, 'Error: %s' % e
+        yield doc
 
 
 def main():
@@ -69,12 +176,34 @@ def main():
                       help='the username to use for authentication')
     parser.add_option('-p', '--password', action='store', dest='password',
                       help='the password to use for authentication')
+    parser.add_option('--batch-size', action='store', type='int',
+                      dest='batch_size', default=1000,
+                      help='the maximum number of documents to save per '
+                           'request')
+    parser.add_option('--batch-bytes', action='store', type='int',
+                      dest='batch_bytes', default=8 * 1024 * 1024,
+                      help='the maximum size in bytes of the documents saved '
+                           'per request')
+    parser.add_option('-j', '--jobs', action='store', type='int',
+                      dest='jobs', default=1,
+                      help='the number of requests to send concurrently')
+    parser.add_option('--checkpoint', action='store', dest='checkpoint',
+                      metavar='FILE',
+                      help='the name of the file to save the progress to '
+                           '(defaults to the input file name with '
+                           '".load-checkpoint" appended)')
+    parser.add_option('--resume', action='store_true', dest='resume',
+                      help='skip the documents loaded before an interruption')
     parser.set_defaults(input='-')
     options, args = parser.parse_args()
 
     if len(args) != 1:
         return parser.error('incorrect number of arguments')
 
+    checkpoint = options.checkpoint
+    if checkpoint is None and options.input != '-':
+        checkpoint = options.input + '.load-checkpoint'
+
     if options.input != '-':
         fileobj = open(options.input, 'rb')
     else:
@@ -84,7 +213,9 @@ def main():
         json.use(options.json_module)
 
     load_db(fileobj, args[0], username=options.username,
-            password=options.password, ignore_errors=options.ignore_errors)
+            password=options.password, ignore_errors=options.ignore_errors,
+            batch_size=options.batch_size, batch_bytes=options.batch_bytes,
+            jobs=options.jobs, checkpoint=checkpoint, resume=options.resume)
 
 
 if __name__ == '__main__':
@@ -17,7 +17,8 @@ CouchDB versions.
 Use 'python replicate.py --help' to get more detailed usage instructions.
 """
 
-from couchdb import http, client
+from couchdb import http, client, replicator, util
+from hashlib import md5
 import optparse
 import sys
 import time
@@ -25,6 +26,8 @@ import urllib
 import urlparse
 import fnmatch
 
+CHECKPOINT_PREFIX = '_local/couchdb-replicate-'
+
 def findpath(parser, s):
     '''returns (server url, path component)'''
 
@@ -42,7 +45,7 @@ def findpath(parser, s):
     cut = None
     for i in range(0, len(parts) + 1):
         try:
-            data = res.get_json(parts[:i])[2]
+            data = res(*parts[:i]).get_json()[2]
         except Exception:
             data = None
         if data and 'couchdb' in data:
@@ -54,6 +57,66 @@ def findpath(parser, s):
     base = res.url + (parts[:cut] and '/'.join(parts[:cut]) or '')
     return base, '/'.join(parts[cut:])
 
+def replicate_db(source, target, sbase, sdb, tdb, continuous=False,
+                 skip_up_to_date=False, client_side=False, max_rate=None):
+    '''replicates database sdb of the source server to database tdb of the
+    target server, creating it if needed, and returns a dict describing the
+    outcome
+
+    With skip_up_to_date, the update sequence of the source database is
+    saved in a _local document of the target database after replicating,
+    and replication is skipped if it has not changed since.
+
+    With client_side, the documents are replicated by this process using a
+    couchdb.replicator.Replicator instead of by the target server, optionally
+    limited to max_rate documents per second.'''
+
+    start = time.time()
+    result = {'source': sdb, 'target': tdb, 'created': False,
+              'skipped': False, 'docs': None, 'error': None}
+    surl = '%s%s' % (sbase, urllib.quote(sdb, ''))
+    try:
+        if tdb not in target:
+            target.create(tdb)
+            result['created'] = True
+        tdatabase = target[tdb]
+
+        if skip_up_to_date:
+            seq = source[sdb].info()['update_seq']
+            checkpoint_id = CHECKPOINT_PREFIX + md5(surl).hexdigest()
+            checkpoint = tdatabase.get(checkpoint_id)
+            if checkpoint is None:
+                checkpoint = {'_id': checkpoint_id, 'source': surl}
+            result['skipped'] = checkpoint.get('source_seq') == seq
+
+        if not result['skipped']:
+            if client_side:
+                replicator.Replicator(source[sdb], tdatabase,
+                                      max_rate=max_rate).run()
+            elif continuous:
+                target.replicate(surl, tdb, continuous=continuous)
+            else:
+                target.replicate(surl, tdb)
+            if skip_up_to_date:
+                # Changes made to the source during replication may not have
+                # been replicated, so record the sequence read before
+                checkpoint['source_seq'] = seq
+                tdatabase.save(checkpoint)
+
+        result['docs'] = tdatabase.info()['doc_count']
+    except Exception, e:
+        result['error'] = e
+    result['duration'] = time.time() - start
+    return result
+
+def _status(result):
+    if result['error'] is not None:
+        return 'failed: %s' % (result['error'],)
+    status = result['skipped'] and 'up to date' or 'replicated'
+    if result['created']:
+        status = 'created, ' + status
+    return status
+
 def main():
 
     usage = '%prog [options] <source> <target>'
@@ -66,10 +129,35 @@ def main():
         action='store_true',
         dest='compact',
         help='compact target database after replication')
+    parser.add_option('--parallel',
+        action='store',
+        type='int',
+        dest='parallel',
+        default=1,
+        help='number of databases to replicate concurrently')
+    parser.add_option('--skip-up-to-date',
+        action='store_true',
+        dest='skip_up_to_date',
+        help='skip databases unchanged since they were last replicated')
+    parser.add_option('--client',
+        action='store_true',
+        dest='client_side',
+        help='replicate through this process instead of the target server')
+    parser.add_option('--max-rate',
+        action='store',
+        type='float',
+        dest='max_rate',
+        help='maximum number of documents per second to replicate with '
+             '--client')
 
     options, args = parser.parse_args()
     if len(args) != 2:
         raise parser.error('need source and target arguments')
+    if options.continuous and options.skip_up_to_date:
+        raise parser.error('--skip-up-to-date cannot be used with '
+                           '--continuous')
+    if options.continuous and options.client_side:
+        raise parser.error('--client cannot be used with --continuous')
 
     # set up server objects
 
@@ -90,35 +178,60 @@ def main():
     if not spath:
         raise parser.error('source database must be specified')
 
-    databases = [(i, i) for i in all if fnmatch.fnmatchcase(i, spath)]
+    databases = [(i, tpath or i) for i in all if fnmatch.fnmatchcase(i, spath)]
     if not databases:
         raise parser.error("no source databases match glob '%s'" % spath)
 
     # do the actual replication
 
-    for sdb, tdb in databases:
-
-        start = time.time()
-        print sdb, '->', tdb,
-        sys.stdout.flush()
-
-        if tdb not in target:
-            target.create(tdb)
-            print "created",
-            sys.stdout.flush()
-
-        sdb = '%s%s' % (sbase, urllib.quote(sdb, ''))
-        if options.continuous:
-            target.replicate(sdb, tdb, continuous=options.continuous)
-        else:
-            target.replicate(sdb, tdb)
-        print '%.1fs' % (time.time() - start)
+    def _replicate(dbs):
+        return replicate_db(source, target, sbase, dbs[0], dbs[1],
+                            continuous=options.continuous,
+                            skip_up_to_date=options.skip_up_to_date,
+                            client_side=options.client_side,
+                            max_rate=options.max_rate)
+
+    start = time.time()
+    if options.parallel > 1:
+        pool = util.WorkerPool(options.parallel)
+        results = pool.imap(_replicate, databases, window=len(databases))
+    else:
+        pool = None
+        results = (_replicate(dbs) for dbs in databases)
+
+    summary = []
+    for result in results:
+        print result['source'], '->', result['target'], _status(result),
+        print '%.1fs' % result['duration']
         sys.stdout.flush()
+        summary.append(result)
+    if pool is not None:
+        pool.close()
+        pool.join()
+
+    print
+    print '%-30s %-30s %10s %8s  %s' % ('source', 'target', 'docs', 'time',
+                                         'status')
+    for result in summary:
+        docs = result['docs']
+        if docs is None:
+            docs = '-'
+        print '%-30s %-30s %10s %7.1fs  %s' % (
+            result['source'], result['target'], docs, result['duration'],
+            _status(result))
+    failed = [result for result in summary if result['error'] is not None]
+    skipped = [result for result in summary if result['skipped']]
+    print '%d databases replicated, %d up to date, %d failed in %.1fs' % (
+        len(summary) - len(failed) - len(skipped), len(skipped), len(failed),
+        time.time() - start)
 
     if options.compact:
         for (sdb, tdb) in databases:
             print 'compact', tdb
             target[tdb].compact()
 
+    if failed:
+        sys.exit(1)
+
 if __name__ == '__main__':
     main()
@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution.
+
+"""Helpers for issuing CouchDB requests concurrently.
+
+All the client classes are safe to use from several threads at once, and
+threads sharing a `Session` also share its connection pool. A `WorkerPool`
+runs calls such as ``Database.get`` on a fixed number of threads and returns
+an `AsyncResult` for each of them:
+
+>>> pool = WorkerPool(4)
+>>> result = pool.submit(sum, [1, 2, 3])
+>>> result.get()
+6
+>>> list(pool.imap(abs, [-1, -2, -3]))
+[1, 2, 3]
+>>> pool.close()
+>>> pool.join()
+"""
+
+from collections import deque
+import sys
+try:
+    from threading import Event, Thread
+except ImportError:
+    from dummy_threading import Event, Thread
+from Queue import Queue
+
+__all__ = ['AsyncResult', 'WorkerPool']
+__docformat__ = 'restructuredtext en'
+
+
+class AsyncResult(object):
+    """The result of a call executed by a `WorkerPool`."""
+
+    def __init__(self):
+        self._event = Event()
+        self._value = self._exc_info = None
+
+    def ready(self):
+        """Return whether the call has completed."""
+        return self._event.isSet()
+
+    def get(self):
+        """Wait for the call to complete and return its return value, or
+        re-raise the exception it raised.
+        """
+        self._event.wait()
+        if self._exc_info is not None:
+            raise self._exc_info[0], self._exc_info[1], self._exc_info[2]
+        return self._value
+
+    def _set(self, value, exc_info=None):
+        self._value = value
+        self._exc_info = exc_info
+        self._event.set()
+
+
+class WorkerPool(object):
+    """A fixed number of daemon threads executing submitted calls.
+
+    :param size: the number of worker threads
+    :param max_pending: the maximum number of calls waiting for a worker, or
+                        `None` for no limit; `submit` blocks when the limit
+                        is reached
+    """
+
+    def __init__(self, size, max_pending=None):
+        if size < 1:
+            raise ValueError('pool size must be at least 1')
+        self.size = size
+        self._tasks = Queue(max_pending or 0)
+        self._threads = []
+        for idx in range(size):
+            thread = Thread(target=self._work)
+            thread.setDaemon(True)
+            thread.start()
+            self._threads.append(thread)
+
+    def submit(self, func, *args, **kwargs):
+        """Schedule a call of `func` with the given arguments.
+
+        :return: the `AsyncResult` of the call
+        :rtype: `AsyncResult`
+        """
+        result = AsyncResult()
+        self._tasks.put((func, args, kwargs, result))
+        return result
+
+    def imap(self, func, iterable, window=None):
+        """Call `func` for every item of `iterable` concurrently and yield the
+        return values in the order of the items.
+
+        At most `window` calls (by default twice the pool size) are scheduled
+        ahead of the value being yielded, so that `iterable` is consumed
+        lazily.
+        """
+        if window is None:
+            window = self.size * 2
+        pending = deque()
+        for item in iterable:
+            pending.append(self.submit(func, item))
+            if len(pending) >= window:
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
+
+    def close(self):
+        """Stop the worker threads once all submitted calls have completed."""
+        for thread in self._threads:
+            self._tasks.put(None)
+
+    def join(self):
+        """Wait for the worker threads to exit; `close` must have been called
+        before.
+        """
+        for thread in self._threads:
+            thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+        self.join()
+
+    def _work(self):
+        while True:
+            task = self._tasks.get()
+            if task is None:
+                break
+            func, args, kwargs, result = task
+            try:
+                value = func(*args, **kwargs)
+            except:
+                result._set(None, sys.exc_info())
+            else:
+                result._set(value)
@@ -9,13 +9,27 @@
 
 """Implementation of a view server for functions written in Python."""
 
+from base64 import b64decode, b64encode
 from codecs import BOM_UTF8
+import cProfile
+from hashlib import md5
 import logging
+import math
+import multiprocessing
 import os
+import select
+import signal
+import struct
 import sys
+import time
 import traceback
 from types import FunctionType
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 from couchdb import json
 
 __all__ = ['main', 'run']
@@ -24,21 +38,461 @@ __docformat__ = 'restructuredtext en'
 log = logging.getLogger('couchdb.view')
 
 
-def run(input=sys.stdin, output=sys.stdout):
+class _FunctionCache(object):
+    """The compiled code of functions keyed by their source code, evicting
+    the least recently used code once there are more than `max_entries`.
+    """
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.hits = self.misses = 0
+        self._entries = {} # source -> [last use, function]
+        self._clock = 0
+
+    def get(self, source):
+        self._clock += 1
+        entry = self._entries.get(source)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        entry[0] = self._clock
+        return entry[1]
+
+    def put(self, source, code):
+        self._entries[source] = [self._clock, code]
+        if len(self._entries) > self.max_entries:
+            oldest = min(self._entries.items(), key=lambda item: item[1][0])
+            del self._entries[oldest[0]]
+
+
+def _define(string, _log, error_id, example, cache=None):
+    """Return the function defined by the source code, or an error response.
+
+    Only the compiled code is taken from the `cache`: the function is defined
+    anew, so that it does not share any state, such as mutable default
+    arguments, with the functions defined before.
+    """
+    code = None
+    if cache is not None:
+        code = cache.get(string)
+    globals_ = {}
+    try:
+        if code is None:
+            code = compile(BOM_UTF8 + string.encode('utf-8'), '<string>',
+                           'exec')
+            if cache is not None:
+                cache.put(string, code)
+        exec code in {'log': _log}, globals_
+    except Exception, e:
+        return {'error': {
+            'id': error_id,
+            'reason': e.args[0]
+        }}
+    err = {'error': {
+        'id': error_id,
+        'reason': 'string must eval to a function (ex: "%s")' % example
+    }}
+    if len(globals_) != 1:
+        return err
+    function = globals_.values()[0]
+    if type(function) is not FunctionType:
+        return err
+    return function
+
+
+def _map(functions, doc, _log):
+    """Return the rows emitted by every function for the document."""
+    results = []
+    for function in functions:
+        try:
+            results.append([[key, value] for key, value in function(doc)])
+        except Exception, e:
+            log.error('runtime error in map function: %s', e, exc_info=True)
+            results.append([])
+            _log(traceback.format_exc())
+    return results
+
+
+def _encode(obj, ascii_output):
+    if ascii_output:
+        return json.encode_bytes(obj)
+    obj = json.encode(obj)
+    if isinstance(obj, unicode):
+        obj = obj.encode('utf-8')
+    return obj
+
+
+def _map_worker(conn, cache_size, ascii_output):
+    # Apply the map functions added to this worker to the documents of the
+    # map_doc commands received, sending back the log messages and the JSON
+    # encoded rows of every function
+    functions = []
+    cache = _FunctionCache(cache_size)
+    logged = [] # the messages of the function being applied
+
+    def _log(message):
+        if not isinstance(message, basestring):
+            message = json.encode(message)
+        logged.append(message)
+
+    while True:
+        line = conn.recv_bytes()
+        if not line:
+            break
+        cmd = json.decode(line)
+        if cmd[0] == 'map_doc':
+            messages, results = [], []
+            for function in functions:
+                rows = _map([function], cmd[1], _log)[0]
+                results.append(_encode(rows, ascii_output))
+                messages.append(logged[:])
+                del logged[:]
+            conn.send((messages, results))
+        elif cmd[0] == 'add_fun':
+            functions.append(_define(cmd[1], _log, 'map_compilation_error',
+                                     '', cache))
+        elif cmd[0] == 'reset':
+            del functions[:]
+
+
+class _MapWorkers(object):
+    """A pool of processes applying the map functions, which are distributed
+    over the processes so that every document is mapped by all of them
+    concurrently.
+    """
+
+    def __init__(self, size, cache_size, ascii_output):
+        self.conns = []
+        self.processes = []
+        for idx in range(size):
+            conn, child_conn = multiprocessing.Pipe()
+            process = multiprocessing.Process(target=_map_worker,
+                                              args=(child_conn, cache_size,
+                                                    ascii_output))
+            process.daemon = True
+            process.start()
+            self.conns.append(conn)
+            self.processes.append(process)
+        self.count = 0 # the number of functions added
+
+    def add_fun(self, string):
+        line = json.encode_bytes(['add_fun', string])
+        self.conns[self.count % len(self.conns)].send_bytes(line)
+        self.count += 1
+
+    def reset(self):
+        line = json.encode_bytes(['reset'])
+        for conn in self.conns:
+            conn.send_bytes(line)
+        self.count = 0
+
+    def map_doc(self, line):
+        """Return the log messages of the map functions and the JSON encoded
+        response.
+        """
+        conns = self.conns[:self.count]
+        for conn in conns:
+            conn.send_bytes(line)
+        replies = [conn.recv() for conn in conns]
+        # Function i has been added to worker i % size; the messages are
+        # returned in the order of the functions, as when mapping serially
+        size = len(self.conns)
+        messages, rows = [], []
+        for idx in range(self.count):
+            worker_messages, worker_results = replies[idx % size]
+            messages.extend(worker_messages[idx // size])
+            rows.append(worker_results[idx // size])
+        return messages, '[' + ', '.join(rows) + ']'
+
+    def close(self):
+        for conn in self.conns:
+            conn.send_bytes('')
+        for process in self.processes:
+            process.join()
+
+
+def _add(total, value):
+    # Add a number, list or object of numbers to the sum of _sum
+    if isinstance(value, (int, long, float)) and \
+            isinstance(total, (int, long, float)):
+        return total + value
+    if isinstance(value, dict) and isinstance(total, dict):
+        total = total.copy()
+        for name, item in value.items():
+            total[name] = _add(total.get(name, 0), item)
+        return total
+    if isinstance(value, (int, long, float)):
+        value = [value]
+    if isinstance(total, (int, long, float)):
+        total = [total]
+    if isinstance(value, list) and isinstance(total, list):
+        if len(value) > len(total):
+            total, value = value, total
+        return [_add(item, other) for item, other in
+                zip(total, value + [0] * (len(total) - len(value)))]
+    raise ValueError('the _sum function requires that map values be '
+                     'numbers, arrays of numbers or objects, not %s'
+                     % json.encode(value))
+
+
+def _builtin_sum(keys, values, rereduce):
+    try:
+        return sum(values)
+    except TypeError: # not all values are numbers
+        return reduce(_add, values, 0)
+
+
+def _builtin_count(keys, values, rereduce):
+    if rereduce:
+        return sum(values)
+    return len(values)
+
+
+def _number_stats(values):
+    if numpy is not None and len(values) >= 256:
+        array = numpy.asarray(values)
+        if array.dtype.kind == 'f':
+            return {'sum': float(array.sum()), 'count': len(values),
+                    'min': float(array.min()), 'max': float(array.max()),
+                    'sumsqr': float(numpy.dot(array, array))}
+    return {'sum': sum(values), 'count': len(values), 'min': min(values),
+            'max': max(values), 'sumsqr': sum([value * value
+                                               for value in values])}
+
+
+def _merge_stats(stats, other):
+    if stats is None:
+        return other
+    return {'sum': stats['sum'] + other['sum'],
+            'count': stats['count'] + other['count'],
+            'min': min(stats['min'], other['min']),
+            'max': max(stats['max'], other['max']),
+            'sumsqr': stats['sumsqr'] + other['sumsqr']}
+
+
+def _builtin_stats(keys, values, rereduce):
+    if values and isinstance(values[0], list):
+        for value in values:
+            if not isinstance(value, list) or len(value) != len(values[0]):
+                raise ValueError('the _stats function requires that map '
+                                 'values be all numbers or all arrays of '
+                                 'numbers of the same length, not %s'
+                                 % json.encode(value))
+        return [_builtin_stats(None, column, rereduce)
+                for column in zip(*values)]
+    if not rereduce:
+        try:
+            return _number_stats(values)
+        except (TypeError, ValueError): # precomputed statistics
+            pass
+    stats = None
+    for value in values:
+        if isinstance(value, (int, long, float)):
+            value = _number_stats([value])
+        elif not isinstance(value, dict) or \
+                set(value) != set(['sum', 'count', 'min', 'max', 'sumsqr']):
+            raise ValueError('the _stats function requires that map values '
+                             'be numbers or arrays of numbers, not %s'
+                             % json.encode(value))
+        stats = _merge_stats(stats, value)
+    if stats is None:
+        return {'sum': 0, 'count': 0, 'min': 0, 'max': 0, 'sumsqr': 0}
+    return stats
+
+
+_HLL_PRECISION = 11 # 2048 registers, a standard error of 2.3%
+
+
+def _hll_estimate(registers):
+    size = len(registers)
+    estimate = 0.7213 / (1 + 1.079 / size) * size * size / \
+               sum([2.0 ** -rank for rank in registers])
+    zeros = registers.count('\x00')
+    if estimate <= 2.5 * size and zeros:
+        estimate = size * math.log(float(size) / zeros)
+    return int(round(estimate))
+
+
+def _builtin_approx_count_distinct(keys, values, rereduce):
+    # A HyperLogLog sketch of the distinct keys; the registers are returned
+    # along with the estimate for use by rereduce
+    registers = bytearray(1 << _HLL_PRECISION)
+    if rereduce:
+        for value in values:
+            other = bytearray(b64decode(value['registers']))
+            for idx, rank in enumerate(other):
+                if rank > registers[idx]:
+                    registers[idx] = rank
+    else:
+        bits = 64 - _HLL_PRECISION
+        mask = (1 << bits) - 1
+        for key in keys:
+            digest = md5(json.encode_bytes(key[0])).digest()
+            value = struct.unpack('>Q', digest[:8])[0]
+            idx = value >> bits
+            rank = bits - len(bin(value & mask)) + 3
+            if rank > registers[idx]:
+                registers[idx] = rank
+    return {'count': _hll_estimate(registers),
+            'registers': b64encode(str(registers))}
+
+
+_BUILTIN_REDUCERS = {
+    '_sum': _builtin_sum,
+    '_count': _builtin_count,
+    '_stats': _builtin_stats,
+    '_approx_count_distinct': _builtin_approx_count_distinct,
+}
+
+
+class _Profile(object):
+    """Call counts and timings of the functions run by the view server,
+    written to a report file on request.
+    """
+
+    def __init__(self, path, stats_path=None):
+        self.path = path
+        self.stats_path = stats_path
+        self.started = time.time()
+        self.functions = {} # label -> [kind, calls, seconds, docs, rows]
+        self._labels = {}
+        self.profiler = None
+        if stats_path is not None:
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+
+    def _label(self, source):
+        label = self._labels.get(source)
+        if label is None:
+            lines = [line.strip() for line in source.splitlines()
+                     if line.strip()]
+            label = '%s [%s]' % (lines and lines[0][:60] or '',
+                                 md5(source.encode('utf-8')).hexdigest()[:8])
+            self._labels[source] = label
+        return label
+
+    def add(self, kind, source, seconds, docs, rows):
+        """Record a call of a function.
+
+        :param kind: either ``'map'`` or ``'reduce'``
+        :param source: the source code of the function
+        :param seconds: the time taken by the call
+        :param docs: the number of documents or values processed
+        :param rows: the number of rows emitted or values returned
+        """
+        label = self._label(source)
+        entry = self.functions.get(label)
+        if entry is None:
+            entry = self.functions[label] = [kind, 0, 0.0, 0, 0]
+        entry[1] += 1
+        entry[2] += seconds
+        entry[3] += docs
+        entry[4] += rows
+
+    def report(self):
+        """Write the report, and the profiler statistics if enabled."""
+        lines = ['View server profile after %.1fs\n' %
+                 (time.time() - self.started),
+                 '%-7s %9s %10s %9s %11s %10s  %s\n' %
+                 ('kind', 'calls', 'total s', 'ms/call', 'docs/s', 'rows',
+                  'function')]
+        entries = sorted(self.functions.items(),
+                         key=lambda item: item[1][2], reverse=True)
+        for label, (kind, calls, seconds, docs, rows) in entries:
+            rate = seconds and docs / seconds or 0
+            lines.append('%-7s %9d %10.3f %9.3f %11.1f %10d  %s\n' %
+                         (kind, calls, seconds, seconds * 1000 / calls, rate,
+                          rows, label))
+        fileobj = open(self.path, 'w')
+        try:
+            fileobj.write(''.join(lines).encode('utf-8'))
+        finally:
+            fileobj.close()
+        if self.profiler is not None:
+            # Dumping the statistics stops the profiler
+            self.profiler.dump_stats(self.stats_path)
+            self.profiler.enable()
+
+    def close(self):
+        self.report()
+        if self.profiler is not None:
+            self.profiler.disable()
+
+
+def run(input=sys.stdin, output=sys.stdout, cache_size=100,
+        ascii_output=False, workers=None, profile=None, profile_stats=None):
     r"""CouchDB view function handler implementation for Python.
 
+    Functions are compiled once and kept in a cache for later ``add_fun``
+    and ``reduce`` commands with the same source code, also after a
+    ``reset``.
+
+    The builtin ``_sum``, ``_count`` and ``_stats`` reduce functions are
+    supported like in CouchDB, as well as ``_approx_count_distinct``, which
+    estimates the number of distinct keys using a HyperLogLog sketch that is
+    returned as the ``registers`` item of the result, next to the ``count``.
+    ``_stats`` uses NumPy where available for large numbers of floats.
+
+    Responses are buffered, and only written and flushed to `output` once
+    no further command is waiting to be read from `input`, so that commands
+    sent without waiting for the responses (as when replaying a transcript)
+    do not cause one write per response.
+
     :param input: the readable file-like object to read input from
     :param output: the writable file-like object to write output to
+    :param cache_size: the maximum number of compiled functions to cache
+    :param ascii_output: whether to escape non-ASCII characters in the
+                         responses, which allows encoding them considerably
+                         faster with the ``simplejson`` and ``json`` modules
+    :param workers: if greater than 1, the number of processes to distribute
+                    the map functions over, so that the functions of a
+                    design document are applied to every document
+                    concurrently; worthwhile for CPU intensive functions
+    :param profile: the name of a file to write the number of calls, time
+                    taken, documents processed per second and rows emitted
+                    by every function to, when the view server exits or
+                    receives a ``SIGUSR1`` signal; with `workers`, the map
+                    functions are only reported as a whole
+    :param profile_stats: the name of a file to write the statistics of the
+                          ``cProfile`` module to along with the report
     """
     functions = []
+    sources = []
+    cache = _FunctionCache(cache_size)
+    buffered = []
+    try:
+        fileno = input.fileno()
+    except AttributeError:
+        fileno = None
+    if sys.platform == 'win32': # select() only supports sockets
+        fileno = None
+
+    pool = None
+    if workers is not None and workers > 1:
+        pool = _MapWorkers(workers, cache_size, ascii_output)
+
+    prof = None
+    if profile is not None:
+        prof = _Profile(profile, profile_stats)
+        if hasattr(signal, 'SIGUSR1'):
+            # Reading the next command is resumed after the report is written
+            handler = signal.signal(signal.SIGUSR1,
+                                    lambda signum, frame: prof.report())
 
     def _writejson(obj):
-        obj = json.encode(obj)
-        if isinstance(obj, unicode):
-            obj = obj.encode('utf-8')
-        output.write(obj)
-        output.write('\n')
+        buffered.append(_encode(obj, ascii_output))
+        buffered.append('\n')
+
+    def _flush():
+        output.write(''.join(buffered))
         output.flush()
+        del buffered[:]
+
+    def _input_pending():
+        if fileno is None:
+            return False
+        return bool(select.select([fileno], [], [], 0)[0])
 
     def _log(message):
         if not isinstance(message, basestring):
@@ -47,66 +501,49 @@ def run(input=sys.stdin, output=sys.stdout):
 
     def reset(config=None):
         del functions[:]
+        del sources[:]
+        if pool is not None:
+            pool.reset()
+        log.debug('Function cache: %d hits, %d misses', cache.hits,
+                  cache.misses)
         return True
 
     def add_fun(string):
-        string = BOM_UTF8 + string.encode('utf-8')
-        globals_ = {}
-        try:
-            exec string in {'log': _log}, globals_
-        except Exception, e:
-            return {'error': {
-                'id': 'map_compilation_error',
-                'reason': e.args[0]
-            }}
-        err = {'error': {
-            'id': 'map_compilation_error',
-            'reason': 'string must eval to a function '
-                      '(ex: "def(doc): return 1")'
-        }}
-        if len(globals_) != 1:
-            return err
-        function = globals_.values()[0]
+        function = _define(string, _log, 'map_compilation_error',
+                           'def(doc): return 1', cache)
         if type(function) is not FunctionType:
-            return err
-        functions.append(function)
+            return function
+        if pool is not None:
+            pool.add_fun(string)
+        else:
+            functions.append(function)
+            sources.append(string)
         return True
 
     def map_doc(doc):
+        if prof is None:
+            return _map(functions, doc, _log)
         results = []
-        for function in functions:
-            try:
-                results.append([[key, value] for key, value in function(doc)])
-            except Exception, e:
-                log.error('runtime error in map function: %s', e,
-                          exc_info=True)
-                results.append([])
-                _log(traceback.format_exc())
+        for function, source in zip(functions, sources):
+            started = time.time()
+            rows = _map([function], doc, _log)[0]
+            prof.add('map', source, time.time() - started, 1, len(rows))
+            results.append(rows)
         return results
 
     def reduce(*cmd, **kwargs):
-        code = BOM_UTF8 + cmd[0][0].encode('utf-8')
         args = cmd[1]
-        globals_ = {}
-        try:
-            exec code in {'log': _log}, globals_
-        except Exception, e:
-            log.error('runtime error in reduce function: %s', e,
-                      exc_info=True)
-            return {'error': {
-                'id': 'reduce_compilation_error',
-                'reason': e.args[0]
-            }}
-        err = {'error': {
-            'id': 'reduce_compilation_error',
-            'reason': 'string must eval to a function '
-                      '(ex: "def(keys, values): return 1")'
-        }}
-        if len(globals_) != 1:
-            return err
-        function = globals_.values()[0]
-        if type(function) is not FunctionType:
-            return err
+        reducers = []
+        for source in cmd[0]:
+            function = _BUILTIN_REDUCERS.get(source.strip())
+            if function is None:
+                function = _define(source, _log, 'reduce_compilation_error',
+                                   'def(keys, values): return 1', cache)
+            if type(function) is not FunctionType:
+                log.error('compilation error in reduce function: %s',
+                          function['error']['reason'])
+                return function
+            reducers.append(function)
 
         rereduce = kwargs.get('rereduce', False)
         results = []
@@ -118,16 +555,31 @@ def run(input=sys.stdin, output=sys.stdout):
                 keys, vals = zip(*args)
             else:
                 keys, vals = [], []
-        if function.func_code.co_argcount == 3:
-            results = function(keys, vals, rereduce)
-        else:
-            results = function(keys, vals)
-        return [True, [results]]
+        for function, source in zip(reducers, cmd[0]):
+            if prof is not None:
+                started = time.time()
+            if function.func_code.co_argcount == 3:
+                try:
+                    results.append(function(keys, vals, rereduce))
+                except ValueError, e:
+                    if function not in _BUILTIN_REDUCERS.values():
+                        raise
+                    return {'error': {
+                        'id': 'builtin_reduce_error',
+                        'reason': e.args[0]
+                    }}
+            else:
+                results.append(function(keys, vals))
+            if prof is not None:
+                prof.add(rereduce and 'rereduce' or 'reduce', source,
+                         time.time() - started, len(vals), 1)
+        return [True, results]
 
     def rereduce(*cmd):
         # Note: weird kwargs is for Python 2.5 compat
         return reduce(*cmd, **{'rereduce': True})
 
+    debug = log.isEnabledFor(logging.DEBUG)
     handlers = {'reset': reset, 'add_fun': add_fun, 'map_doc': map_doc,
                 'reduce': reduce, 'rereduce': rereduce}
 
@@ -138,19 +590,49 @@ def run(input=sys.stdin, output=sys.stdout):
                 break
             try:
                 cmd = json.decode(line)
-                log.debug('Processing %r', cmd)
+                if debug:
+                    log.debug('Processing %r', cmd)
             except ValueError, e:
                 log.error('Error: %s', e, exc_info=True)
                 return 1
             else:
-                retval = handlers[cmd[0]](*cmd[1:])
-                log.debug('Returning  %r', retval)
-                _writejson(retval)
+                if pool is not None and cmd[0] == 'map_doc':
+                    # The workers decode the document themselves and return
+                    # the encoded rows
+                    if prof is not None:
+                        started = time.time()
+                    messages, response = pool.map_doc(line)
+                    if prof is not None:
+                        prof.add('map', '(%d map functions in %d workers)' %
+                                 (pool.count, workers),
+                                 time.time() - started, 1, 0)
+                    for message in messages:
+                        _writejson({'log': message})
+                    if debug:
+                        log.debug('Returning  %s', response)
+                    buffered.append(response)
+                    buffered.append('\n')
+                else:
+                    retval = handlers[cmd[0]](*cmd[1:])
+                    if debug:
+                        log.debug('Returning  %r', retval)
+                    _writejson(retval)
+                if not _input_pending():
+                    _flush()
     except KeyboardInterrupt:
         return 0
     except Exception, e:
         log.error('Error: %s', e, exc_info=True)
         return 1
+    finally:
+        if buffered:
+            _flush()
+        if pool is not None:
+            pool.close()
+        if prof is not None:
+            if hasattr(signal, 'SIGUSR1'):
+                signal.signal(signal.SIGUSR1, handler)
+            prof.close()
 
 
 _VERSION = """%(name)s - CouchDB Python %(version)s
@@ -169,7 +651,16 @@ Options:
   --version             display version information and exit
   -h, --help            display a short help message and exit
   --json-module=<name>  set the JSON module to use ('simplejson', 'cjson',
-                        or 'json' are supported)
+                        'json' or 'ujson' are supported)
+  --ascii-output        escape non-ASCII characters in responses, which is
+                        faster with the 'simplejson' and 'json' modules
+  --workers=<n>         distribute the map functions over this many
+                        processes
+  --profile=<file>      write the call counts and timings of the functions
+                        to this file on exit or when receiving SIGUSR1
+  --profile-stats=<file>
+                        also write cProfile statistics to this file;
+                        requires --profile to be specified
   --log-file=<file>     name of the file to write log messages to, or '-' to
                         enable logging to the standard error stream
   --debug               enable debug logging; requires --log-file to be
@@ -187,10 +678,12 @@ def main():
     try:
         option_list, argument_list = getopt.gnu_getopt(
             sys.argv[1:], 'h',
-            ['version', 'help', 'json-module=', 'debug', 'log-file=']
+            ['version', 'help', 'json-module=', 'debug', 'log-file=',
+             'ascii-output', 'workers=', 'profile=', 'profile-stats=']
         )
 
         message = None
+        options = {}
         for option, value in option_list:
             if option in ('--version'):
                 message = _VERSION % dict(name=os.path.basename(sys.argv[0]),
@@ -199,6 +692,14 @@ def main():
                 message = _HELP % dict(name=os.path.basename(sys.argv[0]))
             elif option in ('--json-module'):
                 json.use(module=value)
+            elif option in ('--ascii-output'):
+                options['ascii_output'] = True
+            elif option in ('--workers'):
+                options['workers'] = int(value)
+            elif option in ('--profile'):
+                options['profile'] = value
+            elif option in ('--profile-stats'):
+                options['profile_stats'] = value
             elif option in ('--debug'):
                 log.setLevel(logging.DEBUG)
             elif option in ('--log-file'):
@@ -226,7 +727,7 @@ def main():
         sys.stderr.flush()
         sys.exit(1)
 
-    sys.exit(run())
+    sys.exit(run(**options))
 
 
 if __name__ == '__main__':
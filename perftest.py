@@ -2,10 +2,14 @@
 Simple peformance tests.
 """
 
+from StringIO import StringIO
+import os
 import sys
+import tempfile
 import time
 
 import couchdb
+from couchdb import http, json, view
 
 
 def main():
@@ -13,7 +17,9 @@ def main():
     print 'sys.version : %r' % (sys.version,)
     print 'sys.platform : %r' % (sys.platform,)
 
-    tests = [create_doc, create_bulk_docs]
+    tests = [create_doc, create_bulk_docs, create_bulk_writer,
+             frame_changes_lines, read_changes_feed, json_backends,
+             view_server]
     if len(sys.argv) > 1:
         tests = [test for test in tests if test.__name__ in sys.argv[1:]]
 
@@ -56,5 +62,119 @@ def create_bulk_docs(db):
         db.update([{'_id': unicode((i * batch_size) + j)} for j in range(batch_size)])
 
 
+def create_bulk_writer(db):
+    """Create lots of docs, one at a time, using a threaded bulk writer"""
+    writer = db.bulk_writer(batch_size=100, workers=4)
+    for i in range(100000):
+        writer.add({'_id': unicode(i)})
+    writer.close()
+
+
+def frame_changes_lines(db):
+    """Frame the lines of a high-rate chunked changes feed"""
+    line = json.encode({'seq': 12345, 'id': 'a' * 32,
+                        'changes': [{'rev': '1-' + 'b' * 32}]}) + '\n'
+    data = line * 500000
+    # Use chunks of a size that does not align with the lines
+    chunk_size = 8000
+    chunks = ['%x\r\n%s\r\n' % (len(data[i:i + chunk_size]),
+                                    data[i:i + chunk_size])
+              for i in range(0, len(data), chunk_size)]
+
+    class ChunkedResponse(object):
+        msg = {'transfer-encoding': 'chunked'}
+        fp = StringIO(''.join(chunks) + '0\r\n\r\n')
+        closed = False
+        def isclosed(self):
+            return self.closed
+        def close(self):
+            self.closed = True
+
+    body = http.ResponseBody(ChunkedResponse(), lambda: None)
+    for ln in body.iterlines():
+        pass
+
+
+def read_changes_feed(db):
+    """Create lots of docs and read them from the continuous changes feed"""
+    for i in range(100):
+        db.update([{'_id': unicode((i * 1000) + j)} for j in range(1000)])
+    for change in db.changes(feed='continuous', timeout=0):
+        pass
+
+
+def json_backends(db):
+    """Encode and decode documents with every available JSON module"""
+    docs = [{
+        '_id': '%032x' % i, '_rev': '3-%032x' % (i * 7),
+        'type': 'Person', 'name': u'J\xf6rg Doe %d' % i, 'age': i % 90,
+        'score': i / 7.0, 'active': i % 2 == 0, 'tags': ['a', 'b', 'c'],
+        'address': {'street': 'Main Street %d' % i, 'city': u'M\xfcnchen'},
+        'history': [{'ts': 1234567890 + j, 'action': 'login'}
+                    for j in range(10)],
+    } for i in range(2000)]
+    using = json._using
+    sys.stdout.write('\n')
+    try:
+        for name in sorted(json._backends):
+            try:
+                json.use(name)
+            except ImportError:
+                continue
+            timings = []
+            for func, items in [(json.encode, docs),
+                                (json.encode_bytes, docs),
+                                (json.decode, map(json.encode_bytes, docs))]:
+                start = time.time()
+                for item in items:
+                    func(item)
+                timings.append(time.time() - start)
+            sys.stdout.write('    %-10s encode %0.3fs, encode_bytes %0.3fs, '
+                             'decode %0.3fs\n' % tuple([name] + timings))
+    finally:
+        json.use(using)
+
+
+def view_server(db):
+    """Replay a view server transcript"""
+    # A transcript recorded from CouchDB, e.g. by configuring a script that
+    # runs `tee transcript.txt | couchpy` as the query server, can be
+    # replayed instead by setting the VIEW_TRANSCRIPT environment variable
+    path = os.environ.get('VIEW_TRANSCRIPT')
+    if path is None:
+        fd, path = tempfile.mkstemp()
+        transcript = os.fdopen(fd, 'w')
+        try:
+            transcript.write(json.encode_bytes(['reset']) + '\n')
+            for source in ['def fun(doc): yield doc["type"], 1',
+                           'def fun(doc):\n'
+                           '    for tag in doc["tags"]:\n'
+                           '        yield [tag, doc["name"]], doc["age"]']:
+                transcript.write(json.encode_bytes(['add_fun', source]) + '\n')
+            for i in range(20000):
+                doc = {'_id': '%032x' % i, '_rev': '1-%032x' % i,
+                       'type': 'Person', 'name': u'J\xf6rg %d' % i,
+                       'age': i % 90, 'tags': ['a', 'b', 'c']}
+                transcript.write(json.encode_bytes(['map_doc', doc]) + '\n')
+            for i in range(2000):
+                transcript.write(json.encode_bytes([
+                    'reduce', ['def fun(keys, values): return sum(values)'],
+                    [[[j, '%032x' % j], j] for j in range(50)]
+                ]) + '\n')
+        finally:
+            transcript.close()
+    try:
+        input = open(path)
+        output = open(os.devnull, 'w')
+        try:
+            view.run(input=input, output=output)
+        finally:
+            input.close()
+            output.close()
+    finally:
+        if 'VIEW_TRANSCRIPT' not in os.environ:
+            os.remove(path)
+
+
 if __name__ == '__main__':
     main()